@@ -0,0 +1,48 @@
+import os
+import hmac
+import asyncio
+import logging
+from typing import Annotated
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from core.config import settings
+from core.profiling import stack_sampler
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+logger = logging.getLogger("imghost")
+
+
+def require_admin(authorization: Annotated[str | None, Header()] = None) -> None:
+    # without a configured token the admin routes don't exist as far as clients can tell
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@router.get("/profile", dependencies=[Depends(require_admin)])
+async def capture_profile(
+    seconds: Annotated[float, Query(gt=0)] = 10.0,
+    interval_ms: Annotated[float, Query(ge=1, le=1000)] = 10.0,
+):
+    # samples the worker process that serves this request, as collapsed stacks for flamegraph.pl/speedscope
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {settings.PROFILE_MAX_SECONDS:g}")
+
+    pid = os.getpid()
+    logger.info(f"Capturing {seconds:g}s stack profile of worker {pid}")
+    profile = await asyncio.to_thread(stack_sampler.capture, seconds, interval_ms / 1000)
+    if profile is None:
+        raise HTTPException(status_code=409, detail="A profile is already being captured in this worker")
+
+    return Response(
+        content=profile.collapsed(),
+        media_type="text/plain; charset=utf-8",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{pid}.folded"',
+            "X-Profile-Pid": str(pid),
+            "X-Profile-Samples": str(profile.samples),
+            "X-Profile-Duration": f"{profile.duration:.3f}",
+            "X-Profile-Sampling-Seconds": f"{profile.sampling_seconds:.3f}",
+        },
+    )
@@ -0,0 +1,164 @@
+import re
+import hashlib
+import logging
+from typing import Annotated, AsyncIterator, Optional, Tuple
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from db.session import get_db
+from models.image import Image, live_since
+from services.storage import ObjectStream, storage_service
+from services.cache import object_cache, object_cache_key
+from services.processing import thumbnail_url, variant_url
+from core.config import settings
+
+router = APIRouter(tags=["serve"])
+logger = logging.getLogger("imghost")
+
+# unprocessed images get replaced in place soon, keep caches from holding the original for long
+UNPROCESSED_MAX_AGE = 60
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # single byte range only, anything else is served in full. Raises 416 when unsatisfiable
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start_s, end_s = match.groups()
+    if not start_s and not end_s:
+        return None
+    if not start_s:
+        length = int(end_s)
+        if length == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(start_s)
+    end = min(int(end_s), size - 1) if end_s else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+async def live_image(db: AsyncSession, filename: str, now: datetime) -> Image:
+    result = await db.execute(
+        select(Image).where(
+            Image.filename == filename,
+            Image.deleted_at.is_(None),
+            Image.uploaded_at >= live_since(now),
+        )
+    )
+    image = result.scalars().first()
+    if image is None or image.expires_at <= now:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image
+
+
+@router.get("/i/{filename}/status")
+async def image_status(
+    filename: str,
+    response: Response,
+    db: Annotated[AsyncSession, Depends(get_db)],
+):
+    # what an upload response leaves out while processing runs: whether it's done, and the variants it made
+    image = await live_image(db, filename, datetime.now(timezone.utc))
+    status = {
+        "url": f"{settings.PUBLIC_BASE_URL}/i/{image.filename}",
+        "is_processed": image.is_processed,
+        "size": image.size_bytes,
+        "mime_type": image.mime_type,
+        "expires_at": image.expires_at.isoformat(),
+    }
+    if image.variants:
+        status["thumbnail_url"] = thumbnail_url(image.filename, image.variants)
+        status["variants"] = {name: variant_url(image.filename, name) for name in image.variants}
+    response.headers["Cache-Control"] = "no-cache" if not image.is_processed else "public, max-age=60"
+    return status
+
+
+@router.api_route("/i/{key}", methods=["GET", "HEAD"])
+async def serve_image(
+    key: str,
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_db)],
+):
+    filename, _, variant = key.partition("_")
+    now = datetime.now(timezone.utc)
+    image = await live_image(db, filename, now)
+
+    if variant:
+        object_key = (image.variants or {}).get(variant)
+        if not object_key:
+            raise HTTPException(status_code=404, detail="Image not found")
+        size, mime_type = None, "image/webp"
+    else:
+        object_key = image.object_url.removeprefix("s3://")
+        size, mime_type = image.size_bytes, image.mime_type
+
+    cache_key = object_cache_key(object_key, size, mime_type)
+    etag = '"' + hashlib.sha1(cache_key.encode()).hexdigest()[:20] + '"'
+    remaining = max(int((image.expires_at - now).total_seconds()), 0)
+    max_age = remaining if (image.is_processed or variant) else min(remaining, UNPROCESSED_MAX_AGE)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}",
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    ranged = bool(range_header) and (not if_range or if_range.strip() == etag)
+
+    data = await object_cache.get(cache_key)
+    if data is not None:
+        byte_range = parse_range(range_header, len(data)) if ranged else None
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(content=data[start:end + 1], status_code=206, media_type=mime_type, headers=headers)
+        return Response(content=data, media_type=mime_type, headers=headers)
+
+    # variants' sizes aren't stored, a ranged request for one learns it from a first GET
+    byte_range = parse_range(range_header, size) if ranged and size is not None else None
+    stream = await storage_service.open_stream(object_key, byte_range)
+    if ranged and size is None:
+        try:
+            byte_range = parse_range(range_header, stream.total)
+        except HTTPException:
+            stream.close()
+            raise
+        if byte_range is not None:
+            stream.close()
+            stream = await storage_service.open_stream(object_key, byte_range)
+
+    headers["Content-Length"] = str(stream.length)
+    if request.method == "HEAD":
+        stream.close()
+        return Response(status_code=206 if byte_range else 200, media_type=mime_type, headers=headers)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{stream.total}"
+        return StreamingResponse(stream.chunks(), status_code=206, media_type=mime_type, headers=headers)
+    body = stream.chunks() if not object_cache.fits(stream.length) else fill_cache(stream, cache_key)
+    return StreamingResponse(body, media_type=mime_type, headers=headers)
+
+
+async def fill_cache(stream: ObjectStream, cache_key: str) -> AsyncIterator[bytes]:
+    # passes the object through and caches it once all of it went out; a client that disconnects
+    # part way leaves nothing behind
+    chunks = []
+    async for chunk in stream.chunks():
+        chunks.append(chunk)
+        yield chunk
+    await object_cache.put(cache_key, b"".join(chunks))
@@ -1,19 +1,30 @@
 import uuid
-import magic
 import logging
 import tempfile
 import os
-from typing import List, Annotated
+import io
+import asyncio
+import hashlib
+from typing import List, Annotated, Tuple
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, status, BackgroundTasks, Request, Form
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import insert, func, null
 from datetime import datetime, timezone, timedelta
 from db.session import limiter, get_db, custom_key_func
 from core.config import settings
 from models.image import Image
 from services.storage import storage_service
-from services.processing import process_image_and_update_db
-from core.monitoring import UPLOAD_COUNT, ERROR_COUNT 
+from services.processing import (
+    process_image_and_update_db, apply_processing_result, process_source, reduction_percent, store_variants,
+    thumbnail_url, variant_url, status_url, observe_processed, MIN_REDUCTION_PCT
+)
+from services.sniff import ImageInfo, detect_mime, probe, HEAD_BYTES, MAX_HEAD_BYTES
+from services.dedup import Duplicate, find_duplicate, register_objects, take_references
+from services.executor import processing_executor
+from services.quota import upload_quota
+from services.expiry import expiry_scheduler
+from services.cache import object_cache, object_cache_key
+from core.monitoring import UPLOAD_COUNT, ERROR_COUNT, BYTES_IN, stage, timed_stage
 
 router = APIRouter()
 logger = logging.getLogger("imghost")
@@ -22,22 +33,320 @@ MAX_FILE_SIZE = 15 * 1024 * 1024
 MAX_GIF_SIZE = 25 * 1024 * 1024
 MAX_TOTAL_SIZE = 50 * 1024 * 1024
 MAX_FILES = 15
-MAX_IMAGES_PER_HOUR = 50  
+STREAM_CHUNK_SIZE = 1024 * 1024
 ALLOWED_MIME_TYPES = ["image/jpeg", "image/png", "image/webp", "image/heic", "image/heif", "image/gif"]
 
 
-async def validate_file(file: UploadFile) -> str:
-            
-    head = await file.read(2048)
-    mime_type = magic.Magic(mime=True).from_buffer(head)
-    await file.seek(0)
+@timed_stage("sniff")
+async def validate_file(file: UploadFile) -> Tuple[str, ImageInfo]:
+    # reads only as far as the container headers, so oversized images are turned away before anything
+    # is spooled, uploaded or recorded
+    head = await file.read(HEAD_BYTES)
+    mime_type = detect_mime(head)
     
     if mime_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(
             status_code=415,
             detail=f"File '{file.filename}' has invalid type: {mime_type}. Allowed: JPEG, PNG, WEBP, HEIC/HEIF, GIF"
         )  
-    return mime_type
+    
+    info = probe(head)
+    while info is None and len(head) < MAX_HEAD_BYTES:
+        more = await file.read(len(head))
+        if not more:
+            break
+        head += more
+        info = probe(head)
+    await file.seek(0)
+    
+    if info is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"File '{file.filename}' is not a readable {mime_type} image"
+        )
+    if info.pixels > settings.MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File '{file.filename}' is {'up to ' if not info.exact else ''}{info.width}x{info.height} pixels (Max {settings.MAX_IMAGE_PIXELS / 1e6:g} megapixels)"
+        )
+    return mime_type, info
+
+
+def read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def remove_tmp(tmp_path: str | None) -> None:
+    if tmp_path and os.path.exists(tmp_path):
+        try:
+            os.unlink(tmp_path)
+        except Exception as e:
+            logger.error(f"Failed to delete temp file {tmp_path}: {e}")
+
+
+async def process_tmp(image_id: uuid.UUID, source: bytes | str, tmp_path: str | None, filename: str, original_mime: str, info: ImageInfo | None = None):
+    try:
+        await process_image_and_update_db(image_id, source, filename, original_mime, info)
+    except Exception as e:
+        logger.error(f"Background processing failed for {filename}: {e}", exc_info=True)
+    finally:
+        remove_tmp(tmp_path)
+
+
+async def finish_pending(image_id: uuid.UUID, job: asyncio.Future, tmp_path: str, filename: str):
+    # the inline job overran its budget, the original is already stored so finish it the two-phase way
+    try:
+        await apply_processing_result(image_id, filename, await job)
+    except Exception as e:
+        logger.error(f"Background processing failed for {filename}: {e}", exc_info=True)
+    finally:
+        remove_tmp(tmp_path)
+
+
+def duplicate_item(filename: str, duplicate: Duplicate, original_mime: str) -> dict:
+    # same bytes are already stored: no PUT and no processing, the row just points at the existing object
+    return {
+        "filename": filename,
+        "object_key": duplicate.object_key,
+        "content_hash": duplicate.content_hash,
+        "duplicate": True,
+        "tmp_path": None,
+        "source": None,
+        "size": duplicate.size_bytes,
+        "mime_type": duplicate.mime_type,
+        "original_mime": original_mime,
+        "info": None,
+        "is_processed": True,
+        "pending_job": None,
+        "variants": duplicate.variants,
+    }
+
+
+async def stage_file(file: UploadFile, staged_keys: list[str]) -> dict:
+    # sniff, spool, optionally process and store one file. staged_keys gets the key before the PUT starts,
+    # so a cancelled or failed batch can delete whatever made it to storage
+    tmp_path = None
+    pending_job = None
+    writer = None
+    new_filename = str(uuid.uuid4())
+    try:
+        mime_type, info = await validate_file(file)
+        
+        per_file_limit = MAX_GIF_SIZE if mime_type == "image/gif" else MAX_FILE_SIZE
+        needs_processing = mime_type != "image/gif" or settings.TRANSCODE_GIFS
+        # animations and very large images take too long for the inline budget, they always go through background processing
+        process_inline = (
+            settings.SINGLE_PUT_UPLOADS
+            and mime_type != "image/gif"
+            and not info.animated
+            and info.pixels <= settings.INLINE_MAX_PIXELS
+        )
+        # queue workers read the stored original back, so nothing is kept locally for them
+        process_locally = settings.PROCESSING_MODE != "queue"
+        
+        if settings.STREAMING_UPLOADS and not process_inline:
+            # parts go to storage as they are read. Processing gets a copy spooled to disk only if it needs one:
+            # held in memory that would be up to 50MB per GIF for as long as the background job waits
+            tee = tempfile.NamedTemporaryFile(delete=False) if needs_processing and process_locally else None
+            if tee is not None:
+                tmp_path = tee.name
+            digest = hashlib.sha256()
+            staged_keys.append(new_filename)
+            writer = storage_service.multipart_writer(new_filename, mime_type)
+            with stage("stream"):
+                try:
+                    while True:
+                        chunk = await file.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if writer.size + len(chunk) > per_file_limit:
+                            raise HTTPException(status_code=413, detail=f"File '{file.filename}' is too large (Max 15MB per file and Max 50MB for GIF)")
+                        await writer.write(chunk)
+                        digest.update(chunk)
+                        if tee is not None:
+                            tee.write(chunk)
+                finally:
+                    if tee is not None:
+                        tee.close()
+            BYTES_IN.observe(writer.size)
+            content_hash = digest.hexdigest()
+            if settings.DEDUP_UPLOADS:
+                duplicate = await find_duplicate(content_hash)
+                if duplicate is not None:
+                    await writer.abort()
+                    writer = None
+                    remove_tmp(tmp_path)
+                    return duplicate_item(new_filename, duplicate, mime_type)
+            await writer.complete()
+            file_size = writer.size
+            writer = None
+            if tmp_path is not None and settings.ORIGIN_CACHE_WARM_ON_UPLOAD:
+                data = await asyncio.to_thread(read_file, tmp_path)
+                await object_cache.put(object_cache_key(new_filename, file_size, mime_type), data)
+                del data
+            
+            return {
+                "filename": new_filename,
+                "object_key": new_filename,
+                "content_hash": content_hash,
+                "duplicate": False,
+                "tmp_path": tmp_path,
+                "source": tmp_path,
+                "size": file_size,
+                "mime_type": mime_type,
+                "original_mime": mime_type,
+                "info": info,
+                "is_processed": False,
+                "pending_job": None,
+                "variants": {},
+            }
+        
+        with stage("spool"), tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp_path = tmp.name
+            written = 0
+            digest = hashlib.sha256()
+            while True:
+                chunk = await file.read(8192)
+                if not chunk:
+                    break
+                tmp.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+                if written > per_file_limit:
+                    raise HTTPException(status_code=413, detail=f"File '{file.filename}' is too large (Max 15MB per file and Max 50MB for GIF)")
+            tmp.flush()
+        BYTES_IN.observe(written)
+        
+        content_hash = digest.hexdigest()
+        if settings.DEDUP_UPLOADS:
+            duplicate = await find_duplicate(content_hash)
+            if duplicate is not None:
+                remove_tmp(tmp_path)
+                return duplicate_item(new_filename, duplicate, mime_type)
+            
+        file_size = os.path.getsize(tmp_path)
+        stored_mime = mime_type
+        stored = False
+        is_processed = False
+        variant_keys: dict[str, str] = {}
+        
+        if process_inline:
+            job = asyncio.ensure_future(processing_executor.run(process_source, tmp_path, info))
+            # owned by the except branch below until it's known to have finished
+            pending_job = job
+            done, _ = await asyncio.wait({job}, timeout=settings.INLINE_PROCESSING_BUDGET)
+            if job in done:
+                pending_job = None
+                is_processed = True
+                try:
+                    processed = job.result()
+                except Exception as e:
+                    logger.error(f"Inline processing failed for {new_filename}, storing original: {e}")
+                else:
+                    variant_keys = await store_variants(new_filename, processed.variants, staged_keys)
+                    keep = reduction_percent(file_size, len(processed.data)) >= MIN_REDUCTION_PCT
+                    observe_processed(processed, len(processed.data) if keep else file_size)
+                    if keep:
+                        staged_keys.append(new_filename)
+                        await storage_service.upload_file(io.BytesIO(processed.data), new_filename, processed.mime_type)
+                        file_size = len(processed.data)
+                        stored_mime = processed.mime_type
+                        stored = True
+                        if settings.ORIGIN_CACHE_WARM_ON_UPLOAD:
+                            await object_cache.put(object_cache_key(new_filename, file_size, stored_mime), processed.data)
+            else:
+                logger.info(f"Inline processing over budget for {new_filename}, storing original")
+        
+        if not stored:
+            staged_keys.append(new_filename)
+            if settings.ORIGIN_CACHE_WARM_ON_UPLOAD:
+                # fresh uploads are the hottest objects, read once and hand the same bytes to storage and the cache
+                data = await asyncio.to_thread(read_file, tmp_path)
+                await storage_service.upload_file(io.BytesIO(data), new_filename, mime_type)
+                await object_cache.put(object_cache_key(new_filename, file_size, mime_type), data)
+                del data
+            else:
+                with open(tmp_path, 'rb') as fh:
+                    await storage_service.upload_file(fh, new_filename, mime_type)
+        
+        if is_processed or (pending_job is None and not process_locally):
+            remove_tmp(tmp_path)
+            tmp_path = None
+        
+        return {
+            "filename": new_filename,
+            "object_key": new_filename,
+            "content_hash": content_hash,
+            "duplicate": False,
+            "tmp_path": tmp_path,
+            "source": tmp_path,
+            "size": file_size,
+            "mime_type": stored_mime,
+            "original_mime": mime_type,
+            "info": info,
+            "is_processed": is_processed,
+            "pending_job": pending_job,
+            "variants": variant_keys,
+        }
+    except BaseException:
+        if pending_job is not None:
+            # the job reads tmp_path, wait for it to let go before removing the file
+            pending_job.cancel()
+            await asyncio.gather(pending_job, return_exceptions=True)
+        if writer is not None:
+            await writer.abort()
+        remove_tmp(tmp_path)
+        raise
+
+
+async def discard_staged(staged: list[dict], staged_keys: list[str]) -> None:
+    for item in staged:
+        if item["pending_job"] is not None:
+            item["pending_job"].cancel()
+            await asyncio.gather(item["pending_job"], return_exceptions=True)
+        remove_tmp(item["tmp_path"])
+    
+    async def delete_one(key: str):
+        try:
+            await storage_service.delete_file(key)
+        except Exception as e:
+            logger.error(f"Failed to delete staged object {key}: {e}")
+    
+    # duplicates point at someone else's object and hold no reference until the insert commits
+    await asyncio.gather(*(delete_one(key) for key in list(staged_keys)))
+
+
+async def insert_images(db: AsyncSession, staged: list[dict], ip_addr: str, expires_at: datetime) -> dict:
+    # one multi-row INSERT ... RETURNING for the whole batch, plus the dedup references and registrations in
+    # the same transaction. Caller commits
+    duplicates = [item["content_hash"] for item in staged if item["duplicate"]]
+    if duplicates and set(duplicates) - await take_references(db, duplicates):
+        # the last row sharing that object expired since the lookup, its bytes are gone
+        raise HTTPException(status_code=503, detail="An uploaded file's stored copy expired during the upload, please retry")
+    registered = set()
+    if settings.DEDUP_UPLOADS:
+        registered = await register_objects(db, [(item["content_hash"], item["object_key"]) for item in staged if not item["duplicate"]])
+
+    rows = []
+    for item in staged:
+        tracked = item["duplicate"] or (item["content_hash"], item["object_key"]) in registered
+        rows.append({
+            "filename": item["filename"],
+            "object_url": f"s3://{item['object_key']}",
+            "size_bytes": item["size"],
+            "mime_type": item["mime_type"],
+            "is_processed": item["is_processed"],
+            "variants": item["variants"] or null(),
+            "thumbnail_url": thumbnail_url(item["filename"], item["variants"]),
+            "content_hash": item["content_hash"] if tracked else None,
+            "ip_address": ip_addr,
+            "expires_at": expires_at,
+            # keep queue workers off it while the inline job finishes here
+            "process_after": func.now() + timedelta(seconds=settings.QUEUE_VISIBILITY_TIMEOUT) if item["pending_job"] is not None else None,
+        })
+    result = await db.execute(insert(Image).values(rows).returning(Image.filename, Image.id))
+    return dict(result.all())
 
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED)
@@ -85,124 +394,89 @@ async def upload_image(
             detail=f"Total upload size ({total_size / (1024 * 1024):.2f} MB) exceeds the limit of 50MB"
         )
     
-    one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-    stmt = select(func.count(Image.id)).where(Image.ip_address == ip_addr, Image.uploaded_at >= one_hour_ago)
-    result = await db.execute(stmt)
-    recent_uploads = result.scalar() or 0 
-    
-    if recent_uploads + len(files) > MAX_IMAGES_PER_HOUR:
-        remaining = MAX_IMAGES_PER_HOUR - recent_uploads
-        raise HTTPException(
-            status_code=429,
-            detail=f"Upload limit exceeded. You've uploaded {recent_uploads}/{MAX_IMAGES_PER_HOUR} images in the last hour."
-        )    
+    # turns away a batch that can't fit before reading it, the quota is charged once it's staged
+    await upload_quota.check(ip_addr, len(files))
         
-    results = []
-    
-    async def process_tmp(image_id: uuid.UUID, tmp_path: str, filename: str, original_mime: str):
-        try:
-            with open(tmp_path, 'rb') as f:
-                file_bytes = f.read()
-            await process_image_and_update_db(image_id, file_bytes, filename, original_mime)
-        except Exception as e:
-            logger.error(f"Background processing failed for {filename}: {e}", exc_info=True)
-        finally:
-            try:
-                os.unlink(tmp_path)
-            except Exception as e:
-                logger.error(f"Failed to delete temp file {tmp_path}: {e}")
-
-    for file in files:
-        tmp_path = None
-        new_filename = str(uuid.uuid4())
-        try:
-            mime_type = await validate_file(file)
-            
-            per_file_limit = MAX_GIF_SIZE if mime_type == "image/gif" else MAX_FILE_SIZE
-            
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                tmp_path = tmp.name
-                written = 0
-                while True:
-                    chunk = await file.read(8192)
-                    if not chunk:
-                        break
-                    tmp.write(chunk)
-                    written += len(chunk)
-                    if written > per_file_limit:
-                        tmp.close()
-                        try:
-                            os.unlink(tmp_path)
-                        except Exception as e:
-                            pass
-                        raise HTTPException(status_code=413, detail=f"File '{file.filename}' is too large (Max 15MB per file and Max 50MB for GIF)")
-                tmp.flush()
-                
-                
-            with open(tmp_path, 'rb') as fh:
-                await storage_service.upload_file(fh, new_filename, mime_type)
-                
-            file_size = os.path.getsize(tmp_path)
-            
-            new_image = Image(
-                filename=new_filename,
-                object_url=f"s3://{new_filename}", 
-                size_bytes=file_size,
-                mime_type=mime_type,
-                is_processed=False,
-                ip_address=ip_addr,
-                expires_at=computed_expires_at
-            )
+    staged_keys: list[str] = []
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+
+    async def bounded_stage(file: UploadFile) -> dict:
+        async with semaphore:
+            return await stage_file(file, staged_keys)
+
+    tasks = [asyncio.ensure_future(bounded_stage(file)) for file in files]
+    try:
+        staged = await asyncio.gather(*tasks)
+    except BaseException as e:
+        # a cancelled request (client gone, shutdown) cleans up too, then stays cancelled
+        for task in tasks:
+            task.cancel()
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        await discard_staged([o for o in outcomes if isinstance(o, dict)], staged_keys)
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        ERROR_COUNT.inc()
+        logger.error(f"Upload failed: {e}", extra={"ip": ip_addr}, exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error during upload")
 
-                
-            db.add(new_image)
-            await db.flush()
+    try:
+        await upload_quota.reserve(ip_addr, len(staged))
+    except BaseException:
+        await discard_staged(staged, staged_keys)
+        raise
 
+    try:
+        with stage("db_insert"):
+            image_ids = await insert_images(db, staged, ip_addr, computed_expires_at)
+            await db.commit()
+    except BaseException as e:
+        await db.rollback()
+        await discard_staged(staged, staged_keys)
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        ERROR_COUNT.inc()
+        logger.error(f"Upload failed while saving metadata: {e}", extra={"ip": ip_addr}, exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error during upload")
+
+    results = []
+    for item in staged:
+        image_id = image_ids[item["filename"]]
+        expiry_scheduler.schedule(image_id, computed_expires_at)
+        if item["pending_job"] is not None:
+            background_tasks.add_task(finish_pending, image_id, item["pending_job"], item["tmp_path"], item["filename"])
+        elif not item["is_processed"] and settings.PROCESSING_MODE != "queue":
             background_tasks.add_task(
                 process_tmp, 
-                new_image.id, 
-                tmp_path, 
-                new_filename,
-                mime_type
+                image_id, 
+                item["source"], 
+                item["tmp_path"], 
+                item["filename"],
+                item["original_mime"],
+                item["info"]
             )
+        
+        resp_item = {
+            "url": f"{settings.PUBLIC_BASE_URL}/i/{item['filename']}",
+            "size": item["size"],
+            "mime_type": item["mime_type"] 
+        }
+        
+        if computed_expires_at is not None:
+            resp_item["expires_at"] = computed_expires_at.isoformat()
+        
+        # only variants that exist already; for images still being processed the status URL has them once done
+        resp_item["is_processed"] = item["is_processed"]
+        if not item["is_processed"]:
+            resp_item["status_url"] = status_url(item["filename"])
+        if item["variants"]:
+            resp_item["thumbnail_url"] = thumbnail_url(item["filename"], item["variants"])
+            resp_item["variants"] = {name: variant_url(item["filename"], name) for name in item["variants"]}
             
-            resp_item = {
-                "url": f"{settings.PUBLIC_BASE_URL}/i/{new_filename}",
-                "size": file_size,
-                "mime_type": mime_type 
-            }
-            
-            if computed_expires_at is not None:
-                resp_item["expires_at"] = computed_expires_at.isoformat()
-                
-            results.append(resp_item)
-            
-            # results.append({"url": f"{settings.PUBLIC_BASE_URL}/i/{new_filename}", "size": file_size})
-            UPLOAD_COUNT.inc()
-            logger.info(f"Upload success.", extra={"status": 201, "ip": ip_addr, "img_filename": new_filename})
-
-            tmp_path = None
-
-        except HTTPException as e:
-            if tmp_path and os.path.exists(tmp_path):
-                try:
-                    os.unlink(tmp_path)
-                except Exception:
-                    pass
-            raise e
-        except Exception as e:
-            if tmp_path and os.path.exists(tmp_path):
-                try:
-                    os.unlink(tmp_path)
-                except Exception:
-                    pass
-            await db.rollback()
-            ERROR_COUNT.inc()
-            logger.error(f"Upload failed for {file.filename}: {e}", extra={"ip": ip_addr}, exc_info=True)
-            raise HTTPException(status_code=500, detail="Internal server error during upload")
-
-    await db.commit()
+        results.append(resp_item)
+        
+        UPLOAD_COUNT.inc()
+        logger.info(f"Upload success.", extra={"status": 201, "ip": ip_addr, "img_filename": item["filename"]})
     
-    total_uploaded_mb = sum(r.get('size', 0) for r in results) / 1024 * 1024 if results else 0
+    total_uploaded_mb = sum(r.get('size', 0) for r in results) / (1024 * 1024) if results else 0
     logger.info(f"batch upload complete: {len(results)} files, {total_uploaded_mb:.1f}MB toal", extra={"ip": ip_addr})
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,145 @@
+"""Database round trips per uploaded image: per-row ORM writes against the batched paths.
+
+Needs a scratch Postgres (DATABASE_URL, the bench default is imghost_bench); the images tables are
+created if missing and the rows written here are removed afterwards.
+
+    python -m benchmarks.bench_db_roundtrips --batch-sizes 1 5 15 --output roundtrips.json
+
+A round trip is a statement or a COMMIT sent to the server.
+"""
+import uuid
+import asyncio
+import argparse
+from datetime import datetime, timezone, timedelta
+from benchmarks.common import write_results
+
+
+class RoundTrips:
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._hit)
+        event.listen(engine.sync_engine, "commit", self._hit)
+
+    def _hit(self, *args, **kwargs):
+        self.count += 1
+
+    def take(self) -> int:
+        count, self.count = self.count, 0
+        return count
+
+
+def staged_items(count: int) -> list[dict]:
+    items = []
+    for _ in range(count):
+        filename = f"bench-{uuid.uuid4()}"
+        items.append({
+            "filename": filename, "object_key": filename, "content_hash": uuid.uuid4().hex * 2, "duplicate": False,
+            "size": 1024, "mime_type": "image/jpeg", "is_processed": False, "pending_job": None, "variants": {},
+        })
+    return items
+
+
+async def legacy_insert(items: list[dict], expires_at: datetime) -> None:
+    # what upload_image did before: add and flush row by row
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async with AsyncSessionLocal() as db:
+        for item in items:
+            db.add(Image(
+                filename=item["filename"], object_url=f"s3://{item['object_key']}", size_bytes=item["size"],
+                mime_type=item["mime_type"], is_processed=False, ip_address="bench", expires_at=expires_at,
+            ))
+            await db.flush()
+        await db.commit()
+
+
+async def legacy_mark_processed(filename: str) -> None:
+    # what each processing branch did before: its own session, SELECT, mutate, COMMIT
+    from sqlalchemy import select
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async with AsyncSessionLocal() as session:
+        image = (await session.execute(select(Image).where(Image.filename == filename))).scalars().first()
+        if image:
+            image.size_bytes = 512
+            image.mime_type = "image/webp"
+            image.is_processed = True
+            await session.commit()
+
+
+async def batched_insert(items: list[dict], expires_at: datetime) -> None:
+    from db.session import AsyncSessionLocal
+    from api.routes.upload import insert_images
+
+    async with AsyncSessionLocal() as db:
+        await insert_images(db, items, "bench", expires_at)
+        await db.commit()
+
+
+async def batched_mark_processed(filename: str) -> None:
+    from services.status import status_writer
+
+    await status_writer.mark_processed(filename, size_bytes=512, mime_type="image/webp")
+
+
+async def run(batch_sizes: list[int], rounds: int) -> list[dict]:
+    from sqlalchemy import delete, text
+    from db.session import engine, Base
+    from models.image import Image
+    from models.stored_object import StoredObject
+    from cleanup import create_partitions_ahead
+
+    async with engine.begin() as conn:
+        await conn.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'))
+        await conn.run_sync(Base.metadata.create_all)
+    await create_partitions_ahead()
+
+    trips = RoundTrips(engine)
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    results = []
+    try:
+        for size in batch_sizes:
+            for path, insert, mark in (
+                ("per-row", legacy_insert, legacy_mark_processed),
+                ("batched", batched_insert, batched_mark_processed),
+            ):
+                insert_trips = status_trips = 0
+                for _ in range(rounds):
+                    items = staged_items(size)
+                    trips.take()
+                    await insert(items, expires_at)
+                    insert_trips += trips.take()
+                    # processing finishes for the whole upload at about the same time
+                    await asyncio.gather(*(mark(item["filename"]) for item in items))
+                    status_trips += trips.take()
+                images = size * rounds
+                results.append({
+                    "path": path,
+                    "batch_size": size,
+                    "insert_round_trips_per_image": insert_trips / images,
+                    "status_round_trips_per_image": status_trips / images,
+                })
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(delete(Image).where(Image.ip_address == "bench"))
+            await conn.execute(delete(StoredObject).where(StoredObject.object_key.like("bench-%")))
+        await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 5, 15])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    write_results(args.output, asyncio.run(run(args.batch_sizes, args.rounds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Full-resolution decode + LANCZOS vs. the size-aware decode plan.
+
+    python -m benchmarks.bench_decode --size 6000x4000 --formats JPEG PNG WEBP HEIF --output decode.json
+
+Each case runs in a fresh process so peak RSS is per decode. Needs numpy for SSIM.
+"""
+import io
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.common import synthetic_image, encode, peak_rss_kb, ssim, write_results
+
+
+def _baseline(data: bytes):
+    from PIL import Image as PilImage
+    from services.processing import target_size
+
+    img = PilImage.open(io.BytesIO(data))
+    img.load()
+    target = target_size(*img.size)
+    if target != img.size:
+        img = img.resize(target, PilImage.Resampling.LANCZOS)
+    return img
+
+
+def _planned(data: bytes):
+    from PIL import Image as PilImage
+    from services.processing import decode_for_target
+
+    return decode_for_target(PilImage.open(io.BytesIO(data)))
+
+
+def _run_case(path_name: str, data: bytes):
+    decode = _baseline if path_name == "baseline" else _planned
+    rss_before = peak_rss_kb()
+    start = time.perf_counter()
+    img = decode(data)
+    elapsed = time.perf_counter() - start
+    rss_delta = peak_rss_kb() - rss_before
+    img = img.convert("RGB")
+    return elapsed, rss_delta, img.size, img.tobytes()
+
+
+def run(size: tuple[int, int], formats: list[str], repeat: int) -> list[dict]:
+    from PIL import Image as PilImage
+
+    results = []
+    source = synthetic_image(*size)
+    for fmt in formats:
+        data = encode(source, fmt)
+        outputs = {}
+        for path_name in ("baseline", "planned"):
+            times, rss = [], []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    elapsed, rss_delta, out_size, raw = pool.submit(_run_case, path_name, data).result()
+                times.append(elapsed)
+                rss.append(rss_delta)
+            outputs[path_name] = PilImage.frombytes("RGB", out_size, raw)
+            results.append({
+                "format": fmt,
+                "path": path_name,
+                "input_bytes": len(data),
+                "output_size": list(out_size),
+                "wall_seconds_min": min(times),
+                "peak_rss_delta_kb": max(rss),
+            })
+        results[-1]["ssim_vs_baseline"] = ssim(outputs["baseline"], outputs["planned"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="6000x4000")
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG", "WEBP", "HEIF"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    write_results(args.output, run((width, height), args.formats, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""End-to-end upload load test: the whole app served in-process by uvicorn, driven over loopback by httpx.
+
+Needs the same local stand-ins as the other benchmarks: a scratch Postgres (DATABASE_URL, default
+imghost_bench) and an S3 endpoint (S3_ENDPOINT_URL, e.g. `moto_server -p 5000` or MinIO). The bucket,
+tables and partitions are created if missing. Cloudflare is answered locally by a mock transport.
+
+    python -m benchmarks.bench_e2e --requests 200 --concurrency 16 --sizes 1024x768 4000x3000 \\
+        --formats JPEG PNG --files-per-request 1 3 --gif-share 0.1 --output e2e.json
+
+Rate limits and the hourly quota are disabled for the run. Deduplication is off unless --dedup is
+given, because the corpus repeats payloads. Time-to-processed is measured from the upload response
+to the row showing is_processed, polled every --poll-interval seconds. Rows written here are removed
+afterwards, and stored objects are left in the bucket.
+"""
+import os
+import time
+import random
+import resource
+import asyncio
+import argparse
+from benchmarks.common import synthetic_image, synthetic_gif, encode, percentiles, mock_cloudflare, peak_rss_kb, write_results
+
+BENCH_IP = "bench"
+MIME_BY_FORMAT = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "HEIF": "image/heif", "GIF": "image/gif"}
+
+
+def parse_size(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def build_corpus(sizes: list[tuple[int, int]], formats: list[str], gif_size: tuple[int, int], variety: int) -> dict:
+    # a few distinct payloads per (size, format) so caches don't see one object over and over
+    corpus = {"still": [], "gif": []}
+    for width, height in sizes:
+        for fmt in formats:
+            for i in range(variety):
+                img = synthetic_image(width, height).rotate(i * 7, expand=False)
+                corpus["still"].append((f"{width}x{height}.{fmt.lower()}", encode(img, fmt), MIME_BY_FORMAT[fmt]))
+    for i in range(variety):
+        corpus["gif"].append((f"{gif_size[0]}x{gif_size[1]}.gif", synthetic_gif(*gif_size, frames=6 + i), "image/gif"))
+    return corpus
+
+
+def pick_files(corpus: dict, files_per_request: list[int], gif_share: float) -> list[tuple[str, bytes, str]]:
+    count = random.choice(files_per_request)
+    return [random.choice(corpus["gif"] if random.random() < gif_share else corpus["still"]) for _ in range(count)]
+
+
+async def ensure_bucket() -> None:
+    import boto3
+    from core.config import settings
+
+    def create():
+        client = boto3.client(
+            "s3", endpoint_url=settings.S3_ENDPOINT_URL,
+            aws_access_key_id=settings.S3_ACCESS_KEY_ID, aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+        )
+        existing = {b["Name"] for b in client.list_buckets().get("Buckets", [])}
+        if settings.S3_BUCKET_NAME not in existing:
+            client.create_bucket(Bucket=settings.S3_BUCKET_NAME)
+
+    await asyncio.to_thread(create)
+
+
+class ProcessedWatcher:
+    # one query per poll interval for everything still pending, so watching doesn't load the DB per upload
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.pending: dict[str, float] = {}
+        self.seconds: list[float] = []
+
+    def watch(self, filename: str, since: float) -> None:
+        self.pending[filename] = since
+
+    async def poll(self) -> None:
+        from sqlalchemy import select
+        from db.session import AsyncSessionLocal
+        from models.image import Image
+
+        if not self.pending:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Image.filename).where(Image.filename.in_(list(self.pending)), Image.is_processed.is_(True))
+            )
+            now = time.perf_counter()
+            for (filename,) in result:
+                self.seconds.append(now - self.pending.pop(filename))
+
+    async def run(self) -> None:
+        while True:
+            await self.poll()
+            await asyncio.sleep(self.interval)
+
+    async def settle(self, timeout: float) -> None:
+        deadline = time.perf_counter() + timeout
+        while self.pending and time.perf_counter() < deadline:
+            await self.poll()
+            await asyncio.sleep(self.interval)
+
+
+async def run(args) -> dict:
+    import uvicorn
+    import httpx
+    from sqlalchemy import delete, text
+    from main import app
+    from db.session import engine, Base, limiter
+    from models.image import Image
+    from models.stored_object import StoredObject
+    from cleanup import create_partitions_ahead
+
+    limiter.enabled = False
+    await ensure_bucket()
+    async with engine.begin() as conn:
+        await conn.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'))
+        await conn.run_sync(Base.metadata.create_all)
+    await create_partitions_ahead()
+
+    corpus = build_corpus([parse_size(s) for s in args.sizes], args.formats, parse_size(args.gif_size), args.variety)
+    cdn_calls = mock_cloudflare(args.cdn_latency)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+
+    watcher = ProcessedWatcher(args.poll_interval)
+    watching = asyncio.create_task(watcher.run())
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    uploaded: list[str] = []
+    files_sent = bytes_sent = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def upload(client: httpx.AsyncClient) -> None:
+        nonlocal files_sent, bytes_sent
+        files = pick_files(corpus, args.files_per_request, args.gif_share)
+        async with semaphore:
+            start = time.perf_counter()
+            resp = await client.post(
+                "/upload",
+                files=[("files", f) for f in files],
+                data={"expires_minutes": "60"},
+                headers={"X-Forwarded-For": BENCH_IP},
+            )
+            done = time.perf_counter()
+        latencies.append(done - start)
+        statuses[str(resp.status_code)] = statuses.get(str(resp.status_code), 0) + 1
+        if resp.status_code == 201:
+            files_sent += len(files)
+            bytes_sent += sum(len(data) for _, data, _ in files)
+            for item in resp.json():
+                filename = item["url"].rsplit("/", 1)[-1]
+                uploaded.append(filename)
+                watcher.watch(filename, done)
+
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=120) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(upload(client) for _ in range(args.requests)))
+            elapsed = time.perf_counter() - start
+        watching.cancel()
+        await asyncio.gather(watching, return_exceptions=True)
+        await watcher.settle(args.settle_timeout)
+    finally:
+        server.should_exit = True
+        await serving
+        async with engine.begin() as conn:
+            await conn.execute(delete(Image).where(Image.ip_address == BENCH_IP))
+            if uploaded:
+                await conn.execute(delete(StoredObject).where(StoredObject.object_key.in_(uploaded)))
+        await engine.dispose()
+
+    ok = statuses.get("201", 0)
+    return {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "requests": args.requests,
+        "statuses": statuses,
+        "files_uploaded": files_sent,
+        "elapsed_seconds": elapsed,
+        "requests_per_second": ok / elapsed,
+        "files_per_second": files_sent / elapsed,
+        "mb_per_second": bytes_sent / (1024 * 1024) / elapsed,
+        **percentiles(latencies),
+        **percentiles(watcher.seconds, prefix="processed_"),
+        "never_processed": len(watcher.pending),
+        "cdn_purge_requests": cdn_calls["requests"],
+        # ru_maxrss of reaped children covers the processing pool, it is shut down with the server
+        "peak_rss_mb": peak_rss_kb() / 1024,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "1920x1080", "4000x3000"])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG", "WEBP"], choices=sorted(set(MIME_BY_FORMAT) - {"GIF"}))
+    parser.add_argument("--files-per-request", nargs="+", type=int, default=[1, 3])
+    parser.add_argument("--gif-share", type=float, default=0.1, help="fraction of files that are animated GIFs")
+    parser.add_argument("--gif-size", default="480x270")
+    parser.add_argument("--variety", type=int, default=3, help="distinct payloads per size and format")
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument("--cdn-latency", type=float, default=0.05, help="seconds the mock Cloudflare takes per call")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--settle-timeout", type=float, default=60.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # settings are read when the app is imported
+    os.environ.setdefault("UPLOAD_QUOTA_PER_HOUR", str(10 ** 9))
+    os.environ.setdefault("DEDUP_UPLOADS", "true" if args.dedup else "false")
+    write_results(args.output, asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""CPU seconds per MB saved for each encoding policy over a corpus.
+
+    python -m benchmarks.bench_encoding --corpus ./corpus --output encoding.json
+    python -m benchmarks.bench_encoding --synthetic 40 --output encoding.json
+
+Savings only count when the processing stage would keep the result (MIN_REDUCTION_PCT).
+"""
+import os
+import time
+import argparse
+from benchmarks.common import synthetic_image, encode, write_results
+
+SYNTHETIC_SIZES = [(640, 480), (1920, 1080), (3024, 4032), (6000, 4000)]
+SYNTHETIC_FORMATS = [("JPEG", "RGB"), ("PNG", "RGB"), ("PNG", "RGBA"), ("WEBP", "RGB"), ("HEIF", "RGB")]
+
+
+def load_corpus(path: str) -> list[tuple[str, bytes]]:
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            with open(full, "rb") as f:
+                corpus.append((name, f.read()))
+    return corpus
+
+
+def synthetic_corpus(count: int) -> list[tuple[str, bytes]]:
+    corpus = []
+    for i in range(count):
+        width, height = SYNTHETIC_SIZES[i % len(SYNTHETIC_SIZES)]
+        fmt, mode = SYNTHETIC_FORMATS[(i // len(SYNTHETIC_SIZES)) % len(SYNTHETIC_FORMATS)]
+        corpus.append((f"synthetic-{i}-{width}x{height}-{mode}.{fmt.lower()}", encode(synthetic_image(width, height, mode), fmt)))
+    return corpus
+
+
+def run(corpus: list[tuple[str, bytes]], policies: list[str]) -> list[dict]:
+    from services.processing import strip_exif_and_process, reduction_percent, MIN_REDUCTION_PCT
+
+    results = []
+    for policy in policies:
+        cpu_seconds = 0.0
+        bytes_in = bytes_saved = skipped = 0
+        for _, data in corpus:
+            start = time.process_time()
+            processed = strip_exif_and_process(data, policy, {}).data
+            cpu_seconds += time.process_time() - start
+            bytes_in += len(data)
+            if processed is data:
+                skipped += 1
+            elif reduction_percent(len(data), len(processed)) >= MIN_REDUCTION_PCT:
+                bytes_saved += len(data) - len(processed)
+        mb_saved = bytes_saved / (1024 * 1024)
+        results.append({
+            "policy": policy,
+            "images": len(corpus),
+            "skipped": skipped,
+            "mb_in": bytes_in / (1024 * 1024),
+            "mb_saved": mb_saved,
+            "cpu_seconds": cpu_seconds,
+            "cpu_seconds_per_mb_saved": cpu_seconds / mb_saved if mb_saved else None,
+        })
+    return results
+
+
+def main():
+    from services.encoding import POLICIES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of images")
+    parser.add_argument("--synthetic", type=int, default=20, help="generated images when no corpus is given")
+    parser.add_argument("--policies", nargs="+", default=sorted(POLICIES))
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.synthetic)
+    write_results(args.output, run(corpus, args.policies))
+
+
+if __name__ == "__main__":
+    main()
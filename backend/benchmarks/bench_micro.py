@@ -0,0 +1,115 @@
+"""Microbenchmarks for the hot functions of the upload path, over a generated corpus.
+
+    python -m benchmarks.bench_micro --sizes 1024x768 4000x3000 --formats JPEG PNG WEBP --repeat 5 --output micro.json
+
+- strip_exif_and_process: wall and CPU time per image, run in this process
+- validate_file: MIME sniffing of an in-memory UploadFile
+- purge_urls: enqueue latency and time to drain the queue against a mock Cloudflare
+
+No database or S3 needed.
+"""
+import io
+import time
+import asyncio
+import argparse
+from benchmarks.common import synthetic_image, synthetic_gif, encode, percentiles, mock_cloudflare, write_results
+
+
+def build_corpus(sizes: list[str], formats: list[str], gif: bool) -> list[tuple[str, bytes]]:
+    corpus = []
+    for size in sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        for fmt in formats:
+            corpus.append((f"{size}.{fmt.lower()}", encode(synthetic_image(width, height), fmt)))
+    if gif:
+        corpus.append(("480x270.gif", synthetic_gif(480, 270)))
+    return corpus
+
+
+def bench_processing(corpus: list[tuple[str, bytes]], repeat: int) -> list[dict]:
+    from services.processing import strip_exif_and_process
+
+    results = []
+    for name, data in corpus:
+        wall, cpu = [], 0.0
+        for _ in range(repeat):
+            start, start_cpu = time.perf_counter(), time.process_time()
+            processed = strip_exif_and_process(data)
+            wall.append(time.perf_counter() - start)
+            cpu += time.process_time() - start_cpu
+        results.append({
+            "image": name,
+            "bytes_in": len(data),
+            "bytes_out": len(processed.data),
+            "variants": len(processed.variants),
+            "cpu_ms_mean": cpu / repeat * 1000,
+            **percentiles(wall),
+        })
+    return results
+
+
+async def bench_validate(corpus: list[tuple[str, bytes]], iterations: int) -> list[dict]:
+    from fastapi import UploadFile
+    from api.routes.upload import validate_file
+
+    results = []
+    for name, data in corpus:
+        latencies = []
+        for _ in range(iterations):
+            file = UploadFile(io.BytesIO(data), filename=name)
+            start = time.perf_counter()
+            await validate_file(file)
+            latencies.append(time.perf_counter() - start)
+        results.append({"image": name, "iterations": iterations, **percentiles(latencies)})
+    return results
+
+
+async def bench_purge(urls: int, per_call: int, cdn_latency: float) -> dict:
+    from services.cloudflare import purge_urls, purge_dispatcher
+
+    calls = mock_cloudflare(cdn_latency)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, urls, per_call):
+        batch = [f"http://localhost:8000/i/bench-{n}" for n in range(i, min(i + per_call, urls))]
+        submitted = time.perf_counter()
+        await purge_urls(batch)
+        latencies.append(time.perf_counter() - submitted)
+    enqueued = time.perf_counter() - start
+    await purge_dispatcher.flush(timeout=3600)
+    drained = time.perf_counter() - start
+    return {
+        "urls": urls,
+        "urls_per_call": per_call,
+        "cdn_latency_seconds": cdn_latency,
+        "enqueue_seconds": enqueued,
+        "drain_seconds": drained,
+        "api_requests": calls["requests"],
+        "urls_sent": calls["urls"],
+        **percentiles(latencies, prefix="enqueue_"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "1920x1080", "4000x3000"])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG", "WEBP"])
+    parser.add_argument("--no-gif", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--validate-iterations", type=int, default=200)
+    parser.add_argument("--purge-urls", type=int, default=2000)
+    parser.add_argument("--purge-per-call", type=int, default=4, help="URLs per purge_urls call, an upload purges a few")
+    parser.add_argument("--cdn-latency", type=float, default=0.05)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.sizes, args.formats, not args.no_gif)
+    write_results(args.output, {
+        "strip_exif_and_process": bench_processing(corpus, args.repeat),
+        "validate_file": asyncio.run(bench_validate(corpus, args.validate_iterations)),
+        "purge_urls": asyncio.run(bench_purge(args.purge_urls, args.purge_per_call, args.cdn_latency)),
+    })
+
+
+if __name__ == "__main__":
+    main()
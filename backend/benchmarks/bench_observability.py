@@ -0,0 +1,85 @@
+"""Steady-state cost of tracing and profiling: request throughput of a trivial route per Sentry configuration.
+
+Events go to a transport that drops them, so only the in-process cost is measured.
+
+    python -m benchmarks.bench_observability --requests 5000 --output observability.json
+"""
+import time
+import asyncio
+import argparse
+from benchmarks.common import percentiles, write_results
+
+# (name, traces_sample_rate, profile_session_sample_rate); None disables the SDK entirely
+CONFIGS = [
+    ("sentry-off", None, None),
+    ("traces-0", 0.0, 0.0),
+    ("traces-0.05", 0.05, 0.0),
+    ("traces-1", 1.0, 0.0),
+    ("traces-1-profiling", 1.0, 1.0),
+]
+
+
+def init_sentry(traces: float | None, profiles: float | None) -> None:
+    import sentry_sdk
+    from sentry_sdk.transport import Transport
+
+    class DropTransport(Transport):
+        def capture_envelope(self, envelope):
+            pass
+
+    if traces is None:
+        sentry_sdk.init(dsn=None)
+        return
+    sentry_sdk.init(
+        dsn="http://bench@localhost/1",
+        transport=DropTransport,
+        traces_sample_rate=traces,
+        profile_session_sample_rate=profiles,
+        profile_lifecycle="trace",
+    )
+
+
+async def _drive(app, requests: int, concurrency: int, path: str) -> dict:
+    import httpx
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def get():
+            async with semaphore:
+                start = time.perf_counter()
+                await client.get(path)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(get() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+    return {"requests_per_second": requests / elapsed, **percentiles(latencies)}
+
+
+def run(requests: int, concurrency: int, path: str) -> list[dict]:
+    from main import app
+
+    results = []
+    for name, traces, profiles in CONFIGS:
+        init_sentry(traces, profiles)
+        # warm up so the first config doesn't pay for imports and route compilation
+        asyncio.run(_drive(app, min(requests, 200), concurrency, path))
+        results.append({"config": name, "path": path, **asyncio.run(_drive(app, requests, concurrency, path))})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    write_results(args.output, run(args.requests, args.concurrency, args.path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Load test for the upload quota check: throughput, latency and how often it falls back to the database.
+
+The recovery counter is replaced by one that only counts calls, so the numbers are the storage path alone.
+Runs against memory:// by default; pass a Redis URI to see the shared-storage cost:
+
+    python -m benchmarks.bench_quota --clients 1000 --requests 20000 --storage-uri redis://localhost:6379 --output quota.json
+"""
+import time
+import random
+import asyncio
+import argparse
+from benchmarks.common import write_results
+
+
+async def _phase(quota, clients: list[str], requests: int, concurrency: int, batch: int) -> dict:
+    from fastapi import HTTPException
+
+    latencies = []
+    rejected = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(ip_addr: str):
+        nonlocal rejected
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await quota.reserve(ip_addr, batch)
+            except HTTPException:
+                rejected += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(check(random.choice(clients)) for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "rejected": rejected,
+        "checks_per_second": requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def run(storage_uri: str, clients: int, requests: int, concurrency: int, batch: int, limit: int) -> dict:
+    from services.quota import UploadQuota, WINDOW_SECONDS
+
+    db_calls = 0
+
+    async def recover(ip_addr: str) -> int:
+        nonlocal db_calls
+        db_calls += 1
+        return 0
+
+    quota = UploadQuota(storage_uri, limit, recover=recover)
+    quota.storage.reset()
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(clients)]
+
+    # a fresh storage seeds each client once from the database
+    recovering = await _phase(quota, ips, requests, concurrency, batch)
+    recovering["db_calls"] = db_calls
+
+    # then pretend the storage has been up longer than a window: the database is no longer touched
+    db_calls = 0
+    quota._epoch_started = time.time() - WINDOW_SECONDS
+    quota._epoch_checked = time.time()
+    steady = await _phase(quota, ips, requests, concurrency, batch)
+    steady["db_calls"] = db_calls
+
+    return {"storage": storage_uri, "clients": clients, "limit": limit, "batch": batch,
+            "recovering": recovering, "steady": steady}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage-uri", default="memory://")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    write_results(args.output, asyncio.run(run(
+        args.storage_uri, args.clients, args.requests, args.concurrency, args.batch, args.limit
+    )))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""PUT/DELETE throughput of the boto3 and aiobotocore storage backends.
+
+Point S3_ENDPOINT_URL at a local stand-in first, e.g. `moto_server -p 5000` or MinIO:
+
+    python -m benchmarks.bench_storage --concurrency 50 100 200 --objects 1000 --output storage.json
+"""
+import io
+import time
+import uuid
+import asyncio
+import argparse
+from benchmarks.common import write_results
+
+
+async def _run(service, concurrency: int, objects: int, payload: bytes) -> dict:
+    keys = [f"bench-{uuid.uuid4()}" for _ in range(objects)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def put(key):
+        async with semaphore:
+            await service.upload_file(io.BytesIO(payload), key, "image/webp")
+
+    async def delete(key):
+        async with semaphore:
+            await service.delete_file(key)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(put(k) for k in keys))
+    put_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(delete(k) for k in keys))
+    delete_seconds = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "objects": objects,
+        "put_per_second": objects / put_seconds,
+        "delete_per_second": objects / delete_seconds,
+    }
+
+
+async def run(concurrency_levels: list[int], objects: int, payload_size: int) -> list[dict]:
+    from services.storage import StorageService, AioStorageService
+
+    payload = b"\0" * payload_size
+    results = []
+    for backend, cls in (("boto3", StorageService), ("aiobotocore", AioStorageService)):
+        service = cls()
+        try:
+            for concurrency in concurrency_levels:
+                result = await _run(service, concurrency, objects, payload)
+                result["backend"] = backend
+                results.append(result)
+        finally:
+            await service.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[50, 100, 200])
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--payload-size", type=int, default=64 * 1024)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    write_results(args.output, asyncio.run(run(args.concurrency, args.objects, args.payload_size)))
+
+
+if __name__ == "__main__":
+    main()
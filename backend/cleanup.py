@@ -1,94 +1,104 @@
 import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import select, func, delete
-from db.session import AsyncSessionLocal
-from models.image import Image
-from services.storage import storage_service
-from services.cloudflare import purge_urls
+from sqlalchemy import select, func, text
+from db.session import AsyncSessionLocal, engine
+from db.partitions import DEFAULT_PARTITION, PARTITION_LOCK_KEY, PARTITION_PREFIX, create_partitions_ahead, list_partitions
+from models.image import Image, MAX_IMAGE_LIFETIME
+from services.cloudflare import close_client
 from core.config import settings
+from core.monitoring import DELETE_COUNT, push_metrics, stage
+from services.expiry import claim_expired_batch, delete_claimed, public_urls, purge_batch
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("cleanup")
 
-BATCH_SIZE = 100
-S3_CONC = 10
+BATCH_SIZE = 500
 RETENTION_DAYS = 90
 
+
 async def soft_delete_expired_imges():
+    # the expiry scheduler in the API handles this continuously, this sweep catches whatever it missed
     now = datetime.now(timezone.utc)
     deleted_total = 0
     failed_total = 0
-    purge_urls_buffer: list[str] = [] 
-    
+    failed_ids: set = set()
     
     async with AsyncSessionLocal() as session:
-        semaphore = asyncio.Semaphore(S3_CONC)
         while True:
-            stmt = (
-                select(Image)
-                .where(Image.expires_at < now, Image.deleted_at.is_(None))
-                .order_by(Image.expires_at)
-                .limit(BATCH_SIZE)
-            )
-            result = await session.execute(stmt)
-            batch = result.scalars().all()
-        
-            if not batch:
-                break
+            with stage("cleanup_batch"):
+                batch = await claim_expired_batch(session, now, BATCH_SIZE, skip_ids=failed_ids)
+                if not batch:
+                    break
 
-            async def delete_one(img: Image):
-                nonlocal deleted_total, failed_total   
-                try:
-                    async with semaphore:
-                        await storage_service.delete_file(img.filename)
-                    img.deleted_at = datetime.now(timezone.utc)
-                    img.object_url = "DELETED"
+                deleted, reverted = await delete_claimed(session, batch)
+                failed_ids.update(row.id for row in reverted)
+                await session.commit()
+            DELETE_COUNT.inc(len(deleted))
 
-                    purge_urls_buffer.append(
-                        f"{settings.PUBLIC_BASE_URL}/i/{img.filename}"
-                    )
-                    
-                    deleted_total +=1
-                except Exception as e:
-                    failed_total += 1
-                    logger.error(f"S3 delete failed for {img.filename}: {e}")
-                    
-            await asyncio.gather(*(delete_one(img) for img in batch))
-            
-            await session.commit()
-            logger.info(f"Soft deleted batch of {len(batch)} images")
+            if deleted:
+                await purge_batch(public_urls(deleted))
+
+            deleted_total += len(deleted)
+            failed_total += len(reverted)
+            logger.info(f"Soft deleted batch of {len(deleted)} images, {len(reverted)} failed")
             
         logger.info(
             f"SOft delete complete deleted={deleted_total}, failed={failed_total}"
         )
-        
-    if purge_urls_buffer:
-        try:
-            purge_result = await purge_urls(purge_urls_buffer)
-            logger.info("CLouflare purge result: %s", purge_result)
-        except Exception:
-            logger.error("cloudflare purge failed")
     
     
      
-async def hard_delete_old_metadata():
+async def drop_expired_partitions():
+    # replaces the row-by-row hard delete: rows are soft-deleted within MAX_IMAGE_LIFETIME of their upload,
+    # so a partition that ended that long before the retention cutoff only holds rows past retention
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+    drop_before = (cutoff_date - MAX_IMAGE_LIFETIME).date()
     
-    async with AsyncSessionLocal() as session:
-        count = await session.scalar(
-            select(func.count(Image.id)).where(Image.deleted_at < cutoff_date)
-        )
+    async with engine.connect() as conn:
+        names = await list_partitions(conn)
+    
+    dropped = 0
+    for name in names:
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        try:
+            day = datetime.strptime(name.removeprefix(PARTITION_PREFIX), "%Y%m%d").date()
+        except ValueError:
+            continue
+        if day + timedelta(days=1) > drop_before:
+            break
         
-        if not count:
-            logger.info("No old metadata records found for hard deletion")
-            return
+        async with AsyncSessionLocal() as session:
+            lingering = await session.scalar(
+                text(f"SELECT EXISTS (SELECT 1 FROM {name} WHERE deleted_at IS NULL OR deleted_at >= :cutoff)"),
+                {"cutoff": cutoff_date}
+            )
+        if lingering:
+            logger.warning(f"Keeping partition {name}, it still has rows inside retention")
+            continue
         
-        await session.execute(
-            delete(Image).where(Image.deleted_at < cutoff_date)
+        # DETACH ... CONCURRENTLY isn't allowed while the default partition exists; dropping the partition
+        # outright locks the parent only for the catalog change
+        with stage("partition_drop"):
+            async with engine.begin() as conn:
+                await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+                await conn.execute(text(f"DROP TABLE {name}"))
+        dropped += 1
+        logger.info(f"Dropped partition {name}")
+    
+    if not dropped:
+        logger.info("No partitions past retention")
+    
+    # rows for days that never got a partition are deleted one by one instead
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text(f"DELETE FROM {DEFAULT_PARTITION} WHERE deleted_at < :cutoff"),
+            {"cutoff": cutoff_date}
         )
         await session.commit()
-        logger.info(f"Hard deleted {count} old metadata rows")
+    if result.rowcount:
+        logger.info(f"Deleted {result.rowcount} rows past retention from {DEFAULT_PARTITION}")
         
 async def print_stats():
     now = datetime.now(timezone.utc)
@@ -124,13 +134,19 @@ async def main():
     logger.info("Starting cleanup job.....")
     try:
         await print_stats()
+        await create_partitions_ahead()
         await soft_delete_expired_imges()
-        await hard_delete_old_metadata()
+        await drop_expired_partitions()
         await print_stats()
         logger.info("Cleanup job completed successfully")
     except Exception as e:
         logger.error(f"Cleanup job failed: {e}", exc_info=True)
         raise 
+    finally:
+        # a large sweep queues far more purges than the API's rate limit sends in the default flush timeout,
+        # and whatever is dropped stays stale on the CDN, so wait for all of it
+        await close_client(flush_timeout=None)
+        push_metrics(settings.METRICS_PUSHGATEWAY_URL, "imghost_cleanup")
   
 if __name__ == "__main__":
     asyncio.run(main())
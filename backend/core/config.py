@@ -11,10 +11,71 @@ class Settings(BaseSettings):
     S3_BUCKET_NAME: str
     PUBLIC_BASE_URL: str
     RATE_LIMIT_STORAGE_URL: str = "memory://"
+    UPLOAD_QUOTA_PER_HOUR: int = 50
     PRESIGNED_URL_EXPIRY_SECONDS: int = 60
     SENTRY_DSN: str | None = None
+    SENTRY_TRACES_SAMPLE_RATE: float = 0.05
+    SENTRY_PROFILE_SESSION_SAMPLE_RATE: float = 0.0
+    # path prefix -> sample rate, the longest matching prefix wins over SENTRY_TRACES_SAMPLE_RATE
+    SENTRY_TRACE_RULES: dict[str, float] = {"/upload": 1.0, "/metrics": 0.0, "/health": 0.0, "/admin": 0.0}
+    ADMIN_TOKEN: str | None = None
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_QUEUE_POLICY: str = "drop"
+    LOG_QUEUE_BLOCK_TIMEOUT: float = 1.0
+    # logger name prefix -> fraction of INFO records kept, e.g. {"imghost.background": 0.1}
+    LOG_SAMPLE_RATES: dict[str, float] = {}
+    PROFILE_MAX_SECONDS: float = 60.0
     CF_API_TOKEN: str | None = None
     CF_ZONE_ID: str | None = None
+    CF_API_BASE_URL: str = "https://api.cloudflare.com/client/v4"
+    CF_PURGE_QUEUE_SIZE: int = 10000
+    CF_PURGE_DEBOUNCE: float = 0.5
+    CF_PURGE_CONCURRENCY: int = 4
+    CF_PURGE_RATE: float = 4.0
+    CF_PURGE_BURST: int = 8
+    PROCESSING_WORKERS: int | None = None
+    PROCESSING_QUEUE_SIZE: int = 32
+    PROCESSING_JOB_TIMEOUT: float = 60.0
+    KEEP_ICC_PROFILE: bool = True
+    ENCODING_POLICY: str = "adaptive"
+    WEBP_QUALITY: int = 85
+    WEBP_METHOD: int = 4
+    IMAGE_VARIANTS: dict[str, int] = {"thumb": 320, "medium": 1280}
+    TRANSCODE_GIFS: bool = True
+    ORIGIN_CACHE_MEMORY_BYTES: int = 256 * 1024 * 1024
+    ORIGIN_CACHE_MAX_OBJECT_BYTES: int = 16 * 1024 * 1024
+    ORIGIN_CACHE_DIR: str | None = "/tmp/imghost-cache"
+    ORIGIN_CACHE_DISK_BYTES: int = 2 * 1024 * 1024 * 1024
+    ORIGIN_CACHE_WARM_ON_UPLOAD: bool = True
+    SINGLE_PUT_UPLOADS: bool = False
+    INLINE_PROCESSING_BUDGET: float = 3.0
+    INLINE_MAX_PIXELS: int = 16_000_000
+    MAX_IMAGE_PIXELS: int = 100_000_000
+    UPLOAD_CONCURRENCY: int = 4
+    STREAMING_UPLOADS: bool = False
+    DEDUP_UPLOADS: bool = True
+    S3_MULTIPART_PART_SIZE: int = 8 * 1024 * 1024
+    STORAGE_BACKEND: str = "boto3"
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_MAX_ATTEMPTS: int = 3
+    S3_KEEPALIVE_TIMEOUT: float = 30.0
+    PROCESSING_MODE: str = "background"
+    QUEUE_VISIBILITY_TIMEOUT: int = 300
+    QUEUE_MAX_ATTEMPTS: int = 5
+    QUEUE_BACKOFF_BASE: float = 10.0
+    WORKER_CONCURRENCY: int = 4
+    WORKER_POLL_INTERVAL: float = 2.0
+    # scrape port for worker.py's metrics, None to not serve them
+    WORKER_METRICS_PORT: int | None = 9102
+    # where cleanup.py pushes its metrics when it finishes, None to not push them
+    METRICS_PUSHGATEWAY_URL: str | None = None
+    STATUS_FLUSH_INTERVAL: float = 0.2
+    STATUS_FLUSH_BATCH: int = 200
+    HEALTH_PROBE_INTERVAL: float = 5.0
+    HEALTH_PROBE_TIMEOUT: float = 3.0
+    EXPIRY_SCHEDULER: bool = True
+    EXPIRY_BATCH_SIZE: int = 50
+    EXPIRY_RELOAD_INTERVAL: float = 30.0
     model_config = SettingsConfigDict(env_file=".env")
 
 
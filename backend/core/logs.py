@@ -0,0 +1,165 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from core.config import settings
+from core.monitoring import LOG_DROPPED
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EXTRA_FIELDS = ("status", "ip", "img_filename", "path")
+
+
+def dumps(record: dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(record, default=str).decode()
+    return json.dumps(record, default=str, separators=(",", ":"))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        log_record = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                log_record[field] = value
+        if record.exc_text:
+            log_record["exc_info"] = record.exc_text
+        elif record.exc_info:
+            log_record["exc_info"] = self.formatException(record.exc_info)
+        return dumps(log_record)
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps a fraction of INFO-and-below records per logger prefix ("imghost.background": 0.1); the longest
+    # matching prefix wins. Warnings and errors always pass.
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                return rate >= 1 or random.random() < rate
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    # The calling thread only resolves the message and enqueues; JSON encoding and the write to stdout
+    # happen on the listener thread. When the queue is full, "drop" discards the record right away and
+    # "block" waits up to block_timeout before discarding it. Either way it shows up in LOG_DROPPED.
+
+    def __init__(self, log_queue: queue.Queue, policy: str, block_timeout: float):
+        super().__init__(log_queue)
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown log queue policy: {policy}")
+        self.policy = policy
+        self.block_timeout = block_timeout
+        # set once the listener is stopping; records are written on the calling thread from then on
+        self.direct: Optional[logging.Handler] = None
+
+    def emit(self, record):
+        if self.direct is not None:
+            self.direct.handle(record)
+        else:
+            super().emit(record)
+
+    def prepare(self, record):
+        # the base class formats here, on the caller; only do what must happen before the record crosses
+        # threads: bake in the args and render any traceback while the frames still exist
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == "block":
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # the base class uses put_nowait, which fails on a full queue; the listener is draining it anyway
+        self.queue.put(self._sentinel)
+
+
+_handler: Optional[BoundedQueueHandler] = None
+_listener: Optional[DrainingQueueListener] = None
+
+
+def stream_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def _start_listener() -> None:
+    global _listener
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _handler.queue = log_queue
+    _listener = DrainingQueueListener(log_queue, stream_handler())
+    _listener.start()
+
+
+def _after_fork_in_child() -> None:
+    # a forked child (gunicorn workers with preload, processing pool workers) inherits the queue but not
+    # the listener thread, so it gets a fresh pair of its own
+    if _listener is not None:
+        _start_listener()
+
+
+def setup_logging() -> None:
+    global _handler
+    if _handler is not None:
+        return
+
+    _handler = BoundedQueueHandler(queue.Queue(), settings.LOG_QUEUE_POLICY, settings.LOG_QUEUE_BLOCK_TIMEOUT)
+    if settings.LOG_SAMPLE_RATES:
+        _handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+    _start_listener()
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+    logger = logging.getLogger("imghost")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(_handler)
+
+    uvicorn_logger = logging.getLogger("uvicorn.access")
+    uvicorn_logger.handlers = [_handler]
+    uvicorn_logger.setLevel(logging.WARNING)
+
+
+def stop_logging() -> None:
+    # runs at exit: drains what is queued and joins the listener thread. Anything logged later, by other
+    # atexit hooks or threads still winding down, is written directly instead of into a queue nobody reads
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        _handler.direct = stream_handler()
+        listener.stop()
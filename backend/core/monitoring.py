@@ -1,27 +1,131 @@
 import time
-from prometheus_client import Counter, Histogram
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
-from starlette.responses import Response
+import logging
+import functools
+from contextlib import contextmanager
+from typing import Dict, Optional
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, push_to_gateway, start_http_server
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 UPLOAD_COUNT = Counter('imghost_uploads_total', 'Total number of successful uploads')
 DELETE_COUNT = Counter('imghost_deletes_total', 'Total number of successful deletes')
 ERROR_COUNT = Counter('imghost_errors_total', 'Total number of intersnal errors')
 REQUEST_LATENCY = Histogram(
-    'imghost_request_latency_seconds', 
-    'Request latency distribution', 
+    'imghost_request_latency_seconds',
+    'Request latency distribution',
+    ['method', 'route', 'status'],
     buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0)
 )
+EXPIRY_LAG = Histogram(
+    'imghost_expiry_lag_seconds',
+    'Delay between expires_at and the image actually being deleted',
+    buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0, 3600.0)
+)
+STAGE_LATENCY = Histogram(
+    'imghost_stage_seconds',
+    'Time spent in each stage of the upload, processing and cleanup pipelines',
+    ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+BYTES_IN = Histogram(
+    'imghost_upload_bytes',
+    'Size of uploaded files as received',
+    buckets=(16e3, 64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6)
+)
+BYTES_OUT = Histogram(
+    'imghost_stored_bytes',
+    'Size of processed images as stored',
+    buckets=(16e3, 64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6)
+)
+COMPRESSION_RATIO = Histogram(
+    'imghost_compression_ratio',
+    'Processed size over original size, 1.0 when the original was kept',
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+)
+LOG_DROPPED = Counter(
+    'imghost_log_records_dropped_total',
+    'Log records discarded because the logging queue was full'
+)
+PROCESSING_IN_FLIGHT = Gauge(
+    'imghost_processing_in_flight',
+    'Processing jobs holding an executor slot, running or waiting for a worker process'
+)
+
+
+def stage(name: str):
+    # `with stage("s3_put"): ...` around sync or async code
+    return STAGE_LATENCY.labels(name).time()
+
+
+def timed_stage(name: str):
+    # decorator form for coroutine functions
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def clock(timings: Dict[str, float], name: str):
+    # for work in processing worker processes, their metrics never reach the server's registry:
+    # collect timings into a dict, send it back with the result and hand it to observe_stages()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def observe_stages(timings: Optional[Dict[str, float]]) -> None:
+    for name, seconds in (timings or {}).items():
+        STAGE_LATENCY.labels(name).observe(seconds)
+
+
+def serve_metrics(port: Optional[int]) -> None:
+    # long-running processes without the API's /metrics route (the queue worker) get a scrape endpoint
+    # of their own on a background thread
+    if port is None:
+        return
+    try:
+        start_http_server(port)
+    except OSError as e:
+        logging.getLogger("imghost").warning(f"Could not serve metrics on port {port}: {e}")
+
+
+def push_metrics(gateway: Optional[str], job: str) -> None:
+    # batch jobs (cleanup.py) exit before any scrape would find them, they push once at the end instead
+    if gateway is None:
+        return
+    try:
+        push_to_gateway(gateway, job=job, registry=REGISTRY)
+    except Exception as e:
+        logging.getLogger("imghost").warning(f"Could not push metrics to {gateway}: {e}")
+
+
+class PrometheusMiddleware:
+    # plain ASGI: no per-request task or response buffering, streaming responses pass straight through
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
         start_time = time.perf_counter()
-        response = await call_next(request)
-        end_time = time.perf_counter()
-        
-        if request.url.path != "/metrics":
-            REQUEST_LATENCY.observe(end_time - start_time)
-            
-        return response
-    
-    
\ No newline at end of file
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the route template, not the raw path, so /i/{key} stays one series
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_LATENCY.labels(scope["method"], route, str(status_code)).observe(time.perf_counter() - start_time)
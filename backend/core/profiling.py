@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+
+class StackProfile:
+    def __init__(self, stacks: Counter, samples: int, duration: float, sampling_seconds: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+        # time the sampler itself spent walking stacks, the profile's own overhead
+        self.sampling_seconds = sampling_seconds
+
+    def collapsed(self) -> str:
+        # Brendan Gregg's folded format: "root;caller;callee count", read by flamegraph.pl, speedscope, etc.
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class StackSampler:
+    # Pure-Python wall-clock sampler: a daemon thread snapshots every other thread's stack via
+    # sys._current_frames() each interval. Nothing is hooked while it isn't running, and only one capture
+    # runs per process. Processing pool workers are separate processes and are not included.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def capture(self, seconds: float, interval: float) -> Optional[StackProfile]:
+        # blocking, run it off the event loop. Returns None when a capture is already running
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(seconds, interval)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float) -> StackProfile:
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        stacks: Counter = Counter()
+        samples = 0
+        sampling = 0.0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            tick = time.perf_counter()
+            if tick >= deadline:
+                break
+            names.update((t.ident, t.name) for t in threading.enumerate() if t.ident is not None)
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    stacks[self._fold(names.get(ident, str(ident)), frame)] += 1
+            samples += 1
+            spent = time.perf_counter() - tick
+            sampling += spent
+            time.sleep(max(interval - spent, 0))
+        return StackProfile(stacks, samples, time.perf_counter() - start, sampling)
+
+    @staticmethod
+    def _fold(thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(f"thread {thread_name}")
+        return ";".join(reversed(frames))
+
+
+stack_sampler = StackSampler()
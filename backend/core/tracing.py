@@ -0,0 +1,37 @@
+from typing import Any, Dict, Optional
+import sentry_sdk
+from core.config import settings
+
+
+def route_rate(path: str, rules: Dict[str, float]) -> Optional[float]:
+    # longest prefix on a segment boundary, so "/health" covers "/health/live" but not "/healthz"
+    best = None
+    for prefix, rate in rules.items():
+        prefix = prefix.rstrip("/") or "/"
+        if path == prefix or path.startswith(prefix if prefix == "/" else prefix + "/"):
+            if best is None or len(prefix) > len(best[0]):
+                best = (prefix, rate)
+    return best[1] if best else None
+
+
+def traces_sampler(sampling_context: Dict[str, Any]) -> float:
+    path = (sampling_context.get("asgi_scope") or {}).get("path")
+    rate = route_rate(path, settings.SENTRY_TRACE_RULES) if path else None
+    if rate is not None:
+        return rate
+    # keep distributed traces whole when the caller already decided
+    parent = sampling_context.get("parent_sampled")
+    if parent is not None:
+        return float(parent)
+    return settings.SENTRY_TRACES_SAMPLE_RATE
+
+
+def init_sentry() -> None:
+    sentry_sdk.init(
+        dsn=settings.SENTRY_DSN,
+        send_default_pii=True,
+        enable_logs=True,
+        traces_sampler=traces_sampler,
+        profile_session_sample_rate=settings.SENTRY_PROFILE_SESSION_SAMPLE_RATE,
+        profile_lifecycle="trace",
+    )
@@ -0,0 +1,73 @@
+import logging
+from datetime import date, datetime, timezone, timedelta
+from typing import Iterable, List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from db.session import engine
+
+logger = logging.getLogger("imghost.partitions")
+
+PARTITIONS_AHEAD_DAYS = 7
+PARTITION_PREFIX = "images_p"
+# catches rows for days that have no partition yet, so an insert never fails for want of one
+DEFAULT_PARTITION = "images_default"
+# API workers starting up and the cleanup job all create partitions, one at a time
+PARTITION_LOCK_KEY = 0x696D6770
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def days_ahead(today: date) -> List[date]:
+    return [today + timedelta(days=offset) for offset in range(-1, PARTITIONS_AHEAD_DAYS + 1)]
+
+
+async def list_partitions(conn: AsyncConnection) -> List[str]:
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'images'::regclass"
+    ))
+    return sorted(result.scalars().all())
+
+
+async def ensure_partitions(conn: AsyncConnection, days: Iterable[date]) -> None:
+    # the default partition plus one per day; runs inside the caller's transaction
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF images DEFAULT"))
+    existing = set(await list_partitions(conn))
+
+    for day in days:
+        name = partition_name(day)
+        if name in existing:
+            continue
+        bounds = f"FROM ('{day.isoformat()} 00:00:00+00') TO ('{(day + timedelta(days=1)).isoformat()} 00:00:00+00')"
+        window = {"start": datetime(day.year, day.month, day.day, tzinfo=timezone.utc)}
+        window["end"] = window["start"] + timedelta(days=1)
+        strays = await conn.scalar(
+            text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE uploaded_at >= :start AND uploaded_at < :end)"),
+            window
+        )
+        if not strays:
+            await conn.execute(text(f"CREATE TABLE {name} PARTITION OF images FOR VALUES {bounds}"))
+            continue
+
+        # Postgres refuses a partition whose rows sit in the default one, so they move over before it's attached
+        await conn.execute(text(f"CREATE TABLE {name} (LIKE images INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        moved = await conn.execute(
+            text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE uploaded_at >= :start AND uploaded_at < :end "
+                f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+            ),
+            window
+        )
+        await conn.execute(text(f"ALTER TABLE images ATTACH PARTITION {name} FOR VALUES {bounds}"))
+        logger.info(f"Moved {moved.rowcount} rows from {DEFAULT_PARTITION} into {name}")
+
+
+async def create_partitions_ahead(today: Optional[date] = None) -> None:
+    # keeps a week of partitions ready, rows only land in the default partition if this stops running
+    today = today or datetime.now(timezone.utc).date()
+    async with engine.begin() as conn:
+        await ensure_partitions(conn, days_ahead(today))
+    logger.info(f"Partitions ensured through {today + timedelta(days=PARTITIONS_AHEAD_DAYS)}")
@@ -1,50 +1,24 @@
 from fastapi import FastAPI
-import sentry_sdk
 from starlette.middleware.cors import CORSMiddleware
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from db.session import limiter, custom_key_func
-from api.routes import upload, health
+from api.routes import upload, health, serve, admin
 from core.monitoring import PrometheusMiddleware
+from core.tracing import init_sentry
+from core.logs import setup_logging
 from services.cloudflare import close_client
-import logging, sys, json, os
-from datetime import datetime, timezone
+from services.executor import processing_executor
+from services.storage import storage_service
+from services.expiry import expiry_scheduler
+from services.status import status_writer
+from services.health import health_prober
+from db.partitions import create_partitions_ahead
+import logging
 
-class JsonFormatter(logging.Formatter):
-    def format(self, record):
-        log_record = {
-            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
-            "level": record.levelname,
-            "name": record.name,
-            "message": record.getMessage(),
-            "status": getattr(record, 'status', None),
-            "ip": getattr(record, 'ip', None),
-            "img_filename": getattr(record, 'img_filename', None),
-            }
-        return json.dumps({k: v for k, v in log_record.items() if v is not None})
-    
-def setup_logging():
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(JsonFormatter())
-    
-    logger = logging.getLogger("imghost")
-    logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
-    
-    uvicorn_logger = logging.getLogger("uvicorn.access")
-    uvicorn_logger.handlers = [handler]
-    uvicorn_logger.setLevel(logging.WARNING)
-    
 setup_logging()
 
-sentry_sdk.init(
-    dsn=os.getenv("SENTRY_DSN"),
-    send_default_pii=True,
-    enable_logs=True,
-    traces_sample_rate=0.7,
-    profile_session_sample_rate=1.0,
-    profile_lifecycle="trace",
-)
+init_sentry()
 
 
 app = FastAPI(
@@ -75,13 +49,30 @@ async def rate_limit_exceeded_handler(request, exc):
 
 app.include_router(upload.router)
 app.include_router(health.router)
+app.include_router(serve.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def root():
     return {"message": "Image Host API Running"}
 
+@app.on_event("startup")
+async def startup_event():
+    try:
+        await create_partitions_ahead()
+    except Exception as e:
+        # not fatal: the cleanup job creates them too, and the default partition takes rows meanwhile
+        logging.getLogger("imghost").error(f"Could not create partitions at startup: {e}")
+    health_prober.start()
+    expiry_scheduler.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
+    await expiry_scheduler.stop()
+    await health_prober.stop()
+    await processing_executor.shutdown()
+    await status_writer.close()
     await close_client()
+    await storage_service.close()
 
 
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from sqlalchemy import text
+from db.session import engine
+from db.partitions import days_ahead, ensure_partitions, list_partitions
+from models.image import Image
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("migrate_partitions")
+
+# One-off move of an unpartitioned images table (from before partitioning) to the day-partitioned layout.
+# Everything happens in one transaction that holds an exclusive lock on images while rows are copied, so
+# stop the API, queue workers and cleanup first. Running it again is harmless. It comes after
+# migrate_schema.py, which has the full rollout order.
+
+OLD_TABLE = "images_unpartitioned"
+
+
+async def migrate(keep_old: bool = False) -> None:
+    today = datetime.now(timezone.utc).date()
+    async with engine.begin() as conn:
+        if await conn.scalar(text("SELECT to_regclass('images')")) is None:
+            logger.info("No images table, nothing to migrate")
+            return
+        partitioned = await conn.scalar(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'images'::regclass)"
+        ))
+        if partitioned:
+            await ensure_partitions(conn, days_ahead(today))
+            logger.info("images is already partitioned")
+            return
+
+        await conn.execute(text("LOCK TABLE images IN ACCESS EXCLUSIVE MODE"))
+        await conn.execute(text(f"ALTER TABLE images RENAME TO {OLD_TABLE}"))
+        # index names are unique per schema, the new table's would clash with the old ones
+        result = await conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": OLD_TABLE})
+        for name in result.scalars().all():
+            await conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_old"'))
+        await conn.run_sync(Image.__table__.create)
+
+        result = await conn.execute(text(f"SELECT DISTINCT (uploaded_at AT TIME ZONE 'UTC')::date FROM {OLD_TABLE}"))
+        await ensure_partitions(conn, sorted(set(result.scalars().all()) | set(days_ahead(today))))
+        # the old table may predate columns added since, those take their defaults
+        result = await conn.execute(
+            text("SELECT column_name FROM information_schema.columns WHERE table_name = :table"),
+            {"table": OLD_TABLE}
+        )
+        existing = set(result.scalars().all())
+        columns = ", ".join(column.name for column in Image.__table__.columns if column.name in existing)
+        copied = await conn.execute(text(f"INSERT INTO images ({columns}) SELECT {columns} FROM {OLD_TABLE}"))
+        logger.info(f"Copied {copied.rowcount} rows into {len(await list_partitions(conn))} partitions")
+
+        if not keep_old:
+            await conn.execute(text(f"DROP TABLE {OLD_TABLE}"))
+    logger.info("Migration complete" + (f", the old rows are kept in {OLD_TABLE}" if keep_old else ""))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Convert the images table to daily range partitions")
+    parser.add_argument("--keep-old", action="store_true", help=f"keep the original table as {OLD_TABLE}")
+    args = parser.parse_args()
+    try:
+        await migrate(args.keep_old)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from sqlalchemy import text
+from db.session import engine
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("migrate_schema")
+
+# Brings a database created before the processing queue up to the current models. Every statement is
+# idempotent, so running it again is harmless.
+#
+# Rollout order for an existing deployment (the deploy workflow restarts the API on every push to main,
+# so do this before merging):
+#   1. stop the API, queue workers and the cleanup job
+#   2. python migrate_schema.py
+#   3. python migrate_partitions.py
+#   4. deploy the new code, start the API, then the queue workers and the cleanup job
+#
+# Adding a column with a constant default doesn't rewrite the table; the index builds block writes to
+# images while they run, hence step 1.
+
+SCHEMA_CHANGES = [
+    # durable processing queue (worker.py)
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS process_attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS process_after TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS process_error VARCHAR",
+    "CREATE INDEX IF NOT EXISTS idx_process_queue ON images (process_after) WHERE is_processed = false AND deleted_at IS NULL",
+    # processed variants
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS variants JSONB",
+    # sliding-window upload quota
+    "CREATE INDEX IF NOT EXISTS idx_ip_uploaded_at ON images (ip_address, uploaded_at)",
+    # deduplication by content hash
+    "ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS idx_object_url ON images (object_url)",
+    """
+    CREATE TABLE IF NOT EXISTS stored_objects (
+        content_hash VARCHAR(64) PRIMARY KEY,
+        object_key VARCHAR NOT NULL,
+        ref_count INTEGER NOT NULL DEFAULT 1,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+
+async def migrate() -> None:
+    async with engine.begin() as conn:
+        if await conn.scalar(text("SELECT to_regclass('images')")) is None:
+            logger.info("No images table, nothing to migrate")
+            return
+        for statement in SCHEMA_CHANGES:
+            await conn.execute(text(statement))
+    logger.info(f"Applied {len(SCHEMA_CHANGES)} schema changes")
+
+
+async def main():
+    try:
+        await migrate()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,19 +1,23 @@
 import uuid
 from sqlalchemy import String, Integer, TIMESTAMP, text, Boolean, Index
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from db.session import Base
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# longest expiry an upload can ask for, plus slack for slow uploads. Every live row was uploaded within this
+# window, so bounding uploaded_at by it lets queries prune to the newest partitions
+MAX_IMAGE_LIFETIME = timedelta(hours=25)
 
 class Image(Base):
     __tablename__ = "images"
     
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, server_default=text("uuid_generate_v4()"))
-    filename: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    filename: Mapped[str] = mapped_column(String, nullable=False)
     object_url: Mapped[str] = mapped_column(String, nullable=False)
     size_bytes: Mapped[str] = mapped_column(Integer, nullable=False)
     mime_type: Mapped[str] = mapped_column(String, nullable=False)
-    uploaded_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+    uploaded_at: Mapped[str] = mapped_column(TIMESTAMP(timezone=True), primary_key=True, nullable=False, server_default=text("now()"))
     expires_at: Mapped[datetime] = mapped_column(
         TIMESTAMP(timezone=True), 
         nullable=False, 
@@ -22,16 +26,37 @@ class Image(Base):
     
     is_processed: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     thumbnail_url: Mapped[str | None] = mapped_column(String, nullable=True)
+    variants: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
     ip_address: Mapped[str | None] = mapped_column(String(45), nullable=False)
     deleted_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    process_attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=text("0"))
+    process_after: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    process_error: Mapped[str | None] = mapped_column(String, nullable=True)
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
     
+    # range-partitioned by day on uploaded_at, see db/partitions.py. Partitions are created at startup and by
+    # cleanup.py, which also drops them; migrate_partitions.py converts an unpartitioned table.
+    # Unique indexes on a partitioned table have to include the partition key
     __table_args__ = (
+        Index('uq_filename_uploaded_at', filename, uploaded_at, unique=True),
         Index('idx_expires_at', expires_at),
         Index('idx_deleted_at', deleted_at),
-        Index('idx_is_processed', is_processed)
+        Index('idx_is_processed', is_processed),
+        Index('idx_ip_uploaded_at', ip_address, uploaded_at),
+        Index('idx_object_url', object_url),
+        Index(
+            'idx_process_queue',
+            process_after,
+            postgresql_where=text("is_processed = false AND deleted_at IS NULL")
+        ),
+        {"postgresql_partition_by": "RANGE (uploaded_at)"},
     )
      
     def __repr__(self) -> str:
         return f"<Image(id={self.id}, filename='{self.filename}')>"
+
+
+def live_since(now: datetime) -> datetime:
+    return now - MAX_IMAGE_LIFETIME
     
     
\ No newline at end of file
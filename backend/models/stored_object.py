@@ -0,0 +1,15 @@
+from sqlalchemy import String, Integer, TIMESTAMP, text
+from sqlalchemy.orm import Mapped, mapped_column
+from db.session import Base
+from datetime import datetime
+
+class StoredObject(Base):
+    __tablename__ = "stored_objects"
+    
+    content_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    object_key: Mapped[str] = mapped_column(String, nullable=False)
+    ref_count: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default=text("1"))
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), nullable=False, server_default=text("now()"))
+     
+    def __repr__(self) -> str:
+        return f"<StoredObject(content_hash='{self.content_hash}', object_key='{self.object_key}', ref_count={self.ref_count})>"
@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+from core.config import settings
+
+logger = logging.getLogger("imghost.cache")
+
+DISK_RESCAN_INTERVAL = 30.0
+
+
+class ObjectCache:
+    # Two tiers for served objects: a byte-bounded in-memory LRU in front of a size-bounded directory.
+    # The directory can be shared by every worker on a host; eviction rescans it, oldest mtime goes first
+    # and reads bump mtime. Keys must change whenever the stored bytes do.
+
+    def __init__(self, memory_bytes: int, max_object_bytes: int, disk_dir: Optional[str], disk_bytes: int):
+        self.memory_bytes = memory_bytes
+        self.max_object_bytes = max_object_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._disk_used: Optional[int] = None
+        self._last_scan = 0.0
+        self._evict_lock = asyncio.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_object_bytes or len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        os.makedirs(self.disk_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _evict_disk(self) -> int:
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        used = sum(size for _, size, _ in entries)
+        if used > self.disk_bytes:
+            entries.sort()
+            low_water = int(self.disk_bytes * 0.9)
+            for _, size, path in entries:
+                if used <= low_water:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                used -= size
+        return used
+
+    async def _maybe_evict_disk(self, added: int) -> None:
+        if self._disk_used is not None:
+            self._disk_used += added
+        stale = time.monotonic() - self._last_scan > DISK_RESCAN_INTERVAL
+        if self._disk_used is not None and self._disk_used <= self.disk_bytes and not stale:
+            return
+        if self._evict_lock.locked():
+            return
+        async with self._evict_lock:
+            try:
+                self._disk_used = await asyncio.to_thread(self._evict_disk)
+                self._last_scan = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Disk cache eviction failed: {e}")
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            return data
+        if not self.disk_dir:
+            return None
+        try:
+            data = await asyncio.to_thread(self._read_disk, key)
+        except Exception as e:
+            logger.warning(f"Disk cache read failed for {key}: {e}")
+            return None
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    def fits(self, size: int) -> bool:
+        # whether put() would keep an object this size in either tier
+        in_memory = size <= self.max_object_bytes and size <= self.memory_bytes
+        return in_memory or bool(self.disk_dir and size <= self.disk_bytes)
+
+    async def put(self, key: str, data: bytes) -> None:
+        self._remember(key, data)
+        if not self.disk_dir or len(data) > self.disk_bytes:
+            return
+        try:
+            await asyncio.to_thread(self._write_disk, key, data)
+        except Exception as e:
+            logger.warning(f"Disk cache write failed for {key}: {e}")
+            return
+        await self._maybe_evict_disk(len(data))
+
+
+def object_cache_key(object_key: str, size: Optional[int], mime_type: Optional[str]) -> str:
+    # reprocessing rewrites the object under the same key but always changes size or type
+    return f"{object_key}:{size}:{mime_type}"
+
+
+object_cache = ObjectCache(
+    memory_bytes=settings.ORIGIN_CACHE_MEMORY_BYTES,
+    max_object_bytes=settings.ORIGIN_CACHE_MAX_OBJECT_BYTES,
+    disk_dir=settings.ORIGIN_CACHE_DIR,
+    disk_bytes=settings.ORIGIN_CACHE_DISK_BYTES,
+)
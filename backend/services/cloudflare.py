@@ -1,9 +1,11 @@
 import os 
+import time
 import asyncio
 import logging
 import httpx # type: ignore
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Set
 from core.config import settings
+from core.monitoring import timed_stage
 
 logger = logging.getLogger("cloudflare")
 
@@ -12,6 +14,8 @@ CF_ZONE_ID = settings.CF_ZONE_ID
 MAX_PURGE_BATCH = 30
 MAX_RETRIES = 5
 BACKOFF_BASE = float(0.5)
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+FLUSH_TIMEOUT = 10.0
 
 _client: Optional[httpx.AsyncClient] = None
 _client_lock = asyncio.Lock()
@@ -24,8 +28,132 @@ async def _get_client() -> httpx.AsyncClient:
                 _client = httpx.AsyncClient(timeout=10.0)
     return _client
                 
-async def close_client() -> None:
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PurgeDispatcher:
+    # Every caller's URLs go through one bounded queue. A collector waits up to the debounce window to fill a
+    # batch of MAX_PURGE_BATCH, then hands it to a sender; senders run concurrently but each API call takes a
+    # token first, so the zone stays under Cloudflare's rate limit. A retrying batch only holds its own sender.
+
+    def __init__(self, queue_size: int, debounce: float, concurrency: int, rate: float, burst: int):
+        self.queue_size = queue_size
+        self.debounce = debounce
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._senders: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _ensure_started(self) -> None:
+        if self._collector is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._collector = asyncio.create_task(self._collect())
+
+    async def submit(self, urls: List[str]) -> None:
+        # waits while the queue is full, that's the memory bound
+        self._ensure_started()
+        for url in urls:
+            await self._queue.put(url)
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = {await self._queue.get(): None}
+            taken = 1
+            deadline = loop.time() + self.debounce
+            while len(batch) < MAX_PURGE_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    url = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch[url] = None
+                taken += 1
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(list(batch), taken))
+            self._senders.add(task)
+            task.add_done_callback(self._senders.discard)
+
+    async def _send(self, batch: List[str], taken: int) -> None:
+        try:
+            for attempt in range(MAX_RETRIES):
+                await self.bucket.acquire()
+                try:
+                    resp = await purge_cache(batch)
+                except httpx.RequestError as e:
+                    wait = BACKOFF_BASE * (2 ** attempt)
+                    logger.warning("Cloudflare purge attempt %d failed with exception, retrying in %.1fs: %s", attempt + 1, wait, e)
+                    await asyncio.sleep(wait)
+                    continue
+
+                status = resp.get("status_code")
+                body = resp.get("body")
+                if status == 200 and isinstance(body, dict) and body.get("success", False):
+                    logger.info("Cloudflare purge success for %d URLs", len(batch))
+                    return
+                if status in RETRYABLE_STATUSES:
+                    wait = resp.get("retry_after") or BACKOFF_BASE * (2 ** attempt)
+                    logger.warning("Cloudflare purge attempt %d failed (status=%s), retrying in %.1fs: %s", attempt + 1, status, wait, body)
+                    await asyncio.sleep(wait)
+                    continue
+                logger.error("Cloudflare purge failed (status=%s): %s", status, body)
+                return
+            logger.error("Cloudflare purge failed after %d attempts for batch of %d URLs", MAX_RETRIES, len(batch))
+        finally:
+            self._slots.release()
+            for _ in range(taken):
+                self._queue.task_done()
+
+    async def flush(self, timeout: Optional[float] = FLUSH_TIMEOUT) -> None:
+        # sends what is queued, giving up after timeout; None waits for the queue to drain however long it takes
+        if self._collector is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Cloudflare purge flush timed out with %d URLs queued", self._queue.qsize())
+        self._collector.cancel()
+        for task in (self._collector, *self._senders):
+            task.cancel()
+        await asyncio.gather(self._collector, *self._senders, return_exceptions=True)
+        self._collector = None
+
+
+purge_dispatcher = PurgeDispatcher(
+    queue_size=settings.CF_PURGE_QUEUE_SIZE,
+    debounce=settings.CF_PURGE_DEBOUNCE,
+    concurrency=settings.CF_PURGE_CONCURRENCY,
+    rate=settings.CF_PURGE_RATE,
+    burst=settings.CF_PURGE_BURST,
+)
+
+
+async def close_client(flush_timeout: Optional[float] = FLUSH_TIMEOUT) -> None:
     global _client
+    await purge_dispatcher.flush(flush_timeout)
     if _client is not None:
         try:
             await _client.aclose()
@@ -34,8 +162,9 @@ async def close_client() -> None:
         finally:
             _client = None
 
+@timed_stage("cdn_purge")
 async def purge_cache(urls: List[str]) -> Dict[str, Any]:
-    endpoint = f"https://api.cloudflare.com/client/v4/zones/{CF_ZONE_ID}/purge_cache"
+    endpoint = f"{settings.CF_API_BASE_URL}/zones/{CF_ZONE_ID}/purge_cache"
     headers = {
         "Authorization": f"Bearer {CF_API_TOKEN}",
         "Content-Type": "application/json"
@@ -48,38 +177,12 @@ async def purge_cache(urls: List[str]) -> Dict[str, Any]:
         body = resp.json()
     except Exception:
         body = {"success": False, "status_code": resp.status_code, "text": resp.text}
-    return {"status_code": resp.status_code, "body": body}
+    try:
+        retry_after = float(resp.headers.get("retry-after", ""))
+    except ValueError:
+        retry_after = None
+    return {"status_code": resp.status_code, "body": body, "retry_after": retry_after}
         
-async def purge_urls(urls: List[str]) -> List[dict]:
-    results: List[Dict] = []
-    batches = [urls[i:i + MAX_PURGE_BATCH] for i in range(0, len(urls), MAX_PURGE_BATCH)]
-    for batch in batches:
-        attempt = 0
-        while attempt < MAX_RETRIES:
-            try:
-                resp = await purge_cache(batch)
-                status = resp.get("status_code")
-                body = resp.get("body")
-                
-                if status == 200 and isinstance(body, dict) and body.get("success", False):
-                    logger.info("Cloudflare purge success for %d URLs", len(batch))
-                    results.append({"batch": batch, "success": True, "response": body})
-                    break
-                if status in (429, 500, 502, 503, 504) or not (isinstance(body, dict) and body.get("success", False)):
-                    wait = BACKOFF_BASE * (2 ** attempt)
-                    logger.warning("Cloudflare purge attempt %d failed (status=%s), retrying in %.1fs: %s", attempt + 1, status, wait, body)
-                    await asyncio.sleep(wait)
-                    attempt += 1
-                    continue
-                logger.error("Cloudflare purge failed (status=%s): %s", status, body)
-                results.append({"batch": batch, "success": False, "response": body})
-                break
-            except httpx.RequestError as e:
-                wait = BACKOFF_BASE * (2 ** attempt)
-                logger.warning("Cloudflare purge attempt %d failed with exception, retrying in %.1fs: %s", attempt + 1, wait, e)
-                await asyncio.sleep(wait)
-                attempt += 1
-        else:
-            logger.error("Cloudflare purge failed after %d attempts for batch of %d URLs", MAX_RETRIES, len(batch))
-            results.append({"batch": batch, "success": False, "response": "max retries exceeded"})
-    return results
\ No newline at end of file
+async def purge_urls(urls: List[str]) -> None:
+    # queued, the dispatcher coalesces them with everyone else's and sends them shortly
+    await purge_dispatcher.submit(urls)
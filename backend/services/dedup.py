@@ -0,0 +1,113 @@
+import logging
+from datetime import datetime, timezone
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.session import AsyncSessionLocal
+from models.image import Image, live_since
+from models.stored_object import StoredObject
+from core.monitoring import timed_stage
+
+logger = logging.getLogger("imghost.dedup")
+
+# stored_objects maps a content hash to the object holding those bytes plus the number of live image rows
+# pointing at it. An image row only counts as a reference when its content_hash is set. A count that
+# reached zero is deleted in the same statement batch, so a reference can never revive it. References are
+# taken and registered in the upload's own transaction, a failed or cancelled upload leaves no count behind.
+
+
+class Duplicate(NamedTuple):
+    content_hash: str
+    object_key: str
+    size_bytes: int
+    mime_type: str
+    variants: dict
+
+
+@timed_stage("dedup_lookup")
+async def find_duplicate(content_hash: str) -> Optional[Duplicate]:
+    # only a lookup, the upload transaction takes the reference with take_references()
+    async with AsyncSessionLocal() as session:
+        object_key = await session.scalar(
+            select(StoredObject.object_key)
+            .where(StoredObject.content_hash == content_hash, StoredObject.ref_count > 0)
+        )
+        if object_key is None:
+            return None
+
+        row = (await session.execute(
+            select(Image.size_bytes, Image.mime_type, Image.variants)
+            .where(
+                Image.object_url == f"s3://{object_key}",
+                Image.deleted_at.is_(None),
+                Image.uploaded_at >= live_since(datetime.now(timezone.utc)),
+            )
+            .limit(1)
+        )).first()
+        if row is None:
+            # every row referencing it is being expired right now
+            return None
+
+    logger.info(f"Upload deduplicated onto {object_key}")
+    return Duplicate(content_hash, object_key, row.size_bytes, row.mime_type, row.variants or {})
+
+
+def group_by_count(counts: Counter) -> Dict[int, List[str]]:
+    # hashes needing the same change go in one statement
+    by_count = defaultdict(list)
+    for content_hash, count in counts.items():
+        by_count[count].append(content_hash)
+    return by_count
+
+
+async def take_references(session: AsyncSession, content_hashes: Iterable[str]) -> Set[str]:
+    # one reference per hash occurrence, inside the upload transaction; returns the hashes that got theirs.
+    # The row lock holds off an expiry releasing the last reference until the upload commits or rolls back
+    counts = Counter(content_hashes)
+    referenced = set()
+    for count, hashes in group_by_count(counts).items():
+        result = await session.execute(
+            update(StoredObject)
+            .where(StoredObject.content_hash.in_(hashes), StoredObject.ref_count > 0)
+            .values(ref_count=StoredObject.ref_count + count)
+            .returning(StoredObject.content_hash)
+        )
+        referenced.update(result.scalars().all())
+    return referenced
+
+
+async def register_objects(session: AsyncSession, objects: List[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+    # (content_hash, object_key) pairs in one statement inside the upload transaction, returns the pairs that
+    # got registered. Losers (an identical upload elsewhere, or earlier in the same batch) stay untracked
+    if not objects:
+        return set()
+    result = await session.execute(
+        insert(StoredObject)
+        .values([{"content_hash": content_hash, "object_key": object_key, "ref_count": 1} for content_hash, object_key in objects])
+        .on_conflict_do_nothing(index_elements=[StoredObject.content_hash])
+        .returning(StoredObject.content_hash, StoredObject.object_key)
+    )
+    return {tuple(row) for row in result.all()}
+
+
+async def release_references(session: AsyncSession, content_hashes: Iterable[str]) -> List[str]:
+    # drops one reference per hash occurrence, returns the object keys nobody references any more
+    counts = Counter(content_hashes)
+    if not counts:
+        return []
+
+    for count, hashes in group_by_count(counts).items():
+        await session.execute(
+            update(StoredObject)
+            .where(StoredObject.content_hash.in_(hashes))
+            .values(ref_count=StoredObject.ref_count - count)
+        )
+
+    result = await session.execute(
+        delete(StoredObject)
+        .where(StoredObject.content_hash.in_(list(counts)), StoredObject.ref_count <= 0)
+        .returning(StoredObject.object_key)
+    )
+    return list(result.scalars().all())
@@ -0,0 +1,63 @@
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+from core.config import settings
+
+# bits per pixel under which re-encoding a lossy source rarely clears MIN_REDUCTION_PCT
+LOSSY_SKIP_BPP = {"JPEG": 1.2, "MPO": 1.2, "HEIF": 0.9, "WEBP": 2.0}
+# above this many output pixels method 6 costs a lot more than it saves
+LARGE_IMAGE_PIXELS = 4_000_000
+
+
+class EncodingDecision(NamedTuple):
+    skip: bool
+    quality: int
+    method: int
+    reason: str
+
+
+class ImageSignals(NamedTuple):
+    source_format: Optional[str]
+    size: Tuple[int, int]
+    target_size: Tuple[int, int]
+    source_bytes: int
+    has_alpha: bool
+    # EXIF/XMP/comments in the source, a skip serves the source bytes as uploaded
+    has_metadata: bool
+
+    @property
+    def resized(self) -> bool:
+        return self.target_size != self.size
+
+    @property
+    def bits_per_pixel(self) -> float:
+        return self.source_bytes * 8 / max(self.size[0] * self.size[1], 1)
+
+
+def fixed_policy(signals: ImageSignals) -> EncodingDecision:
+    return EncodingDecision(False, 85, 6, "fixed")
+
+
+def adaptive_policy(signals: ImageSignals) -> EncodingDecision:
+    skip_bpp = LOSSY_SKIP_BPP.get(signals.source_format or "")
+    if not signals.resized and not signals.has_metadata and skip_bpp is not None and signals.bits_per_pixel < skip_bpp:
+        return EncodingDecision(True, 0, 0, f"{signals.source_format} already compact ({signals.bits_per_pixel:.2f} bpp)")
+
+    quality = settings.WEBP_QUALITY
+    if signals.has_alpha:
+        # alpha edges band early at lower quality
+        quality = max(quality, 90)
+
+    width, height = signals.target_size
+    method = settings.WEBP_METHOD
+    if width * height > LARGE_IMAGE_PIXELS:
+        method = min(method, 4)
+    return EncodingDecision(False, quality, method, "adaptive")
+
+
+POLICIES: Dict[str, Callable[[ImageSignals], EncodingDecision]] = {
+    "fixed": fixed_policy,
+    "adaptive": adaptive_policy,
+}
+
+
+def choose_encoding(signals: ImageSignals, policy: Optional[str] = None) -> EncodingDecision:
+    return POLICIES[policy or settings.ENCODING_POLICY](signals)
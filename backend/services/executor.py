@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from core.config import settings
+from core.monitoring import STAGE_LATENCY, PROCESSING_IN_FLIGHT
+
+logger = logging.getLogger("imghost.executor")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class _Orphaned(BaseException):
+    # raised out of _run when the caller was cancelled while its job was already running
+    def __init__(self, future: Future):
+        self.future = future
+
+
+class ProcessingExecutor:
+    # At most max_workers + queue_size jobs are outstanding, further callers wait for a slot.
+    # A job that overruns its timeout after it started recycles the pool: new jobs go to a fresh pool,
+    # jobs still queued on the old one are resubmitted once, and the ones already running there (the
+    # overrun included) finish with the old pool's workers, which exit after. A caller that is cancelled
+    # doesn't recycle anything: its job is dropped if still queued, or left to finish with the result discarded.
+
+    def __init__(self, max_workers: Optional[int] = None, queue_size: int = 32, job_timeout: float = 60.0):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"Started processing pool with {self.max_workers} workers")
+        return self._pool
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers + self.queue_size)
+        return self._slots
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        # ProcessPoolExecutor can't stop a running call; the pool is replaced instead and winds down on its own
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        timeout = self.job_timeout if timeout is None else timeout
+        slots = self._get_slots()
+
+        waited = time.perf_counter()
+        await slots.acquire()
+        orphaned: Optional[Future] = None
+        try:
+            STAGE_LATENCY.labels("processing_wait").observe(time.perf_counter() - waited)
+            with PROCESSING_IN_FLIGHT.track_inprogress():
+                return await self._run(fn, args, timeout)
+        except _Orphaned as e:
+            orphaned = e.future
+            raise asyncio.CancelledError() from None
+        finally:
+            if orphaned is None:
+                slots.release()
+            else:
+                # the job keeps its worker busy until it ends, so it keeps its slot until then too
+                loop = asyncio.get_running_loop()
+                orphaned.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+
+    async def _run(self, fn: Callable[..., Any], args: tuple, timeout: float) -> Any:
+        for attempt in range(2):
+            pool = self._get_pool()
+            future = pool.submit(fn, *args)
+            wrapped = asyncio.wrap_future(future)
+            # a job given up on (timed out or orphaned) still ends later, don't let its outcome go unretrieved
+            wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                # shielded, so the caller's cancellation never reaches the pool on its own
+                return await asyncio.wait_for(asyncio.shield(wrapped), timeout)
+            except asyncio.TimeoutError:
+                if not future.cancel() and not future.done():
+                    logger.warning(f"Processing job {getattr(fn, '__name__', fn)} overran, recycling pool")
+                    self._recycle(pool)
+                raise
+            except asyncio.CancelledError:
+                # shield() only passes a cancellation in from the job's own future, anything else is the caller's
+                if not wrapped.cancelled():
+                    # the caller went away. A queued job is dropped; a running one can't be stopped without
+                    # killing everyone else's jobs with the pool, so it finishes and its result is discarded
+                    if not future.cancel() and not future.done():
+                        raise _Orphaned(future)
+                    raise
+                # not ours: another job's timeout recycled the pool and cancelled this one while queued
+                if attempt:
+                    raise JobCancelled("Processing job was cancelled by a pool recycle") from None
+                logger.warning("Processing pool was recycled before the job started, resubmitting once")
+            except BrokenProcessPool:
+                if self._pool is pool:
+                    self._pool = None
+                    pool.shutdown(wait=False, cancel_futures=True)
+                if attempt:
+                    raise
+                logger.warning("Processing pool broke mid-job, resubmitting once")
+
+    async def shutdown(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await asyncio.to_thread(pool.shutdown, True, cancel_futures=True)
+
+
+processing_executor = ProcessingExecutor(
+    max_workers=settings.PROCESSING_WORKERS,
+    queue_size=settings.PROCESSING_QUEUE_SIZE,
+    job_timeout=settings.PROCESSING_JOB_TIMEOUT,
+)
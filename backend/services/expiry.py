@@ -0,0 +1,223 @@
+import time
+import heapq
+import uuid
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+from sqlalchemy import select, update, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.session import AsyncSessionLocal
+from models.image import Image, live_since
+from services.storage import storage_service
+from services.cloudflare import purge_urls
+from services.dedup import release_references
+from services.processing import variant_url
+from core.monitoring import EXPIRY_LAG, DELETE_COUNT, stage
+from core.config import settings
+
+logger = logging.getLogger("imghost.expiry")
+
+# anything beyond this many due rows is picked up by the next reload
+RELOAD_LIMIT = 10000
+ERROR_BACKOFF = 5.0
+
+
+async def claim_expired_batch(
+    session: AsyncSession,
+    now: datetime,
+    limit: int,
+    skip_ids: Iterable[uuid.UUID] = (),
+    ids: Optional[List[uuid.UUID]] = None,
+    since: Optional[datetime] = None,
+) -> list:
+    # soft-deletes a batch in one statement and hands back what it needs to clean up, old object_url included.
+    # SKIP LOCKED lets the scheduler in every worker and the cleanup job share the backlog. `since` bounds
+    # uploaded_at so the scan only touches recent partitions; the cleanup job leaves it open to catch rows
+    # that expired while nothing was running
+    expired = (
+        select(Image.id, Image.uploaded_at, Image.object_url)
+        .where(Image.expires_at < now, Image.deleted_at.is_(None))
+        .order_by(Image.expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    if ids is not None:
+        expired = expired.where(Image.id.in_(ids))
+    if since is not None:
+        expired = expired.where(Image.uploaded_at >= since)
+    skip_ids = list(skip_ids)
+    if skip_ids:
+        expired = expired.where(Image.id.not_in(skip_ids))
+    expired = expired.cte("expired")
+
+    result = await session.execute(
+        update(Image)
+        .where(Image.id == expired.c.id, Image.uploaded_at == expired.c.uploaded_at)
+        .values(deleted_at=func.now(), object_url="DELETED")
+        .returning(Image.id, Image.uploaded_at, Image.filename, expired.c.object_url, Image.variants, Image.content_hash, Image.expires_at)
+    )
+    return result.all()
+
+
+async def delete_claimed(session: AsyncSession, batch: list) -> Tuple[list, list]:
+    # removes the stored objects of a claimed batch, returns (deleted, reverted). Caller commits
+    # rows sharing a deduplicated object only drop their reference, the last one deletes the bytes
+    released = set(await release_references(session, [row.content_hash for row in batch if row.content_hash]))
+
+    keys_by_row = {}
+    for row in batch:
+        object_key = row.object_url.removeprefix("s3://")
+        if not row.content_hash or object_key in released:
+            keys_by_row[row.id] = [object_key, *(row.variants or {}).values()]
+
+    failed_keys = set()
+    keys = [key for row_keys in keys_by_row.values() for key in row_keys]
+    if keys:
+        failed_keys = set(await storage_service.delete_files(keys))
+
+    # rows with any key left behind go back to live and get retried. Their reference is already
+    # released, so the row now owns the object outright
+    reverted = [row for row in batch if failed_keys.intersection(keys_by_row.get(row.id, ()))]
+    if reverted:
+        await session.execute(
+            update(Image.__table__)
+            .where(Image.__table__.c.id == bindparam("row_id"), Image.__table__.c.uploaded_at == bindparam("row_uploaded_at"))
+            .values(deleted_at=None, object_url=bindparam("row_url"), content_hash=None),
+            [{"row_id": row.id, "row_uploaded_at": row.uploaded_at, "row_url": row.object_url} for row in reverted]
+        )
+    reverted_ids = {row.id for row in reverted}
+    return [row for row in batch if row.id not in reverted_ids], reverted
+
+
+def public_urls(rows: list) -> List[str]:
+    urls = []
+    for row in rows:
+        urls.append(f"{settings.PUBLIC_BASE_URL}/i/{row.filename}")
+        urls.extend(variant_url(row.filename, name) for name in (row.variants or {}))
+    return urls
+
+
+async def purge_batch(urls: List[str]) -> None:
+    try:
+        await purge_urls(urls)
+    except Exception as e:
+        logger.error(f"Cloudflare purge failed: {e}")
+
+
+class ExpiryScheduler:
+    # Deletes images within seconds of expires_at. A min-heap holds whatever expires before the next reload
+    # plus a margin; uploads on this worker feed it directly, everything else (other workers, restarts,
+    # rows a failed delete put back) comes in through the periodic reload from idx_expires_at.
+
+    def __init__(self, batch_size: int, reload_interval: float):
+        self.batch_size = batch_size
+        self.reload_interval = reload_interval
+        self._heap: List[Tuple[float, uuid.UUID]] = []
+        self._scheduled: Set[uuid.UUID] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._next_reload = 0.0
+
+    @property
+    def horizon(self) -> float:
+        return time.time() + 2 * self.reload_interval
+
+    def schedule(self, image_id: uuid.UUID, expires_at: datetime) -> None:
+        if self._task is None or image_id in self._scheduled:
+            return
+        due = expires_at.timestamp()
+        if due > self.horizon:
+            return
+        heapq.heappush(self._heap, (due, image_id))
+        self._scheduled.add(image_id)
+        if self._heap[0][1] == image_id:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None and settings.EXPIRY_SCHEDULER:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Expiry scheduler started, batch={self.batch_size}, reload every {self.reload_interval}s")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _reload(self) -> None:
+        horizon = datetime.fromtimestamp(self.horizon, tz=timezone.utc)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Image.id, Image.expires_at)
+                .where(
+                    Image.uploaded_at >= live_since(datetime.now(timezone.utc)),
+                    Image.expires_at < horizon,
+                    Image.deleted_at.is_(None),
+                )
+                .order_by(Image.expires_at)
+                .limit(RELOAD_LIMIT)
+            )
+            rows = result.all()
+        for row in rows:
+            self.schedule(row.id, row.expires_at)
+
+    def _pop_due(self) -> List[uuid.UUID]:
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            _, image_id = heapq.heappop(self._heap)
+            self._scheduled.discard(image_id)
+            due.append(image_id)
+        return due
+
+    async def _expire(self, ids: List[uuid.UUID]) -> None:
+        now = datetime.now(timezone.utc)
+        with stage("expiry_batch"):
+            async with AsyncSessionLocal() as session:
+                batch = await claim_expired_batch(session, now, len(ids), ids=ids, since=live_since(now))
+                if not batch:
+                    return
+                deleted, reverted = await delete_claimed(session, batch)
+                await session.commit()
+        DELETE_COUNT.inc(len(deleted))
+
+        for row in deleted:
+            EXPIRY_LAG.observe((now - row.expires_at).total_seconds())
+        if reverted:
+            logger.error(f"Expiry left {len(reverted)} images for retry")
+        if deleted:
+            logger.info(f"Expired {len(deleted)} images")
+            await purge_batch(public_urls(deleted))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if time.monotonic() >= self._next_reload:
+                    await self._reload()
+                    self._next_reload = time.monotonic() + self.reload_interval
+
+                due = self._pop_due()
+                if due:
+                    await self._expire(due)
+                    continue
+
+                timeout = self._next_reload - time.monotonic()
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - time.time())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Expiry scheduler iteration failed: {e}", exc_info=True)
+                await asyncio.sleep(ERROR_BACKOFF)
+
+
+expiry_scheduler = ExpiryScheduler(
+    batch_size=settings.EXPIRY_BATCH_SIZE,
+    reload_interval=settings.EXPIRY_RELOAD_INTERVAL,
+)
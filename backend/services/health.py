@@ -0,0 +1,126 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+from sqlalchemy import text
+from db.session import engine
+from services.storage import storage_service
+from core.config import settings
+
+logger = logging.getLogger("imghost.health")
+
+LATENCY_WINDOW = 60
+# a snapshot this many intervals old means the prober itself is stuck
+STALE_AFTER_INTERVALS = 3
+
+
+class DependencyStatus:
+    def __init__(self, name: str):
+        self.name = name
+        self.ok = False
+        self.message = "not checked yet"
+        self.checked_at: Optional[float] = None
+        self.consecutive_failures = 0
+        self.latencies: "deque[float]" = deque(maxlen=LATENCY_WINDOW)
+        self.results: "deque[bool]" = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, ok: bool, latency: float, message: str) -> None:
+        # log transitions only, a dependency that stays down would otherwise log every interval
+        if (self.checked_at is None and not ok) or (self.checked_at is not None and ok != self.ok):
+            log = logger.info if ok else logger.error
+            log(f"Health of {self.name} changed to {'OK' if ok else 'FAIL'}: {message}")
+        self.ok = ok
+        self.message = message
+        self.checked_at = time.time()
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        self.latencies.append(latency)
+        self.results.append(ok)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self.latencies)
+        stats = {}
+        if latencies:
+            stats = {
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95_ms": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000, 1),
+                "max_ms": round(latencies[-1] * 1000, 1),
+                "success_rate": round(sum(self.results) / len(self.results), 3),
+            }
+        return {
+            "status": "OK" if self.ok else "FAIL",
+            "message": self.message,
+            "checked_at": self.checked_at,
+            "consecutive_failures": self.consecutive_failures,
+            **stats,
+        }
+
+
+async def check_db_connection() -> None:
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+class HealthProber:
+    # Probes dependencies on an interval in the background; /health only reads the last snapshot, so load
+    # balancer probes cost nothing downstream and a slow dependency can't make the probe itself time out.
+
+    def __init__(self, interval: float, timeout: float, checks: Dict[str, Callable[[], Awaitable[None]]]):
+        self.interval = interval
+        self.timeout = timeout
+        self.checks = checks
+        self.statuses = {name: DependencyStatus(name) for name in checks}
+        self._task: Optional[asyncio.Task] = None
+        self._last_round: Optional[float] = None
+
+    async def _probe(self, name: str) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.checks[name](), self.timeout)
+            ok, message = True, f"{name.capitalize()} OK"
+        except asyncio.TimeoutError:
+            ok, message = False, f"timed out after {self.timeout}s"
+        except Exception as e:
+            ok, message = False, str(e)
+        self.statuses[name].record(ok, time.perf_counter() - start, message)
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self._probe(name) for name in self.checks))
+        self._last_round = time.time()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Health probe round failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> dict:
+        stale = self._last_round is None or time.time() - self._last_round > self.interval * STALE_AFTER_INTERVALS
+        ready = not stale and all(status.ok for status in self.statuses.values())
+        return {
+            "ready": ready,
+            "stale": stale,
+            "probed_at": self._last_round,
+            **{name: status.snapshot() for name, status in self.statuses.items()},
+        }
+
+
+health_prober = HealthProber(
+    interval=settings.HEALTH_PROBE_INTERVAL,
+    timeout=settings.HEALTH_PROBE_TIMEOUT,
+    checks={"database": check_db_connection, "storage": storage_service.check},
+)
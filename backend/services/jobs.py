@@ -0,0 +1,75 @@
+import uuid
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List, NamedTuple
+from sqlalchemy import select, update, or_, func
+from db.session import AsyncSessionLocal
+from models.image import Image, live_since
+from core.config import settings
+
+logger = logging.getLogger("imghost.jobs")
+
+# Unprocessed image rows are the queue. A worker claims rows by pushing process_after past the
+# visibility timeout, so a job whose worker dies becomes claimable again once that passes.
+
+
+class ProcessingJob(NamedTuple):
+    image_id: uuid.UUID
+    filename: str
+    mime_type: str
+    attempts: int
+    uploaded_at: datetime
+
+
+def visibility_deadline():
+    return func.now() + timedelta(seconds=settings.QUEUE_VISIBILITY_TIMEOUT)
+
+
+async def claim_jobs(limit: int) -> List[ProcessingJob]:
+    async with AsyncSessionLocal() as session:
+        claimable = (
+            select(Image.id, Image.uploaded_at)
+            .where(
+                Image.uploaded_at >= live_since(datetime.now(timezone.utc)),
+                Image.is_processed.is_(False),
+                Image.deleted_at.is_(None),
+                Image.process_attempts < settings.QUEUE_MAX_ATTEMPTS,
+                or_(Image.process_after.is_(None), Image.process_after <= func.now()),
+            )
+            .order_by(Image.uploaded_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("claimable")
+        )
+        stmt = (
+            update(Image)
+            .where(Image.id == claimable.c.id, Image.uploaded_at == claimable.c.uploaded_at)
+            .values(
+                process_after=visibility_deadline(),
+                process_attempts=Image.process_attempts + 1,
+            )
+            .returning(Image.id, Image.filename, Image.mime_type, Image.process_attempts, Image.uploaded_at)
+        )
+        result = await session.execute(stmt)
+        jobs = [ProcessingJob(*row) for row in result.all()]
+        await session.commit()
+    return jobs
+
+
+async def fail_job(job: ProcessingJob, error: str) -> None:
+    backoff = settings.QUEUE_BACKOFF_BASE * (2 ** (job.attempts - 1))
+    if job.attempts >= settings.QUEUE_MAX_ATTEMPTS:
+        logger.error(f"Image {job.image_id} failed processing {job.attempts} times, giving up: {error}")
+    else:
+        logger.warning(f"Image {job.image_id} processing attempt {job.attempts} failed, retrying in {backoff:.0f}s: {error}")
+
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Image)
+            .where(Image.id == job.image_id, Image.uploaded_at == job.uploaded_at)
+            .values(
+                process_after=func.now() + timedelta(seconds=backoff),
+                process_error=error[:1000],
+            )
+        )
+        await session.commit()
@@ -1,104 +1,357 @@
 import io
 import uuid
+import asyncio
 import logging
-from PIL import Image as PilImage
+from PIL import Image as PilImage, ImageOps, ExifTags
 from pillow_heif import register_heif_opener
-from typing import Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 from services.storage import storage_service
-from db.session import AsyncSessionLocal
-from models.image import Image
-from sqlalchemy import select
+from services.executor import processing_executor
+from services.encoding import ImageSignals, choose_encoding
+from services.cache import object_cache, object_cache_key
 from services.cloudflare import purge_urls
+from services.status import status_writer
+from services.sniff import ImageInfo
 from core.config import settings
+from core.monitoring import BYTES_OUT, COMPRESSION_RATIO, clock, observe_stages
 
 logger = logging.getLogger("imghost.background")
 MAX_DIMENSION = 2500
+# info keys that describe pixels rather than the capture, everything else (exif, xmp, comments, ...) is dropped
+KEPT_INFO_KEYS = ("transparency", "background")
+# info keys Pillow fills from EXIF (GPS included), XMP and comment segments
+METADATA_INFO_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment")
+# formats whose decoder can scale down while decoding (libjpeg DCT scaling by 1/2, 1/4, 1/8)
+DRAFT_FORMATS = ("JPEG", "MPO")
+# resize first reduces by an integer factor with a box filter, then LANCZOS over the last ~3x
+REDUCING_GAP = 3.0
+MIN_REDUCTION_PCT = 5
+# browsers play GIF frame delays this short at 100ms, WebP plays them as written
+MIN_GIF_FRAME_MS = 20
+GIF_DEFAULT_FRAME_MS = 100
+THUMBNAIL_VARIANT = "thumb"
+# variants are small, the slowest methods buy almost nothing there
+VARIANT_WEBP_METHOD = 4
 
 register_heif_opener() 
 
-def strip_exif_and_process(file_bytes: bytes) -> Tuple[bytes, str]:
-    logger.info("Starting image processing")
 
+class ProcessedImage(NamedTuple):
+    data: bytes
+    mime_type: str
+    original_size: int
+    variants: Dict[str, bytes]
+    # seconds per stage, measured in the worker process
+    timings: Optional[Dict[str, float]] = None
+
+
+def strip_metadata(img: PilImage.Image) -> PilImage.Image:
+    # bake the EXIF orientation into the pixels and drop metadata in place, without copying the frame
+    img.load()
+    ImageOps.exif_transpose(img, in_place=True)
+    kept = {k: img.info[k] for k in KEPT_INFO_KEYS if k in img.info}
+    if settings.KEEP_ICC_PROFILE and img.info.get("icc_profile"):
+        kept["icc_profile"] = img.info["icc_profile"]
+    img.info = kept
+    return img
+
+
+def check_pixels(size: Tuple[int, int]) -> None:
+    if size[0] * size[1] > settings.MAX_IMAGE_PIXELS:
+        raise ValueError(f"{size[0]}x{size[1]} is over the {settings.MAX_IMAGE_PIXELS} pixel budget")
+
+
+def target_size(width: int, height: int, max_dimension: int = MAX_DIMENSION) -> Tuple[int, int]:
+    if width <= max_dimension and height <= max_dimension:
+        return width, height
+    if width > height:
+        return max_dimension, int((max_dimension / width) * height)
+    return int((max_dimension / height) * width), max_dimension
+
+
+def plan_decode(img: PilImage.Image, max_dimension: int = MAX_DIMENSION) -> Tuple[int, int]:
+    # must run before the image is loaded. Returns the final size in stored (pre-orientation) order
+    target = target_size(*img.size, max_dimension=max_dimension)
+    if target != img.size and img.format in DRAFT_FORMATS:
+        # draft keeps the decoded size >= target, the resize below does the rest
+        img.draft(img.mode, target)
+    return target
+
+
+def decode_for_target(img: PilImage.Image, max_dimension: int = MAX_DIMENSION) -> PilImage.Image:
+    target = plan_decode(img, max_dimension)
+    if img.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+        target = (target[1], target[0])
+
+    img = strip_metadata(img)
+    if img.size != target:
+        img = img.resize(target, PilImage.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img
+
+
+def has_alpha(img: PilImage.Image) -> bool:
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+
+def has_metadata(img: PilImage.Image) -> bool:
+    return any(img.info.get(key) for key in METADATA_INFO_KEYS)
+
+
+def encode_webp(img: PilImage.Image, quality: int, method: int) -> bytes:
+    output_buffer = io.BytesIO()
+    icc_profile = img.info.get("icc_profile")
+    
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img.save(output_buffer, format='WEBP', quality=quality, method=method, lossless=False, icc_profile=icc_profile)
+    else:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')   
+        img.save(output_buffer, format='WEBP', quality=quality, method=method, icc_profile=icc_profile)
+    return output_buffer.getvalue()
+
+
+def render_variants(img: PilImage.Image, variant_sizes: Dict[str, int]) -> Dict[str, bytes]:
+    # largest first, each one downscaled from the previous, so the whole set costs about one extra resize
+    if img.mode == 'P':
+        img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+    variants = {}
+    current = img
+    for name, max_dimension in sorted(variant_sizes.items(), key=lambda item: item[1], reverse=True):
+        size = target_size(*current.size, max_dimension=max_dimension)
+        if size != current.size:
+            current = current.resize(size, PilImage.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        variants[name] = encode_webp(current, settings.WEBP_QUALITY, VARIANT_WEBP_METHOD)
+    return variants
+
+
+def animation_frame(img: PilImage.Image, index: int, canvas: Tuple[int, int], target: Tuple[int, int], durations: List[int]) -> PilImage.Image:
+    # decodes one frame ready for the encoder and records its delay, since save_all would otherwise play
+    # every frame at the first one's
+    img.seek(index)
+    check_pixels(img.size)
+    duration = img.info.get("duration", GIF_DEFAULT_FRAME_MS)
+    durations.append(GIF_DEFAULT_FRAME_MS if duration < MIN_GIF_FRAME_MS else duration)
+
+    frame = img
+    if frame.size != canvas:
+        # a GIF frame can reach past the declared screen, browsers clip it there
+        frame = frame.crop((0, 0) + canvas)
+    if frame.mode not in ("RGBX", "RGBA", "RGB"):
+        frame = frame.convert("RGBA" if frame.has_transparency_data else "RGB")
+    if frame.size != target:
+        frame = frame.resize(target, PilImage.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return frame
+
+
+class AnimationFrames:
+    # Stands in for the frames after the first in WebP's save_all, which seeks each one in turn and reads
+    # its delay once it's encoded. Frames are decoded and resized when they're sought, so only one is held
+    def __init__(self, img: PilImage.Image, canvas: Tuple[int, int], target: Tuple[int, int], durations: List[int]):
+        self.img = img
+        self.canvas = canvas
+        self.target = target
+        self.durations = durations
+        self.n_frames = img.n_frames - 1
+        self.index = 0
+        self.frame: Optional[PilImage.Image] = None
+
+    def seek(self, index: int) -> None:
+        self.frame = None
+        self.index = index
+        self.frame = animation_frame(self.img, index + 1, self.canvas, self.target, self.durations)
+
+    def tell(self) -> int:
+        return self.index
+
+    def __getattr__(self, name: str):
+        return getattr(self.frame, name)
+
+
+def transcode_animation(img: PilImage.Image, source_bytes: int) -> ProcessedImage:
+    canvas = img.size
+    target = target_size(*canvas)
+    durations: List[int] = []
+
+    first = animation_frame(img, 0, canvas, target, durations)
+    if first is img:
+        # save_all would walk the source's own frames
+        first = img.copy()
+    output = io.BytesIO()
+    first.save(
+        output,
+        format="WEBP",
+        save_all=True,
+        append_images=[AnimationFrames(img, canvas, target, durations)],
+        # filled in as the frames are sought
+        duration=durations,
+        # a GIF without a NETSCAPE loop block plays once
+        loop=img.info.get("loop", 1),
+        background=(0, 0, 0, 0),
+        quality=settings.WEBP_QUALITY,
+        method=min(settings.WEBP_METHOD, 4),
+    )
+
+    data = output.getvalue()
+    logger.info(f"Transcoded {len(durations)} frame animation {canvas} -> {target}, {source_bytes} -> {len(data)} bytes")
+    return ProcessedImage(data, "image/webp", source_bytes, {})
+
+
+def strip_exif_and_process(
+    file_bytes: bytes,
+    policy: Optional[str] = None,
+    variant_sizes: Optional[Dict[str, int]] = None,
+    info: Optional[ImageInfo] = None,
+) -> ProcessedImage:
+    logger.info("Starting image processing")
+    variant_sizes = settings.IMAGE_VARIANTS if variant_sizes is None else variant_sizes
+    timings: Dict[str, float] = {}
 
     try:
         img = PilImage.open(io.BytesIO(file_bytes))
         original_size = img.size
-        data = list(img.getdata())
-        img_no_exif = PilImage.new(img.mode, img.size)
-        img_no_exif.putdata(data)
-
-        width, height = img_no_exif.size
-        needs_resize = width > MAX_DIMENSION or height > MAX_DIMENSION
-
-        if needs_resize:
-            if width > height:
-                new_width = MAX_DIMENSION
-                new_height = int((MAX_DIMENSION / width) * height)
-            else:
-                new_height = MAX_DIMENSION
-                new_width = int((MAX_DIMENSION / height) * width)
-
-            img_no_exif = img_no_exif.resize((new_width, new_height), PilImage.Resampling.LANCZOS)
-            logger.info(f"Resized from {original_size} to {img_no_exif.size}")
-            
-        output_buffer = io.BytesIO()
+        # uploads are checked while sniffing, this covers sources that weren't (queue workers, backfills)
+        check_pixels(img.size)
         
-        if img_no_exif.mode in ('RGBA', 'LA', 'P'):
-            img_no_exif.save(output_buffer, format='WEBP', quality=85, method=6, lossless=False)
-        else:
-            if img_no_exif.mode != 'RGB':
-                img_no_exif = img_no_exif.convert('RGB')   
-            img_no_exif.save(output_buffer, format='WEBP', quality=85, method=6)
+        # the upload's header sniff already counted frames when it saw them all; Pillow would scan a GIF to find out
+        animated = info.animated if info is not None and info.frames is not None else getattr(img, "is_animated", False)
+        if animated:
+            if img.format == "GIF":
+                with clock(timings, "transcode"):
+                    processed = transcode_animation(img, len(file_bytes))
+                return processed._replace(timings=timings)
+            # re-encoding would keep only the first frame
+            logger.info(f"Keeping animated {img.format} as is")
+            return ProcessedImage(file_bytes, PilImage.MIME.get(img.format or "", "application/octet-stream"), len(file_bytes), {})
+        
+        # decided from the header alone, so a skip costs no decode
+        decision = choose_encoding(ImageSignals(
+            source_format=img.format,
+            size=img.size,
+            target_size=target_size(*img.size),
+            source_bytes=len(file_bytes),
+            has_alpha=has_alpha(img),
+            has_metadata=has_metadata(img),
+        ), policy)
+        if decision.skip:
+            logger.info(f"Skipping encode: {decision.reason}")
+            variants = {}
+            if variant_sizes:
+                with clock(timings, "decode"):
+                    decoded = decode_for_target(img, max(variant_sizes.values()))
+                with clock(timings, "variants"):
+                    variants = render_variants(decoded, variant_sizes)
+            return ProcessedImage(file_bytes, PilImage.MIME.get(img.format or "", "application/octet-stream"), len(file_bytes), variants, timings)
+        
+        with clock(timings, "decode"):
+            img_no_exif = decode_for_target(img)
 
-        output_buffer.seek(0)
-        processed_bytes = output_buffer.read()
+        if sorted(img_no_exif.size) != sorted(original_size):
+            logger.info(f"Resized from {original_size} to {img_no_exif.size}")
+            
+        with clock(timings, "encode"):
+            processed_bytes = encode_webp(img_no_exif, decision.quality, decision.method)
+        with clock(timings, "variants"):
+            variants = render_variants(img_no_exif, variant_sizes) if variant_sizes else {}
         
         original_kb = len(file_bytes) / 1024
         processed_kb = len(processed_bytes) / 1024
         reduction = ((len(file_bytes) - len(processed_bytes)) / len(file_bytes)) * 100
         
         logger.info(f"Original size: {original_kb:.2f} KB, Processed size: {processed_kb:.2f} KB, Reduction: {reduction:.2f}%")
-        return processed_bytes, "image/webp"
+        return ProcessedImage(processed_bytes, "image/webp", len(file_bytes), variants, timings)
     
     except Exception as e:
         logger.error(f"Image processing failed: {e}")
-        return file_bytes, "image/jpeg"
+        return ProcessedImage(file_bytes, "image/jpeg", len(file_bytes), {}, timings)
+
+
+def process_source(source: Union[bytes, str], info: Optional[ImageInfo] = None) -> ProcessedImage:
+    # runs inside a processing worker, so callers can hand over a temp file path instead of pickling the bytes
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            source = f.read()
+    return strip_exif_and_process(source, info=info)
+
+
+def variant_key(filename: str, name: str) -> str:
+    return f"{filename}_{name}"
+
+
+def variant_url(filename: str, name: str) -> str:
+    # public variant URLs hang off the row's own filename, the serve route maps them to the stored key
+    return f"{settings.PUBLIC_BASE_URL}/i/{variant_key(filename, name)}"
+
+
+def status_url(filename: str) -> str:
+    return f"{settings.PUBLIC_BASE_URL}/i/{filename}/status"
+
+
+def thumbnail_variant(variant_names) -> Optional[str]:
+    names = list(variant_names)
+    if not names:
+        return None
+    if THUMBNAIL_VARIANT in names:
+        return THUMBNAIL_VARIANT
+    return min(names, key=lambda name: settings.IMAGE_VARIANTS.get(name, 0))
+
+
+def thumbnail_url(filename: str, variant_keys: Dict[str, str]) -> Optional[str]:
+    name = thumbnail_variant(variant_keys)
+    return variant_url(filename, name) if name else None
+
+
+async def store_variants(filename: str, variants: Dict[str, bytes], staged_keys: Optional[List[str]] = None) -> Dict[str, str]:
+    keys = {name: variant_key(filename, name) for name in variants}
+    if staged_keys is not None:
+        staged_keys.extend(keys.values())
+    await asyncio.gather(*(
+        storage_service.upload_file(io.BytesIO(data), keys[name], "image/webp")
+        for name, data in variants.items()
+    ))
+    if settings.ORIGIN_CACHE_WARM_ON_UPLOAD:
+        for name, data in variants.items():
+            await object_cache.put(object_cache_key(keys[name], None, "image/webp"), data)
+    return keys
+
+
+def reduction_percent(original_size: int, processed_size: int) -> float:
+    return ((original_size - processed_size) / original_size) * 100
     
 
-async def process_image_and_update_db(image_id: uuid.UUID, original_bytes: bytes, original_filename: str, original_mime: str):
-    if original_mime == "image/gif":
+async def process_image_and_update_db(image_id: uuid.UUID, source: Union[bytes, str], original_filename: str, original_mime: str, info: Optional[ImageInfo] = None):
+    if original_mime == "image/gif" and not settings.TRANSCODE_GIFS:
         logger.info(f"skipping process for GIF {image_id}")
         try:
-            async with AsyncSessionLocal() as session:
-                stmt = select(Image).filter(Image.id == image_id)
-                result = await session.execute(stmt)
-                image = result.scalars().first()
-                if image:
-                    image.is_processed = True
-                    await session.commit()
-                    logger.info(f"Image {image_id} marked procesed (GIF)")
+            if await status_writer.mark_processed(original_filename):
+                logger.info(f"Image {image_id} marked procesed (GIF)")
         except Exception as e:
             logger.exception(f"Failed gif process mark for {image_id}: {e}")
         return
     
     
-    processed_bytes, new_mime_type = strip_exif_and_process(original_bytes)
-    
-    size_reduction = len(original_bytes) - len(processed_bytes)
-    reduction_pct = (size_reduction / len(original_bytes)) * 100
+    processed = await processing_executor.run(process_source, source, info)
+    await apply_processing_result(image_id, original_filename, processed)
+
+
+def observe_processed(processed: ProcessedImage, stored_size: int) -> None:
+    observe_stages(processed.timings)
+    BYTES_OUT.observe(stored_size)
+    COMPRESSION_RATIO.observe(stored_size / max(processed.original_size, 1))
+
+
+async def apply_processing_result(image_id: uuid.UUID, original_filename: str, processed: ProcessedImage):
+    processed_bytes, new_mime_type = processed.data, processed.mime_type
+    reduction_pct = reduction_percent(processed.original_size, len(processed_bytes))
+    variant_keys = await store_variants(original_filename, processed.variants)
     
-    if reduction_pct < 5:
+    if reduction_pct < MIN_REDUCTION_PCT:
+        observe_processed(processed, processed.original_size)
         logger.info(f"Image {image_id} process resulted in ({reduction_pct:.2f}%) change, skipping reupload")
-        async with AsyncSessionLocal() as session:
-            stmt = select(Image).filter(Image.id == image_id)
-            result = await session.execute(stmt)
-            image = result.scalars().first()
-            if image:
-                image.is_processed = True
-                await session.commit()
+        await status_writer.mark_processed(original_filename, variants=variant_keys, thumbnail=thumbnail_variant(variant_keys))
         return
 
     logger.info(f"Image {image_id} processed. New size: {len(processed_bytes)} bytes.")
+    observe_processed(processed, len(processed_bytes))
 
     try:
         await storage_service.upload_file(
@@ -106,28 +359,29 @@ async def process_image_and_update_db(image_id: uuid.UUID, original_bytes: bytes
             filename=original_filename,
             mime_type=new_mime_type
         )
+        if settings.ORIGIN_CACHE_WARM_ON_UPLOAD:
+            await object_cache.put(object_cache_key(original_filename, len(processed_bytes), new_mime_type), processed_bytes)
+        
+        filenames = await status_writer.mark_processed(
+            original_filename,
+            size_bytes=len(processed_bytes),
+            mime_type=new_mime_type,
+            variants=variant_keys,
+            thumbnail=thumbnail_variant(variant_keys),
+        )
+        if filenames:
+            logger.info(f"Image {image_id} DB updated successfully ({len(filenames)} rows).")
+        else:
+            logger.warning(f"Image {image_id} not found for update (possible prior deletion).")
         
         try:
-            public_url = f"{settings.PUBLIC_BASE_URL}/i/{original_filename}"
-            purge_result = await purge_urls([public_url])
-            logger.info(f"Purged CDN cache for {original_filename}: {purge_result}")
+            public_urls = [f"{settings.PUBLIC_BASE_URL}/i/{filename}" for filename in filenames]
+            if public_urls:
+                await purge_urls(public_urls)
+                logger.info(f"Queued CDN purge for {original_filename}")
         except Exception as e:
             logger.exception(f"Failed to purge CDN cache for {original_filename}: {e}")
-        
-        async with AsyncSessionLocal() as session:
-            stmt = select(Image).filter(Image.id == image_id)
-            result = await session.execute(stmt)
-            image = result.scalars().first()
-    
-            if image:
-                image.size_bytes = len(processed_bytes)  # type: ignore[assignment]
-                image.mime_type = new_mime_type
-                image.is_processed = True
-
-                await session.commit()
-                logger.info(f"Image {image_id} DB updated successfully.")
-            else:
-                logger.warning(f"Image {image_id} not found for update (possible prior deletion).")
 
     except Exception as e:
         logger.critical(f"Background update failed for {image_id}: {e}")
+        raise
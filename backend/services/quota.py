@@ -0,0 +1,126 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException
+from limits import RateLimitItemPerHour
+from limits.storage import MemoryStorage, storage_from_string
+from limits.strategies import SlidingWindowCounterRateLimiter
+from sqlalchemy import select, func
+from db.session import AsyncSessionLocal
+from models.image import Image
+from core.config import settings
+
+logger = logging.getLogger("imghost.quota")
+
+QUOTA_NAMESPACE = "UPLOAD-QUOTA"
+WINDOW_SECONDS = 3600
+# outlives any window by far, its age says whether the storage forgot counters recently
+EPOCH_TTL = 365 * 24 * 3600
+EPOCH_RECHECK_INTERVAL = 60.0
+
+
+async def count_recent_uploads(ip_addr: str) -> int:
+    since = datetime.now(timezone.utc) - timedelta(seconds=WINDOW_SECONDS)
+    async with AsyncSessionLocal() as session:
+        count = await session.scalar(
+            select(func.count(Image.id)).where(Image.ip_address == ip_addr, Image.uploaded_at >= since)
+        )
+    return count or 0
+
+
+class UploadQuota:
+    # Sliding-window image quota per client, kept in the rate limiter's storage backend so every worker
+    # shares it. check() turns a batch away before any of it is read; reserve() charges it with one atomic
+    # check-and-increment once it's staged, so rejected and failed uploads cost nothing. The database is
+    # only read while the storage is younger than a window (memory:// after a restart, a flushed Redis),
+    # once per client, to seed the counter with the uploads it forgot, or when the storage is unreachable.
+    # A memory:// counter only sees its own process, and nothing says how many worker processes there are,
+    # so without a shared backend (Redis, Memcached, ...) the database count is the quota instead;
+    # concurrent batches from one client can then overshoot it.
+
+    def __init__(
+        self,
+        storage_uri: str,
+        limit: int,
+        recover: Callable[[str], Awaitable[int]] = count_recent_uploads,
+    ):
+        self.limit = limit
+        self.storage = storage_from_string(storage_uri)
+        self.strategy = SlidingWindowCounterRateLimiter(self.storage)
+        self.item = RateLimitItemPerHour(limit, namespace=QUOTA_NAMESPACE)
+        self.recover = recover
+        # network backends block, keep them off the event loop
+        self.in_process = isinstance(self.storage, MemoryStorage)
+        self.shared = not self.in_process
+        if not self.shared:
+            logger.warning(f"{storage_uri} isn't shared between workers, counting uploads from the database")
+        self._epoch_started = 0.0
+        self._epoch_checked = 0.0
+
+    def _recovering(self) -> bool:
+        now = time.time()
+        if now - self._epoch_checked > EPOCH_RECHECK_INTERVAL:
+            key = f"{QUOTA_NAMESPACE}/epoch"
+            if not self.storage.get(key):
+                self.storage.incr(key, EPOCH_TTL)
+            self._epoch_started = self.storage.get_expiry(key) - EPOCH_TTL
+            self._epoch_checked = now
+        return now - self._epoch_started < WINDOW_SECONDS
+
+    def _needs_seed(self, ip_addr: str) -> bool:
+        return self._recovering() and self.storage.incr(f"{QUOTA_NAMESPACE}/seeded/{ip_addr}", WINDOW_SECONDS) == 1
+
+    def _seed(self, ip_addr: str, count: int) -> None:
+        if count:
+            self.strategy.hit(self.item, ip_addr, cost=min(count, self.limit))
+
+    def _used(self, ip_addr: str) -> int:
+        stats = self.strategy.get_window_stats(self.item, ip_addr)
+        return self.limit - stats.remaining
+
+    def _fits(self, ip_addr: str, count: int) -> Optional[int]:
+        # None when it would fit, otherwise how much of the window is used up
+        return None if self.strategy.test(self.item, ip_addr, cost=count) else self._used(ip_addr)
+
+    def _reserve(self, ip_addr: str, count: int) -> Optional[int]:
+        return None if self.strategy.hit(self.item, ip_addr, cost=count) else self._used(ip_addr)
+
+    async def _call(self, fn, *args):
+        if self.in_process:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def _counted(self, ip_addr: str, count: int) -> Optional[int]:
+        used = await self.recover(ip_addr)
+        return used if used + count > self.limit else None
+
+    async def _over_limit(self, ip_addr: str, count: int, attempt: Callable[[str, int], Optional[int]]) -> Optional[int]:
+        if not self.shared:
+            return await self._counted(ip_addr, count)
+        try:
+            if await self._call(self._needs_seed, ip_addr):
+                await self._call(self._seed, ip_addr, await self.recover(ip_addr))
+            return await self._call(attempt, ip_addr, count)
+        except Exception as e:
+            logger.warning(f"Quota storage unavailable, counting from the database: {e}")
+            return await self._counted(ip_addr, count)
+
+    async def _enforce(self, ip_addr: str, count: int, attempt: Callable[[str, int], Optional[int]]) -> None:
+        used = await self._over_limit(ip_addr, count, attempt)
+        if used is not None:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Upload limit exceeded. You've uploaded {used}/{self.limit} images in the last hour."
+            )
+
+    async def check(self, ip_addr: str, count: int) -> None:
+        await self._enforce(ip_addr, count, self._fits)
+
+    async def reserve(self, ip_addr: str, count: int) -> None:
+        # counting from the database, the inserted rows are the reservation
+        if self.shared:
+            await self._enforce(ip_addr, count, self._reserve)
+
+upload_quota = UploadQuota(settings.RATE_LIMIT_STORAGE_URL, settings.UPLOAD_QUOTA_PER_HOUR)
@@ -0,0 +1,217 @@
+import struct
+import magic
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+# libmagic loads its database per instance, one for the process. python-magic serialises calls with a lock
+_detector = magic.Magic(mime=True)
+
+MAGIC_BYTES = 2048
+HEAD_BYTES = 4096
+# how far into a file dimensions are looked for; JPEG EXIF/ICC segments can push SOF past the first KBs
+MAX_HEAD_BYTES = 512 * 1024
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageInfo(NamedTuple):
+    format: str
+    width: int
+    height: int
+    # None when the frames aren't all within the bytes read
+    frames: Optional[int]
+    animated: bool
+    # False when width and height are only an upper bound (HEIF)
+    exact: bool = True
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+def detect_mime(head: bytes) -> str:
+    return _detector.from_buffer(head[:MAGIC_BYTES])
+
+
+def _jpeg(buf: bytes) -> Optional[ImageInfo]:
+    i = 2
+    while i + 4 <= len(buf):
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image or start of scan before any frame header
+            return None
+        length = struct.unpack_from(">H", buf, i + 2)[0]
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(buf):
+                return None
+            height, width = struct.unpack_from(">HH", buf, i + 5)
+            # height 0 means it comes later in a DNL segment
+            return ImageInfo("JPEG", width, height, 1, False) if width and height else None
+        i += 2 + length
+    return None
+
+
+def _png_chunks(buf: bytes) -> Iterator[Tuple[bytes, int, int]]:
+    i = 8
+    while i + 8 <= len(buf):
+        length, kind = struct.unpack_from(">I4s", buf, i)
+        yield kind, i + 8, length
+        i += 12 + length
+
+
+def _png(buf: bytes) -> Optional[ImageInfo]:
+    if len(buf) < 24 or buf[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack_from(">II", buf, 16)
+    frames = None
+    # an APNG's acTL has to come before the first IDAT
+    for kind, offset, _ in _png_chunks(buf):
+        if kind == b"acTL" and offset + 4 <= len(buf):
+            frames = struct.unpack_from(">I", buf, offset)[0]
+            break
+        if kind == b"IDAT":
+            frames = 1
+            break
+    return ImageInfo("PNG", width, height, frames, bool(frames and frames > 1))
+
+
+def _skip_sub_blocks(buf: bytes, i: int) -> Optional[int]:
+    while i < len(buf):
+        size = buf[i]
+        i += 1 + size
+        if size == 0:
+            return i
+    return None
+
+
+def _gif(buf: bytes) -> Optional[ImageInfo]:
+    if len(buf) < 13:
+        return None
+    width, height, flags = struct.unpack_from("<HHB", buf, 6)
+    i = 13
+    if flags & 0x80:
+        i += 3 << ((flags & 0x07) + 1)
+    frames = 0
+    while i < len(buf):
+        block = buf[i]
+        if block == 0x3B:
+            return ImageInfo("GIF", width, height, frames, frames > 1)
+        if block == 0x21:
+            end = _skip_sub_blocks(buf, i + 2)
+        elif block == 0x2C:
+            if i + 10 > len(buf):
+                break
+            left, top, frame_w, frame_h, frame_flags = struct.unpack_from("<HHHHB", buf, i + 1)
+            # frames that overflow the logical screen grow the canvas when decoded
+            width, height = max(width, left + frame_w), max(height, top + frame_h)
+            frames += 1
+            i += 10
+            if frame_flags & 0x80:
+                i += 3 << ((frame_flags & 0x07) + 1)
+            # LZW minimum code size, then the image data
+            end = _skip_sub_blocks(buf, i + 1)
+        else:
+            return None
+        if end is None:
+            break
+        i = end
+    # ran out of bytes: the canvas so far is a lower bound, the frame count unknown
+    return ImageInfo("GIF", width, height, None, frames > 1)
+
+
+def _webp(buf: bytes) -> Optional[ImageInfo]:
+    if len(buf) < 30:
+        return None
+    kind = buf[12:16]
+    if kind == b"VP8 ":
+        if buf[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack_from("<HH", buf, 26)
+        return ImageInfo("WEBP", width & 0x3FFF, height & 0x3FFF, 1, False)
+    if kind == b"VP8L":
+        if buf[20] != 0x2F:
+            return None
+        bits = struct.unpack_from("<I", buf, 21)[0]
+        return ImageInfo("WEBP", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, 1, False)
+    if kind == b"VP8X":
+        animated = bool(buf[20] & 0x02)
+        width = int.from_bytes(buf[24:27], "little") + 1
+        height = int.from_bytes(buf[27:30], "little") + 1
+        if not animated:
+            return ImageInfo("WEBP", width, height, 1, False)
+        frames = 0
+        i = 12
+        while i + 8 <= len(buf):
+            chunk, size = struct.unpack_from("<4sI", buf, i)
+            frames += chunk == b"ANMF"
+            i += 8 + size + (size & 1)
+        complete = i >= struct.unpack_from("<I", buf, 4)[0] + 8
+        return ImageInfo("WEBP", width, height, frames if complete else None, True)
+    return None
+
+
+def _boxes(buf: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    # ISO BMFF boxes as (type, payload start, box end), only those whose header fits in the buffer
+    i = start
+    while i + 8 <= min(end, len(buf)):
+        size, kind = struct.unpack_from(">I4s", buf, i)
+        header = 8
+        if size == 1:
+            if i + 16 > len(buf):
+                return
+            size = struct.unpack_from(">Q", buf, i + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - i
+        if size < header:
+            return
+        yield kind, i + header, i + size
+        i += size
+
+
+def _heif(buf: bytes) -> Optional[ImageInfo]:
+    # meta > iprp > ipco > ispe. A file has one ispe per image item (primary, grid tiles, thumbnails);
+    # the largest is the primary image or the grid it's assembled into. Encoders often write the coded
+    # size there, padded to whole blocks, and crop it with a clap box, so it's only an upper bound
+    for kind, start, end in _boxes(buf, 0, len(buf)):
+        if kind != b"meta":
+            continue
+        # meta is a full box: version and flags come first
+        for kind, start, end in _boxes(buf, start + 4, end):
+            if kind != b"iprp":
+                continue
+            for kind, start, end in _boxes(buf, start, end):
+                if kind != b"ipco":
+                    continue
+                sizes = [
+                    struct.unpack_from(">II", buf, start + 4)
+                    for kind, start, _ in _boxes(buf, start, end)
+                    if kind == b"ispe" and start + 12 <= len(buf)
+                ]
+                if sizes:
+                    width, height = max(sizes, key=lambda size: size[0] * size[1])
+                    return ImageInfo("HEIF", width, height, 1, False, exact=False)
+    return None
+
+
+def probe(head: bytes) -> Optional[ImageInfo]:
+    # dimensions and frame count from the container headers; None when they aren't within `head`
+    if head[:3] == b"\xff\xd8\xff":
+        return _jpeg(head)
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return _png(head)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return _gif(head)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _webp(head)
+    if head[4:8] == b"ftyp":
+        return _heif(head)
+    return None
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional, Set
+from datetime import datetime, timezone
+from sqlalchemy import update, values, column, case, cast, func, literal, String, Integer
+from sqlalchemy.dialects.postgresql import JSONB
+from db.session import AsyncSessionLocal
+from models.image import Image, live_since
+from core.config import settings
+
+logger = logging.getLogger("imghost.status")
+
+
+class ProcessedStatus(NamedTuple):
+    size_bytes: Optional[int]
+    mime_type: Optional[str]
+    variants: Optional[dict]
+    thumbnail: Optional[str]
+
+
+class PendingStatus(NamedTuple):
+    status: ProcessedStatus
+    waiters: List[asyncio.Future]
+
+
+class StatusWriter:
+    # Write-behind for "processing finished" updates. Everything submitted within flush_interval (or until
+    # max_batch objects pile up) goes out as one UPDATE ... FROM (VALUES ...) keyed by object_url, which also
+    # covers every deduplicated row sharing the object. Callers await their own entry, so a failed flush
+    # still reaches them.
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: Dict[str, PendingStatus] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def mark_processed(
+        self,
+        object_key: str,
+        size_bytes: Optional[int] = None,
+        mime_type: Optional[str] = None,
+        variants: Optional[dict] = None,
+        thumbnail: Optional[str] = None,
+    ) -> List[str]:
+        # returns the filenames of the rows that were updated
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        status = ProcessedStatus(size_bytes, mime_type, variants or None, thumbnail)
+        pending = self._pending.get(object_key)
+        self._pending[object_key] = PendingStatus(status, (pending.waiters if pending else []) + [waiter])
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+        return await waiter
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: Dict[str, PendingStatus]) -> None:
+        rows = values(
+            column("object_url", String),
+            column("size_bytes", Integer),
+            column("mime_type", String),
+            column("variants", JSONB(none_as_null=True)),
+            column("thumbnail", String),
+            name="processed",
+        ).data([
+            (f"s3://{key}", p.status.size_bytes, p.status.mime_type, p.status.variants, p.status.thumbnail)
+            for key, p in batch.items()
+        ])
+        stmt = (
+            update(Image)
+            .where(
+                Image.object_url == rows.c.object_url,
+                Image.deleted_at.is_(None),
+                Image.uploaded_at >= live_since(datetime.now(timezone.utc)),
+            )
+            .values(
+                is_processed=True,
+                # NULLs in VALUES are untyped when a whole column is NULL, hence the casts
+                size_bytes=func.coalesce(cast(rows.c.size_bytes, Integer), Image.size_bytes),
+                mime_type=func.coalesce(rows.c.mime_type, Image.mime_type),
+                variants=cast(rows.c.variants, JSONB),
+                # each row sharing an object gets the thumbnail under its own filename
+                thumbnail_url=case(
+                    (rows.c.thumbnail.is_(None), None),
+                    else_=literal(f"{settings.PUBLIC_BASE_URL}/i/") + Image.filename + literal("_") + rows.c.thumbnail,
+                ),
+            )
+            .returning(Image.object_url, Image.filename)
+        )
+
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(stmt)
+                updated = result.all()
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Status flush of {len(batch)} objects failed: {e}")
+            for pending in batch.values():
+                for waiter in pending.waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+            return
+
+        filenames: Dict[str, List[str]] = {}
+        for object_url, filename in updated:
+            filenames.setdefault(object_url.removeprefix("s3://"), []).append(filename)
+        for key, pending in batch.items():
+            for waiter in pending.waiters:
+                if not waiter.done():
+                    waiter.set_result(filenames.get(key, []))
+
+    async def close(self) -> None:
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+status_writer = StatusWriter(
+    flush_interval=settings.STATUS_FLUSH_INTERVAL,
+    max_batch=settings.STATUS_FLUSH_BATCH,
+)
@@ -1,10 +1,54 @@
+import io
 import boto3
 import asyncio
+import logging
 from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 from fastapi import HTTPException, status
-from typing import BinaryIO
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, List, Optional, Tuple
 from core.config import settings
+from core.monitoring import timed_stage
+
+logger = logging.getLogger("imghost")
+
+# S3 rejects non-final multipart parts under 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+S3_REGION = 'ap-mumbai-1'
+# DeleteObjects takes at most 1000 keys per call
+MAX_DELETE_BATCH = 1000
+# reads from a streamed GET body
+GET_CHUNK_SIZE = 256 * 1024
+
+
+class ObjectStream:
+    # A GET whose headers are in and whose body hasn't been read. chunks() closes the body when it's
+    # exhausted or abandoned; close() is for a stream that's never iterated.
+
+    def __init__(self, read: Callable[[int], Awaitable[bytes]], close: Callable[[], None], resp: dict):
+        self._read = read
+        self._close = close
+        self.length: int = resp["ContentLength"]
+        # a ranged GET answers with "bytes start-end/total"
+        content_range = resp.get("ContentRange")
+        self.total: int = int(content_range.rpartition("/")[2]) if content_range else self.length
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                chunk = await self._read(GET_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._close()
+
+
+def range_arg(byte_range: Optional[Tuple[int, int]]) -> dict:
+    return {"Range": f"bytes={byte_range[0]}-{byte_range[1]}"} if byte_range else {}
+
 
 class StorageService:
     def __init__(self):
@@ -14,11 +58,24 @@ class StorageService:
             endpoint_url=settings.S3_ENDPOINT_URL,
             aws_access_key_id=settings.S3_ACCESS_KEY_ID,
              aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
-            region_name='ap-mumbai-1',
-            config=Config(signature_version='s3v4')
+            region_name=S3_REGION,
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                retries={'max_attempts': settings.S3_MAX_ATTEMPTS, 'mode': 'standard'},
+                tcp_keepalive=True
+            )
         )   
         self.bucket_name = settings.S3_BUCKET_NAME
+
+    async def check(self) -> None:
+        # HeadBucket: one cheap request against our own bucket, also proves the credentials can reach it
+        await asyncio.to_thread(self.s3_client.head_bucket, Bucket=self.bucket_name)
+
+    async def close(self) -> None:
+        self.s3_client.close()
         
+    @timed_stage("storage_put")
     async def upload_file(
         self,
         file_obj: BinaryIO,
@@ -46,6 +103,7 @@ class StorageService:
                 detail="Could not upload file to storagee"
             )
             
+    @timed_stage("storage_delete")
     async def delete_file(self, filename: str) -> None:
         try:
             await asyncio.to_thread(
@@ -58,8 +116,369 @@ class StorageService:
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Could not detail file from storage"
             )
-            
-            
-            
-            
-storage_service = StorageService()
\ No newline at end of file
+
+    @timed_stage("storage_delete_batch")
+    async def delete_files(self, filenames: List[str]) -> List[str]:
+        # returns the keys that could not be deleted, a failed call fails its whole chunk
+        failed: List[str] = []
+        for i in range(0, len(filenames), MAX_DELETE_BATCH):
+            chunk = filenames[i:i + MAX_DELETE_BATCH]
+            try:
+                resp = await asyncio.to_thread(
+                    self.s3_client.delete_objects,
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True}
+                )
+            except (BotoCoreError, ClientError) as e:
+                logger.error(f"Bulk delete of {len(chunk)} objects failed: {e}")
+                failed.extend(chunk)
+                continue
+            for error in resp.get("Errors", []):
+                logger.error(f"Bulk delete failed for {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+                failed.append(error["Key"])
+        return failed
+
+    @timed_stage("storage_get")
+    async def download_file(self, filename: str) -> bytes:
+        try:
+            resp = await asyncio.to_thread(
+                self.s3_client.get_object,
+                Bucket=self.bucket_name,
+                Key=filename
+            )
+            return await asyncio.to_thread(resp["Body"].read)
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not download file from storage"
+            )
+
+    @timed_stage("storage_get")
+    async def open_stream(self, filename: str, byte_range: Optional[Tuple[int, int]] = None) -> ObjectStream:
+        # the body is left unread, so serving an object doesn't have to hold all of it
+        try:
+            resp = await asyncio.to_thread(
+                self.s3_client.get_object,
+                Bucket=self.bucket_name,
+                Key=filename,
+                **range_arg(byte_range)
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not download file from storage"
+            )
+        body = resp["Body"]
+        return ObjectStream(lambda size: asyncio.to_thread(body.read, size), body.close, resp)
+
+    async def create_multipart_upload(self, filename: str, mime_type: str) -> str:
+        try:
+            resp = await asyncio.to_thread(
+                self.s3_client.create_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=filename,
+                ContentType=mime_type
+            )
+            return resp["UploadId"]
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    @timed_stage("storage_put_part")
+    async def upload_part(self, filename: str, upload_id: str, part_number: int, data: bytes) -> str:
+        try:
+            resp = await asyncio.to_thread(
+                self.s3_client.upload_part,
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return resp["ETag"]
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    @timed_stage("storage_complete_multipart")
+    async def complete_multipart_upload(self, filename: str, upload_id: str, parts: List[dict]) -> None:
+        try:
+            await asyncio.to_thread(
+                self.s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    async def abort_multipart_upload(self, filename: str, upload_id: str) -> None:
+        try:
+            await asyncio.to_thread(
+                self.s3_client.abort_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id
+            )
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Could not abort multipart upload {upload_id} for {filename}: {e}")
+
+    def multipart_writer(self, filename: str, mime_type: str) -> "MultipartWriter":
+        return MultipartWriter(self, filename, mime_type, settings.S3_MULTIPART_PART_SIZE)
+
+
+class MultipartWriter:
+    # Feeds parts to a multipart upload as data is written, keeping one part buffered and one in flight.
+    # Objects smaller than a part never start a multipart upload and go up as a single PUT on complete().
+
+    def __init__(self, storage: StorageService, filename: str, mime_type: str, part_size: int):
+        self.storage = storage
+        self.filename = filename
+        self.mime_type = mime_type
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.size = 0
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[dict] = []
+        self._inflight: Optional[asyncio.Task] = None
+
+    async def _send_part(self, data: bytes) -> None:
+        if self._inflight is not None:
+            await self._inflight
+        if self._upload_id is None:
+            self._upload_id = await self.storage.create_multipart_upload(self.filename, self.mime_type)
+        part_number = len(self._parts) + 1
+        part = {"PartNumber": part_number}
+        self._parts.append(part)
+
+        async def send():
+            part["ETag"] = await self.storage.upload_part(self.filename, self._upload_id, part_number, data)
+
+        self._inflight = asyncio.ensure_future(send())
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            chunk = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._send_part(chunk)
+
+    async def complete(self) -> None:
+        if self._upload_id is None:
+            await self.storage.upload_file(io.BytesIO(bytes(self._buffer)), self.filename, self.mime_type)
+        else:
+            if self._buffer:
+                await self._send_part(bytes(self._buffer))
+            if self._inflight is not None:
+                await self._inflight
+            await self.storage.complete_multipart_upload(self.filename, self._upload_id, self._parts)
+        self._buffer = bytearray()
+
+    async def abort(self) -> None:
+        if self._inflight is not None:
+            self._inflight.cancel()
+            try:
+                await self._inflight
+            except BaseException:
+                pass
+        if self._upload_id is not None:
+            await self.storage.abort_multipart_upload(self.filename, self._upload_id)
+        self._buffer = bytearray()
+
+
+class AioStorageService(StorageService):
+    # Same interface as StorageService on a native async client (aiobotocore): no thread hop per call and
+    # a shared keep-alive connection pool sized by S3_MAX_POOL_CONNECTIONS. SigV4 and retries come from botocore.
+
+    def __init__(self):
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+
+        self.bucket_name = settings.S3_BUCKET_NAME
+        self._session = get_session()
+        self._config = AioConfig(
+            signature_version='s3v4',
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+            retries={'max_attempts': settings.S3_MAX_ATTEMPTS, 'mode': 'standard'},
+            connector_args={'keepalive_timeout': settings.S3_KEEPALIVE_TIMEOUT}
+        )
+        self._client = None
+        self._client_cm = None
+        self._client_lock = asyncio.Lock()
+
+    async def _get_client(self):
+        if self._client is None:
+            async with self._client_lock:
+                if self._client is None:
+                    self._client_cm = self._session.create_client(
+                        's3',
+                        endpoint_url=settings.S3_ENDPOINT_URL,
+                        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+                        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+                        region_name=S3_REGION,
+                        config=self._config
+                    )
+                    self._client = await self._client_cm.__aenter__()
+        return self._client
+
+    async def check(self) -> None:
+        client = await self._get_client()
+        await client.head_bucket(Bucket=self.bucket_name)
+
+    async def close(self) -> None:
+        if self._client_cm is not None:
+            try:
+                await self._client_cm.__aexit__(None, None, None)
+            except Exception as e:
+                logger.warning(f"Error closing S3 client: {e}")
+            finally:
+                self._client = None
+                self._client_cm = None
+
+    @timed_stage("storage_put")
+    async def upload_file(
+        self,
+        file_obj: BinaryIO,
+        filename: str,
+        mime_type: str
+    ) -> str:
+        try:
+            body = file_obj.getvalue() if isinstance(file_obj, io.BytesIO) else await asyncio.to_thread(file_obj.read)
+            client = await self._get_client()
+            await client.put_object(Bucket=self.bucket_name, Key=filename, Body=body, ContentType=mime_type)
+            return f"{settings.S3_ENDPOINT_URL}/{self.bucket_name}/{filename}"
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    @timed_stage("storage_delete")
+    async def delete_file(self, filename: str) -> None:
+        try:
+            client = await self._get_client()
+            await client.delete_object(Bucket=self.bucket_name, Key=filename)
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not detail file from storage"
+            )
+
+    @timed_stage("storage_delete_batch")
+    async def delete_files(self, filenames: List[str]) -> List[str]:
+        failed: List[str] = []
+        chunks = [filenames[i:i + MAX_DELETE_BATCH] for i in range(0, len(filenames), MAX_DELETE_BATCH)]
+
+        async def delete_chunk(chunk: List[str]):
+            try:
+                client = await self._get_client()
+                resp = await client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True}
+                )
+            except (BotoCoreError, ClientError) as e:
+                logger.error(f"Bulk delete of {len(chunk)} objects failed: {e}")
+                failed.extend(chunk)
+                return
+            for error in resp.get("Errors", []):
+                logger.error(f"Bulk delete failed for {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+                failed.append(error["Key"])
+
+        await asyncio.gather(*(delete_chunk(chunk) for chunk in chunks))
+        return failed
+
+    @timed_stage("storage_get")
+    async def download_file(self, filename: str) -> bytes:
+        try:
+            client = await self._get_client()
+            resp = await client.get_object(Bucket=self.bucket_name, Key=filename)
+            async with resp["Body"] as stream:
+                return await stream.read()
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not download file from storage"
+            )
+
+    @timed_stage("storage_get")
+    async def open_stream(self, filename: str, byte_range: Optional[Tuple[int, int]] = None) -> ObjectStream:
+        try:
+            client = await self._get_client()
+            resp = await client.get_object(Bucket=self.bucket_name, Key=filename, **range_arg(byte_range))
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not download file from storage"
+            )
+        body = resp["Body"]
+        return ObjectStream(body.read, body.close, resp)
+
+    async def create_multipart_upload(self, filename: str, mime_type: str) -> str:
+        try:
+            client = await self._get_client()
+            resp = await client.create_multipart_upload(Bucket=self.bucket_name, Key=filename, ContentType=mime_type)
+            return resp["UploadId"]
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    @timed_stage("storage_put_part")
+    async def upload_part(self, filename: str, upload_id: str, part_number: int, data: bytes) -> str:
+        try:
+            client = await self._get_client()
+            resp = await client.upload_part(
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return resp["ETag"]
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    @timed_stage("storage_complete_multipart")
+    async def complete_multipart_upload(self, filename: str, upload_id: str, parts: List[dict]) -> None:
+        try:
+            client = await self._get_client()
+            await client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Could not upload file to storagee"
+            )
+
+    async def abort_multipart_upload(self, filename: str, upload_id: str) -> None:
+        try:
+            client = await self._get_client()
+            await client.abort_multipart_upload(Bucket=self.bucket_name, Key=filename, UploadId=upload_id)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Could not abort multipart upload {upload_id} for {filename}: {e}")
+
+
+def create_storage_service() -> StorageService:
+    if settings.STORAGE_BACKEND == "aiobotocore":
+        return AioStorageService()
+    return StorageService()
+
+
+storage_service = create_storage_service()
\ No newline at end of file
@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def admin(client, monkeypatch):
+    from api.routes import admin
+    from core.config import settings
+
+    def request(token, **kwargs):
+        monkeypatch.setattr(settings, "ADMIN_TOKEN", token)
+
+        async def main():
+            async with client(admin.router) as http:
+                return await http.get("/admin/profile", **kwargs)
+        return asyncio.run(main())
+    return request
+
+
+def test_profile_is_hidden_without_a_configured_token(admin):
+    response = admin(None, headers={"Authorization": "Bearer anything"})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", "Basic s3cret", "s3cret", "Bearer ", "Bearer s3cret2"])
+def test_profile_rejects_a_missing_or_wrong_token(admin, authorization):
+    headers = {"Authorization": authorization} if authorization is not None else {}
+    response = admin("s3cret", headers=headers, params={"seconds": 0.05})
+    assert response.status_code == 401
+
+
+def test_profile_with_the_token(admin):
+    response = admin("s3cret", headers={"Authorization": "bearer s3cret"}, params={"seconds": 0.05, "interval_ms": 5})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert int(response.headers["x-profile-samples"]) > 0
+
+
+def test_profile_length_is_capped(admin):
+    response = admin("s3cret", headers={"Authorization": "Bearer s3cret"}, params={"seconds": 3600})
+    assert response.status_code == 400
@@ -0,0 +1,141 @@
+import uuid
+from datetime import datetime, timezone, timedelta
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, update
+
+# against the Postgres in DATABASE_URL (see conftest.py)
+
+CONTENT_HASH = "ab" * 32
+
+
+def staged(object_key: str, duplicate: bool = False) -> dict:
+    # the parts of a staged upload insert_images reads
+    return {
+        "filename": str(uuid.uuid4()),
+        "object_key": object_key,
+        "content_hash": CONTENT_HASH,
+        "duplicate": duplicate,
+        "size": 100,
+        "mime_type": "image/webp",
+        "is_processed": True,
+        "pending_job": None,
+        "variants": {},
+    }
+
+
+async def insert(items: list, commit: bool = True) -> dict:
+    from db.session import AsyncSessionLocal
+    from api.routes.upload import insert_images
+
+    async with AsyncSessionLocal() as session:
+        ids = await insert_images(session, items, "127.0.0.1", datetime.now(timezone.utc) + timedelta(hours=1))
+        if commit:
+            await session.commit()
+        else:
+            await session.rollback()
+    return ids
+
+
+async def ref_count():
+    from db.session import AsyncSessionLocal
+    from models.stored_object import StoredObject
+
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(StoredObject.ref_count).where(StoredObject.content_hash == CONTENT_HASH))
+
+
+def test_duplicates_take_their_reference_with_the_insert(schema, run):
+    from services.dedup import find_duplicate
+
+    async def scenario():
+        await insert([staged("original")])
+        assert await ref_count() == 1
+
+        duplicate = await find_duplicate(CONTENT_HASH)
+        assert duplicate.object_key == "original"
+        # the lookup alone takes nothing
+        assert await ref_count() == 1
+
+        # an upload that fails after the lookup leaves no reference behind
+        await insert([staged(duplicate.object_key, duplicate=True)], commit=False)
+        assert await ref_count() == 1
+
+        await insert([staged(duplicate.object_key, duplicate=True), staged(duplicate.object_key, duplicate=True)])
+        assert await ref_count() == 3
+
+    run(scenario)
+
+
+def test_identical_uploads_in_one_batch_register_once(schema, run):
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async def scenario():
+        ids = await insert([staged("first"), staged("second")])
+        assert await ref_count() == 1
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Image.object_url, Image.content_hash).where(Image.id.in_(ids.values())))
+            tracked = dict(result.all())
+        # the loser keeps its own object, untracked
+        assert tracked == {"s3://first": CONTENT_HASH, "s3://second": None}
+
+    run(scenario)
+
+
+def test_duplicate_of_an_object_expired_since_the_lookup_is_refused(schema, run):
+    from db.session import AsyncSessionLocal
+    from services.dedup import find_duplicate, release_references
+
+    async def scenario():
+        await insert([staged("original")])
+        duplicate = await find_duplicate(CONTENT_HASH)
+        async with AsyncSessionLocal() as session:
+            assert await release_references(session, [CONTENT_HASH]) == ["original"]
+            await session.commit()
+
+        with pytest.raises(HTTPException) as exc:
+            await insert([staged(duplicate.object_key, duplicate=True)])
+        assert exc.value.status_code == 503
+        assert await ref_count() is None
+
+    run(scenario)
+
+
+class DeletedKeys(list):
+    # records what expiry deletes from storage
+    async def delete_files(self, keys):
+        self.extend(keys)
+        return []
+
+
+def test_expiring_shared_rows_deletes_the_object_with_the_last(schema, run, monkeypatch):
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+    from services import expiry
+
+    deleted = DeletedKeys()
+    monkeypatch.setattr(expiry, "storage_service", deleted)
+
+    async def expire(image_id) -> None:
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Image).where(Image.id == image_id).values(expires_at=now - timedelta(seconds=1)))
+            batch = await expiry.claim_expired_batch(session, now, 10, since=now - timedelta(days=1))
+            await expiry.delete_claimed(session, batch)
+            await session.commit()
+
+    async def scenario():
+        first = (await insert([staged("original")])).popitem()[1]
+        second = (await insert([staged("original", duplicate=True)])).popitem()[1]
+        assert await ref_count() == 2
+
+        await expire(first)
+        assert deleted == []
+        assert await ref_count() == 1
+
+        await expire(second)
+        assert deleted == ["original"]
+        assert await ref_count() is None
+
+    run(scenario)
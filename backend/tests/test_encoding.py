@@ -0,0 +1,38 @@
+from services.encoding import ImageSignals, adaptive_policy
+
+
+def signals(size=(1000, 1000), target_size=None, source_bytes=100_000, source_format="JPEG", **flags) -> ImageSignals:
+    return ImageSignals(
+        source_format=source_format,
+        size=size,
+        target_size=target_size or size,
+        source_bytes=source_bytes,
+        has_alpha=flags.get("has_alpha", False),
+        has_metadata=flags.get("has_metadata", False),
+    )
+
+
+def test_compact_lossy_sources_skip_unless_they_carry_metadata():
+    # 0.8 bits per pixel
+    assert adaptive_policy(signals()).skip
+    assert not adaptive_policy(signals(has_metadata=True)).skip
+    # a resize always re-encodes, as does a format without a skip threshold
+    assert not adaptive_policy(signals(target_size=(500, 500))).skip
+    assert not adaptive_policy(signals(source_format="PNG")).skip
+
+
+def test_alpha_raises_quality(monkeypatch):
+    from core.config import settings
+
+    monkeypatch.setattr(settings, "WEBP_QUALITY", 75)
+    big = dict(source_bytes=10_000_000)
+    assert adaptive_policy(signals(**big)).quality == 75
+    assert adaptive_policy(signals(has_alpha=True, **big)).quality == 90
+
+
+def test_method_is_capped_for_large_outputs(monkeypatch):
+    from core.config import settings
+
+    monkeypatch.setattr(settings, "WEBP_METHOD", 6)
+    assert adaptive_policy(signals(size=(1000, 1000), source_bytes=10_000_000)).method == 6
+    assert adaptive_policy(signals(size=(2500, 2000), source_bytes=50_000_000)).method == 4
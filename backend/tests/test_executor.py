@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+import pytest
+
+
+def sleep_then(seconds: float, value):
+    time.sleep(seconds)
+    return value
+
+
+def worker_pid(seconds: float = 0) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def touch(path: str) -> None:
+    open(path, "w").close()
+
+
+def test_overrun_replaces_the_pool_without_killing_other_jobs():
+    from services.executor import ProcessingExecutor
+
+    executor = ProcessingExecutor(max_workers=2, queue_size=2, job_timeout=0.5)
+
+    async def scenario():
+        # start both workers so the two jobs below run side by side
+        old_workers = set(await asyncio.gather(executor.run(worker_pid, 0.2), executor.run(worker_pid, 0.2)))
+        pool = executor._pool
+        assert len(old_workers) == 2
+
+        overrun = asyncio.create_task(executor.run(sleep_then, 2, "late"))
+        neighbour = asyncio.create_task(executor.run(worker_pid, 1, timeout=5))
+        with pytest.raises(asyncio.TimeoutError):
+            await overrun
+        assert executor._pool is None
+
+        # the job sharing the old pool finishes there rather than being resubmitted
+        assert await neighbour in old_workers
+        assert await executor.run(sleep_then, 0, "fresh") == "fresh"
+        assert executor._pool is not pool
+        await executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_keeps_its_slot_until_the_job_ends():
+    from services.executor import ProcessingExecutor
+
+    executor = ProcessingExecutor(max_workers=1, queue_size=0, job_timeout=5)
+
+    async def scenario():
+        await executor.run(sleep_then, 0, None)
+        slots = executor._get_slots()
+
+        orphaned = asyncio.create_task(executor.run(sleep_then, 1, "discarded"))
+        await asyncio.sleep(0.3)
+        orphaned.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await orphaned
+        # the worker is still busy with it
+        assert slots.locked()
+
+        started = time.perf_counter()
+        assert await executor.run(sleep_then, 0, "next") == "next"
+        assert time.perf_counter() - started > 0.3
+        assert not slots.locked()
+        await executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_drops_a_queued_job(tmp_path):
+    from services.executor import ProcessingExecutor
+
+    # room for exactly the four jobs below
+    executor = ProcessingExecutor(max_workers=1, queue_size=3, job_timeout=5)
+    marker = tmp_path / "ran"
+
+    async def scenario():
+        await executor.run(sleep_then, 0, None)
+
+        running = asyncio.create_task(executor.run(sleep_then, 0.5, "first"))
+        await asyncio.sleep(0.1)
+        # the pool hands calls to its workers ahead of time, two fill that up and the next one stays queued
+        handed_over = [asyncio.create_task(executor.run(sleep_then, 0, value)) for value in ("second", "third")]
+        await asyncio.sleep(0.1)
+        queued = asyncio.create_task(executor.run(touch, str(marker)))
+        await asyncio.sleep(0.1)
+        assert executor._get_slots().locked()
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        # its slot is back straight away
+        assert not executor._get_slots().locked()
+        assert await asyncio.gather(running, *handed_over) == ["first", "second", "third"]
+        assert not marker.exists()
+        await executor.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+
+
+def prober(**checks):
+    from services.health import HealthProber
+
+    # /health reports the checks named database and storage
+    return HealthProber(interval=10.0, timeout=0.05, checks=checks)
+
+
+async def ok() -> None:
+    pass
+
+
+async def broken() -> None:
+    raise ConnectionError("connection refused")
+
+
+async def hangs() -> None:
+    await asyncio.sleep(1)
+
+
+@pytest.fixture
+def serve_health(monkeypatch, client):
+    from api.routes import health
+
+    def serve(probe, scenario):
+        monkeypatch.setattr(health, "health_prober", probe)
+
+        async def main():
+            async with client(health.router) as http:
+                return await scenario(http)
+        return asyncio.run(main())
+    return serve
+
+
+def test_snapshot_records_each_dependency():
+    probe = prober(database=ok, storage=broken, cache=hangs)
+    asyncio.run(probe.probe_all())
+    asyncio.run(probe.probe_all())
+    snapshot = probe.snapshot()
+
+    assert not snapshot["ready"] and not snapshot["stale"]
+    assert snapshot["database"]["status"] == "OK"
+    assert snapshot["database"]["success_rate"] == 1.0
+    assert snapshot["storage"]["status"] == "FAIL"
+    assert snapshot["storage"]["message"] == "connection refused"
+    assert snapshot["storage"]["consecutive_failures"] == 2
+    assert snapshot["cache"]["message"] == "timed out after 0.05s"
+    assert snapshot["cache"]["max_ms"] < 1000
+
+
+def test_health_serves_the_last_snapshot_without_probing(serve_health):
+    calls = []
+
+    async def counted() -> None:
+        calls.append(1)
+
+    probe = prober(database=counted, storage=counted)
+
+    async def scenario(http):
+        # nothing probed yet
+        before = await http.get("/health")
+        assert before.status_code == 503
+        assert before.json()["stale"]
+
+        await probe.probe_all()
+        for _ in range(5):
+            response = await http.get("/health")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["status"] == "OK"
+        assert body["database"]["status"] == body["storage"]["status"] == "OK"
+        # the requests themselves never reach a dependency
+        assert len(calls) == 2
+
+    serve_health(probe, scenario)
+
+
+def test_failing_dependency_makes_health_unavailable(serve_health):
+    probe = prober(database=ok, storage=broken)
+
+    async def scenario(http):
+        await probe.probe_all()
+        response = await http.get("/health")
+        assert response.status_code == 503
+        assert response.json()["status"] == "UNAVAILABLE"
+        assert response.json()["storage"]["message"] == "connection refused"
+
+    serve_health(probe, scenario)
+
+
+def test_stale_snapshot_is_not_ready(serve_health):
+    from services.health import STALE_AFTER_INTERVALS
+
+    probe = prober(database=ok, storage=ok)
+
+    async def scenario(http):
+        await probe.probe_all()
+        # the prober stopped running three intervals ago
+        probe._last_round -= probe.interval * STALE_AFTER_INTERVALS + 1
+        response = await http.get("/health")
+        assert response.status_code == 503
+        assert response.json()["stale"]
+
+    serve_health(probe, scenario)
+
+
+def test_liveness_never_touches_a_dependency(serve_health):
+    probe = prober(database=broken, storage=hangs)
+
+    async def scenario(http):
+        response = await http.get("/health/live")
+        assert response.status_code == 200
+        assert response.json()["status"] == "OK"
+
+    serve_health(probe, scenario)
+    assert probe._last_round is None
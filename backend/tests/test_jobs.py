@@ -0,0 +1,129 @@
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import insert, select, update, func
+
+# against the Postgres in DATABASE_URL (see conftest.py)
+
+
+async def add_images(count: int, **values) -> None:
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(Image).values([
+            {
+                "filename": f"{values.get('is_processed', False)}-{values.get('deleted_at') is not None}-{i}",
+                "object_url": "s3://object",
+                "size_bytes": 100,
+                "mime_type": "image/png",
+                "ip_address": "127.0.0.1",
+                "is_processed": False,
+                "uploaded_at": now - timedelta(minutes=count - i),
+                **values,
+            }
+            for i in range(count)
+        ]))
+        await session.commit()
+
+
+async def make_visible() -> None:
+    # what the visibility timeout or a backoff does once it passes
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(Image).values(process_after=func.now() - timedelta(seconds=1)))
+        await session.commit()
+
+
+async def queue_state(job):
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Image.process_attempts, Image.process_after - func.now(), Image.process_error)
+            .where(Image.id == job.image_id)
+        )
+        return result.one()
+
+
+def test_claims_skip_processed_and_deleted_rows(schema, run):
+    from services.jobs import claim_jobs
+
+    async def scenario():
+        await add_images(3)
+        await add_images(1, is_processed=True)
+        await add_images(1, deleted_at=datetime.now(timezone.utc))
+
+        jobs = await claim_jobs(2)
+        # oldest first
+        assert [job.filename for job in jobs] == ["False-False-0", "False-False-1"]
+        assert {job.attempts for job in jobs} == {1}
+        assert [job.filename for job in await claim_jobs(10)] == ["False-False-2"]
+        # claimed jobs stay invisible for the visibility timeout
+        assert await claim_jobs(10) == []
+
+    run(scenario)
+
+
+def test_job_is_claimed_again_after_the_visibility_timeout(schema, run):
+    from core.config import settings
+    from services.jobs import claim_jobs
+
+    async def scenario():
+        await add_images(1)
+        job, = await claim_jobs(1)
+        attempts, invisible_for, _ = await queue_state(job)
+        assert attempts == 1
+        assert abs(invisible_for.total_seconds() - settings.QUEUE_VISIBILITY_TIMEOUT) < 5
+
+        # the worker died without a word
+        await make_visible()
+        again, = await claim_jobs(1)
+        assert again.image_id == job.image_id
+        assert again.attempts == 2
+
+    run(scenario)
+
+
+def test_failed_job_backs_off_exponentially(schema, run, monkeypatch):
+    from core.config import settings
+    from services.jobs import claim_jobs, fail_job
+
+    monkeypatch.setattr(settings, "QUEUE_BACKOFF_BASE", 100.0)
+
+    async def scenario():
+        await add_images(1)
+        for attempt, backoff in [(1, 100), (2, 200), (3, 400)]:
+            job, = await claim_jobs(1)
+            assert job.attempts == attempt
+            await fail_job(job, f"ValueError: attempt {attempt}")
+
+            _, retry_in, error = await queue_state(job)
+            assert abs(retry_in.total_seconds() - backoff) < 5
+            assert error == f"ValueError: attempt {attempt}"
+            assert await claim_jobs(1) == []
+            await make_visible()
+
+    run(scenario)
+
+
+def test_job_is_given_up_once_attempts_run_out(schema, run, monkeypatch):
+    from core.config import settings
+    from services.jobs import claim_jobs, fail_job
+
+    monkeypatch.setattr(settings, "QUEUE_MAX_ATTEMPTS", 2)
+
+    async def scenario():
+        await add_images(1)
+        for _ in range(2):
+            job, = await claim_jobs(1)
+            await fail_job(job, "OSError: broken")
+            await make_visible()
+
+        assert await claim_jobs(1) == []
+        attempts, _, error = await queue_state(job)
+        assert (attempts, error) == (2, "OSError: broken")
+
+    run(scenario)
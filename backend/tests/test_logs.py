@@ -0,0 +1,27 @@
+import json
+import queue
+import logging
+from core import logs
+
+
+def test_records_after_stop_are_written_directly(monkeypatch, capsys):
+    handler = logs.BoundedQueueHandler(queue.Queue(), "block", 1.0)
+    listener = logs.DrainingQueueListener(handler.queue, logs.stream_handler())
+    listener.start()
+    monkeypatch.setattr(logs, "_handler", handler)
+    monkeypatch.setattr(logs, "_listener", listener)
+
+    logger = logging.getLogger("imghost.test_logs")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        logger.info("queued %s", 1)
+        logs.stop_logging()
+        logger.info("after stop")
+        # stopping twice (shutdown and atexit) is harmless
+        logs.stop_logging()
+    finally:
+        logger.removeHandler(handler)
+
+    messages = [json.loads(line)["message"] for line in capsys.readouterr().out.splitlines()]
+    assert messages == ["queued 1", "after stop"]
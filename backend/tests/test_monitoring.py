@@ -0,0 +1,49 @@
+import socket
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_serve_metrics_exposes_the_registry():
+    from core.monitoring import DELETE_COUNT, serve_metrics
+
+    port = _free_port()
+    serve_metrics(port)
+    DELETE_COUNT.inc(3)
+    body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5).read().decode()
+    assert "imghost_deletes_total" in body
+    # a second process on the same host only gets a warning
+    serve_metrics(port)
+
+
+def test_push_metrics_sends_the_job():
+    from core.monitoring import push_metrics
+
+    received = []
+
+    class Gateway(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            received.append((self.path, self.rfile.read(int(self.headers["Content-Length"])).decode()))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Gateway)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        push_metrics(f"http://127.0.0.1:{server.server_address[1]}", "imghost_cleanup")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert received[0][0] == "/metrics/job/imghost_cleanup"
+    assert "imghost_stage_seconds" in received[0][1]
@@ -0,0 +1,162 @@
+from datetime import date, datetime, timezone, timedelta
+from sqlalchemy import text
+
+# against the Postgres in DATABASE_URL (see conftest.py); the tables there are dropped and rebuilt
+
+
+BASELINE_DDL = [
+    """
+    CREATE TABLE images (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        filename VARCHAR NOT NULL UNIQUE,
+        object_url VARCHAR NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        mime_type VARCHAR NOT NULL,
+        uploaded_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+        expires_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now() + interval '24 hours',
+        is_processed BOOLEAN NOT NULL,
+        thumbnail_url VARCHAR,
+        ip_address VARCHAR(45) NOT NULL,
+        deleted_at TIMESTAMP WITH TIME ZONE
+    )
+    """,
+    "CREATE INDEX idx_expires_at ON images (expires_at)",
+    "CREATE INDEX idx_deleted_at ON images (deleted_at)",
+    "CREATE INDEX idx_is_processed ON images (is_processed)",
+]
+
+
+async def insert(conn, uploaded_at: datetime) -> None:
+    await conn.execute(
+        text(
+            "INSERT INTO images (filename, object_url, size_bytes, mime_type, uploaded_at, ip_address, is_processed) "
+            "VALUES (:filename, :filename, 1, 'image/png', :uploaded_at, '127.0.0.1', true)"
+        ),
+        {"filename": uploaded_at.isoformat(), "uploaded_at": uploaded_at}
+    )
+
+
+async def placement(conn) -> dict:
+    result = await conn.execute(text("SELECT filename, tableoid::regclass::text FROM images"))
+    return dict(result.all())
+
+
+def test_rows_without_a_day_partition_land_in_default_and_move_out(db, run):
+    from models.image import Image
+    from db.partitions import DEFAULT_PARTITION, ensure_partitions, create_partitions_ahead, partition_name
+
+    today = date(2026, 3, 10)
+    uploaded_at = datetime(2026, 3, 11, 12, tzinfo=timezone.utc)
+
+    async def scenario():
+        async with db.begin() as conn:
+            await conn.run_sync(Image.__table__.create)
+            await ensure_partitions(conn, [])
+            await insert(conn, uploaded_at)
+            assert await placement(conn) == {uploaded_at.isoformat(): DEFAULT_PARTITION}
+
+        await create_partitions_ahead(today)
+        async with db.connect() as conn:
+            assert await placement(conn) == {uploaded_at.isoformat(): partition_name(uploaded_at.date())}
+        # running it again finds everything in place
+        await create_partitions_ahead(today)
+
+    run(scenario)
+
+
+def test_migration_partitions_an_existing_table(db, run):
+    from db.partitions import list_partitions, partition_name
+    from migrate_partitions import migrate
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    uploads = [now, now - timedelta(days=1), now - timedelta(days=30)]
+
+    async def scenario():
+        # the table as it was first deployed, before partitioning and the columns added since
+        async with db.begin() as conn:
+            for statement in BASELINE_DDL:
+                await conn.execute(text(statement))
+            for uploaded_at in uploads:
+                await insert(conn, uploaded_at)
+
+        await migrate()
+        async with db.connect() as conn:
+            assert await conn.scalar(text("SELECT to_regclass('images_unpartitioned')")) is None
+            assert await placement(conn) == {
+                uploaded_at.isoformat(): partition_name(uploaded_at.astimezone(timezone.utc).date())
+                for uploaded_at in uploads
+            }
+            assert partition_name((now + timedelta(days=7)).date()) in await list_partitions(conn)
+            # columns the old table didn't have come up with their defaults
+            assert await conn.scalar(text("SELECT array_agg(DISTINCT process_attempts) FROM images")) == [0]
+
+        # a second run leaves the partitioned table alone
+        await migrate()
+        async with db.connect() as conn:
+            assert len(await placement(conn)) == len(uploads)
+
+    run(scenario)
+
+
+def test_cleanup_drops_partitions_past_retention_next_to_the_default(db, run):
+    from models.image import Image
+    from db.partitions import DEFAULT_PARTITION, ensure_partitions, list_partitions, partition_name
+    from cleanup import RETENTION_DAYS, drop_expired_partitions
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    old = now - timedelta(days=RETENTION_DAYS + 5)
+    recent = now - timedelta(days=1)
+
+    async def scenario():
+        async with db.begin() as conn:
+            await conn.run_sync(Image.__table__.create)
+            await ensure_partitions(conn, [old.date(), recent.date()])
+            for uploaded_at in (old, recent):
+                await insert(conn, uploaded_at)
+            await conn.execute(
+                text("UPDATE images SET deleted_at = :deleted_at WHERE uploaded_at = :uploaded_at"),
+                {"deleted_at": old + timedelta(hours=24), "uploaded_at": old}
+            )
+
+        await drop_expired_partitions()
+        async with db.connect() as conn:
+            partitions = await list_partitions(conn)
+            assert partition_name(old.date()) not in partitions
+            assert {DEFAULT_PARTITION, partition_name(recent.date())} <= set(partitions)
+            assert list(await placement(conn)) == [recent.isoformat()]
+
+    run(scenario)
+
+
+def test_schema_migration_brings_the_baseline_table_up_to_the_model(db, run):
+    from models.image import Image
+    from models.stored_object import StoredObject
+    import migrate_schema
+    import migrate_partitions
+
+    async def columns(conn, table: str = "images") -> set:
+        result = await conn.execute(
+            text("SELECT column_name FROM information_schema.columns WHERE table_name = :table"), {"table": table}
+        )
+        return set(result.scalars().all())
+
+    async def scenario():
+        async with db.begin() as conn:
+            for statement in BASELINE_DDL:
+                await conn.execute(text(statement))
+            await insert(conn, datetime.now(timezone.utc))
+
+        await migrate_schema.migrate()
+        async with db.connect() as conn:
+            assert await columns(conn) == {column.name for column in Image.__table__.columns}
+            assert await columns(conn, "stored_objects") == {column.name for column in StoredObject.__table__.columns}
+            assert await conn.scalar(text("SELECT process_attempts FROM images")) == 0
+
+        # the rollout order: the schema first, then partitioning, and the schema step is a no-op after that
+        await migrate_partitions.migrate()
+        await migrate_schema.migrate()
+        async with db.connect() as conn:
+            indexes = await conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'images'"))
+            assert {index.name for index in Image.__table__.indexes} <= set(indexes.scalars().all())
+
+    run(scenario)
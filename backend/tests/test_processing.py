@@ -0,0 +1,254 @@
+import io
+import os
+import time
+import struct
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from PIL import Image as PilImage, ExifTags
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _peak_rss_growth_kb(path: str, planned: bool) -> tuple:
+    # runs in a fresh spawned process; the peak is reset first so import-time spikes don't hide the decode
+    from services.processing import decode_for_target
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    before = _status_kb("VmRSS")
+    started = time.perf_counter()
+    img = PilImage.open(io.BytesIO(data))
+    if planned:
+        decode_for_target(img)
+    else:
+        img.load()
+    return _status_kb("VmHWM") - before, time.perf_counter() - started
+
+
+def _measure(path: str, planned: bool) -> tuple:
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_peak_rss_growth_kb, path, planned).result()
+
+
+def _gradient(size) -> PilImage.Image:
+    return PilImage.linear_gradient("L").resize(size).convert("RGB")
+
+
+@pytest.fixture(scope="module")
+def large_jpeg(tmp_path_factory):
+    path = tmp_path_factory.mktemp("decode") / "large.jpg"
+    _gradient((6000, 4000)).save(path, format="JPEG", quality=90)
+    return str(path)
+
+
+needs_peak_reset = pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="needs Linux peak RSS reset")
+
+
+@needs_peak_reset
+def test_draft_decode_stays_under_memory_bound(large_jpeg):
+    full, _ = _measure(large_jpeg, False)
+    planned, seconds = _measure(large_jpeg, True)
+
+    # Pillow keeps RGB at 4 bytes per pixel: a full 6000x4000 decode is ~96 MB, a draft decode at 1/2 scale
+    # is ~24 MB, plus ~17 MB for the 2500x1666 resize
+    assert full > 80 * 1024
+    assert planned < 64 * 1024
+    assert seconds < 5
+
+
+@needs_peak_reset
+@pytest.mark.parametrize("fmt, size", [("PNG", (6000, 4000)), ("HEIF", (4000, 3000))])
+def test_decode_without_draft_holds_one_full_frame(tmp_path, fmt, size):
+    # no draft mode here, the full decode is the floor; what's on top is the box-reduced intermediate and
+    # the resize, never a second full-size frame (a copying exif_transpose or convert would be one)
+    pytest.importorskip("pillow_heif").register_heif_opener()
+    path = tmp_path / f"large.{fmt.lower()}"
+    _gradient(size).save(path, format=fmt)
+    frame_kb = size[0] * size[1] * 4 // 1024
+
+    full, _ = _measure(str(path), False)
+    planned, seconds = _measure(str(path), True)
+    assert planned < full + frame_kb * 3 // 4
+    assert seconds < 5
+
+
+def _noise_jpeg(size=(600, 400), **options) -> bytes:
+    # noise doesn't compress, so the adaptive policy never skips it
+    output = io.BytesIO()
+    PilImage.effect_noise(size, 60).convert("RGB").save(output, format="JPEG", quality=95, **options)
+    return output.getvalue()
+
+
+def test_exif_xmp_and_gps_are_removed():
+    from services.processing import strip_exif_and_process
+
+    exif = PilImage.Exif()
+    exif[ExifTags.Base.Make] = "Camera"
+    exif[ExifTags.IFD.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (51.0, 30.0, 0.0)}
+    data = _noise_jpeg(exif=exif.tobytes(), xmp=b"<x:xmpmeta>location</x:xmpmeta>", comment=b"shot on")
+
+    processed = strip_exif_and_process(data, variant_sizes={"thumb": 100})
+    for output in [processed.data, *processed.variants.values()]:
+        img = PilImage.open(io.BytesIO(output))
+        assert img.format == "WEBP"
+        assert not img.getexif()
+        assert not {"exif", "xmp", "comment"} & set(img.info)
+        assert b"location" not in output
+
+
+def test_orientation_is_applied_to_the_pixels():
+    from services.processing import strip_exif_and_process
+
+    # left half red as stored; orientation 6 means the camera was turned, the top must come out red
+    img = PilImage.new("RGB", (600, 400), "blue")
+    img.paste("red", (0, 0, 300, 400))
+    exif = PilImage.Exif()
+    exif[ExifTags.Base.Orientation] = 6
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=95, exif=exif.tobytes())
+
+    processed = strip_exif_and_process(output.getvalue(), policy="fixed", variant_sizes={})
+    rotated = PilImage.open(io.BytesIO(processed.data))
+    assert rotated.size == (400, 600)
+    assert not rotated.getexif()
+    rotated = rotated.convert("RGB")
+    assert rotated.getpixel((200, 50))[0] > 200
+    assert rotated.getpixel((200, 550))[2] > 200
+
+
+@pytest.mark.parametrize("keep", [True, False])
+def test_icc_profile_follows_the_setting(monkeypatch, keep):
+    from PIL import ImageCms
+    from core.config import settings
+    from services.processing import strip_exif_and_process
+
+    monkeypatch.setattr(settings, "KEEP_ICC_PROFILE", keep)
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    processed = strip_exif_and_process(_noise_jpeg(icc_profile=profile), variant_sizes={})
+
+    assert PilImage.open(io.BytesIO(processed.data)).info.get("icc_profile") == (profile if keep else None)
+
+
+def _gif(size, durations) -> bytes:
+    frames = [PilImage.effect_noise(size, 40 + i * 10).convert("P") for i in range(len(durations))]
+    output = io.BytesIO()
+    frames[0].save(output, format="GIF", save_all=True, append_images=frames[1:], duration=durations, loop=0)
+    return output.getvalue()
+
+
+def _frame_durations(data: bytes) -> list:
+    img = PilImage.open(io.BytesIO(data))
+    durations = []
+    for index in range(img.n_frames):
+        img.seek(index)
+        img.load()
+        durations.append(img.info["duration"])
+    return durations
+
+
+@pytest.mark.parametrize("size, expected", [((300, 200), (300, 200)), ((3000, 400), (2500, 333))])
+def test_transcode_animation_keeps_per_frame_durations(size, expected):
+    from services.processing import transcode_animation
+
+    data = _gif(size, [10, 70, 100, 40])
+    processed = transcode_animation(PilImage.open(io.BytesIO(data)), len(data))
+
+    webp = PilImage.open(io.BytesIO(processed.data))
+    assert processed.mime_type == "image/webp"
+    assert webp.size == expected
+    assert webp.n_frames == 4
+    # delays under 20ms play at 100ms in browsers
+    assert _frame_durations(processed.data) == [100, 70, 100, 40]
+
+
+def test_transcode_animation_holds_one_resized_frame_at_a_time(monkeypatch):
+    from services import processing
+
+    held = []
+    frames = []
+    decode = processing.animation_frame
+
+    def tracked(*args):
+        # every resized frame except the first should be gone by the time the next one is decoded
+        held.append(sum(ref() is not None for ref in frames[1:]))
+        frame = decode(*args)
+        frames.append(weakref.ref(frame))
+        return frame
+
+    monkeypatch.setattr(processing, "animation_frame", tracked)
+    data = _gif((3000, 400), [50] * 6)
+    processing.transcode_animation(PilImage.open(io.BytesIO(data)), len(data))
+    assert len(frames) == 6
+    assert max(held) == 0
+
+
+def _gif_with_frame_past_the_screen() -> bytes:
+    # two 200x150 frames on a 200x150 screen, the second moved to (100, 100) so it runs past it
+    def single(color: int) -> bytes:
+        frame = PilImage.new("P", (200, 150), color)
+        frame.putpalette([0, 0, 0, 255, 0, 0, 0, 0, 255] + [0] * 759)
+        output = io.BytesIO()
+        frame.save(output, format="GIF", duration=50, optimize=False)
+        return output.getvalue()
+
+    first, second = single(1), single(2)
+    # header, screen descriptor and global color table, then the frame blocks up to the trailer
+    blocks = 13 + 3 * 2 ** ((first[10] & 7) + 1)
+    moved = bytearray(second[blocks:-1])
+    descriptor = moved.index(b"\x2c")
+    moved[descriptor + 1:descriptor + 5] = struct.pack("<HH", 100, 100)
+    return first[:-1] + bytes(moved) + b"\x3b"
+
+
+def test_transcode_animation_clips_frames_to_the_screen():
+    from services.processing import transcode_animation
+
+    data = _gif_with_frame_past_the_screen()
+    source = PilImage.open(io.BytesIO(data))
+    source.seek(1)
+    # Pillow grows the image to fit the frame
+    assert source.size == (300, 250)
+
+    processed = transcode_animation(PilImage.open(io.BytesIO(data)), len(data))
+    webp = PilImage.open(io.BytesIO(processed.data))
+    assert webp.size == (200, 150)
+    assert webp.n_frames == 2
+
+
+def _compact_jpeg(**options) -> bytes:
+    # a smooth gradient at low quality is well under the skip threshold
+    output = io.BytesIO()
+    PilImage.linear_gradient("L").resize((800, 600)).convert("RGB").save(output, format="JPEG", quality=50, **options)
+    return output.getvalue()
+
+
+def test_skip_serves_compact_sources_as_uploaded():
+    from services.processing import strip_exif_and_process
+
+    data = _compact_jpeg()
+    processed = strip_exif_and_process(data, policy="adaptive", variant_sizes={})
+    assert processed.data == data
+    assert processed.mime_type == "image/jpeg"
+
+
+def test_skip_never_serves_source_metadata():
+    from services.processing import strip_exif_and_process
+
+    exif = PilImage.Exif()
+    exif[ExifTags.IFD.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (51.0, 30.0, 0.0)}
+    for data in (_compact_jpeg(exif=exif.tobytes()), _compact_jpeg(xmp=b"<x:xmpmeta/>"), _compact_jpeg(comment=b"shot on")):
+        processed = strip_exif_and_process(data, policy="adaptive", variant_sizes={})
+        assert processed.mime_type == "image/webp"
+        output = PilImage.open(io.BytesIO(processed.data))
+        assert not output.getexif()
+        assert not {"exif", "xmp", "comment"} & set(output.info)
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from services.quota import UploadQuota
+
+
+def quota(limit: int = 10, recent: int = 0, shared: bool = True) -> UploadQuota:
+    # the database knows of `recent` uploads from 1.2.3.4 only
+    async def recover(ip_addr: str) -> int:
+        return recent if ip_addr == "1.2.3.4" else 0
+
+    q = UploadQuota("memory://", limit, recover=recover)
+    # one process stands in for every worker, as though the storage were shared
+    q.shared = shared
+    return q
+
+
+def test_check_consumes_nothing():
+    q = quota()
+
+    async def scenario():
+        for _ in range(5):
+            await q.check("1.2.3.4", 10)
+        await q.reserve("1.2.3.4", 10)
+        with pytest.raises(HTTPException) as exc:
+            await q.check("1.2.3.4", 1)
+        assert exc.value.status_code == 429
+
+    asyncio.run(scenario())
+
+
+def test_reserve_seeds_from_database_after_restart():
+    q = quota(recent=8)
+
+    async def scenario():
+        await q.check("1.2.3.4", 2)
+        await q.reserve("1.2.3.4", 2)
+        with pytest.raises(HTTPException):
+            await q.reserve("1.2.3.4", 1)
+        # other clients have their own window
+        await q.reserve("5.6.7.8", 10)
+
+    asyncio.run(scenario())
+
+
+def test_memory_storage_counts_from_database():
+    assert not UploadQuota("memory://", 10).shared
+    q = quota(recent=9, shared=False)
+
+    async def scenario():
+        await q.check("1.2.3.4", 1)
+        await q.reserve("1.2.3.4", 1)
+        with pytest.raises(HTTPException):
+            await q.check("1.2.3.4", 2)
+
+    asyncio.run(scenario())
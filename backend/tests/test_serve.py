@@ -0,0 +1,215 @@
+import io
+import os
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+from sqlalchemy import insert
+
+# the serve route against the Postgres in DATABASE_URL and a moto S3 (see conftest.py)
+
+DATA = bytes(range(256)) * 40
+VARIANT = b"variant bytes " * 100
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    from api.routes import serve
+    from services.cache import ObjectCache
+
+    cache = ObjectCache(memory_bytes=64 * 1024, max_object_bytes=32 * 1024, disk_dir=str(tmp_path / "cache"), disk_bytes=1024 * 1024)
+    monkeypatch.setattr(serve, "object_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def origin(schema, bucket, cache, monkeypatch, run, client):
+    # one live image plus a variant, stored in S3 and not cached yet
+    from api.routes import serve
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+    from services.storage import create_storage_service
+
+    storage = create_storage_service()
+    monkeypatch.setattr(serve, "storage_service", storage)
+
+    async def setup():
+        await storage.upload_file(io.BytesIO(DATA), "img", "image/png")
+        await storage.upload_file(io.BytesIO(VARIANT), "img_thumb", "image/webp")
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(Image).values(
+                filename="img",
+                object_url="s3://img",
+                size_bytes=len(DATA),
+                mime_type="image/png",
+                ip_address="127.0.0.1",
+                is_processed=True,
+                variants={"thumb": "img_thumb"},
+                expires_at=datetime.now(timezone.utc) + timedelta(hours=1),
+            ))
+            await session.commit()
+
+    run(setup)
+
+    def serve_requests(scenario):
+        async def main():
+            try:
+                async with client(serve.router) as http:
+                    return await scenario(http)
+            finally:
+                await storage.close()
+        return run(main)
+    return serve_requests
+
+
+def test_full_get_fills_the_cache_and_is_served_from_it(origin, cache):
+    from services.cache import object_cache_key
+
+    async def scenario(http):
+        first = await http.get("/i/img")
+        assert first.status_code == 200
+        assert first.content == DATA
+        assert first.headers["content-type"] == "image/png"
+        assert first.headers["accept-ranges"] == "bytes"
+        assert await cache.get(object_cache_key("img", len(DATA), "image/png")) == DATA
+
+        again = await http.get("/i/img")
+        assert again.content == DATA
+        assert again.headers["etag"] == first.headers["etag"]
+
+    origin(scenario)
+
+
+@pytest.mark.parametrize("warm", [False, True])
+def test_ranges(origin, warm):
+    async def scenario(http):
+        if warm:
+            await http.get("/i/img")
+        size = len(DATA)
+
+        partial = await http.get("/i/img", headers={"Range": "bytes=10-19"})
+        assert partial.status_code == 206
+        assert partial.content == DATA[10:20]
+        assert partial.headers["content-range"] == f"bytes 10-19/{size}"
+
+        suffix = await http.get("/i/img", headers={"Range": "bytes=-5"})
+        assert suffix.content == DATA[-5:]
+        assert suffix.headers["content-range"] == f"bytes {size - 5}-{size - 1}/{size}"
+
+        # an open end is clamped to the object
+        tail = await http.get("/i/img", headers={"Range": f"bytes={size - 3}-{size + 100}"})
+        assert tail.content == DATA[-3:]
+
+        beyond = await http.get("/i/img", headers={"Range": f"bytes={size}-"})
+        assert beyond.status_code == 416
+        assert beyond.headers["content-range"] == f"bytes */{size}"
+
+        # several ranges aren't supported, the whole object comes back
+        multi = await http.get("/i/img", headers={"Range": "bytes=0-1,5-6"})
+        assert multi.status_code == 200
+        assert multi.content == DATA
+
+    origin(scenario)
+
+
+def test_if_range_and_if_none_match(origin):
+    async def scenario(http):
+        etag = (await http.get("/i/img")).headers["etag"]
+
+        current = await http.get("/i/img", headers={"Range": "bytes=0-9", "If-Range": etag})
+        assert current.status_code == 206
+        assert current.content == DATA[:10]
+        # the client's copy is outdated, it gets the whole object instead of a piece of the new one
+        stale = await http.get("/i/img", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        assert stale.status_code == 200
+        assert stale.content == DATA
+
+        for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            not_modified = await http.get("/i/img", headers={"If-None-Match": header})
+            assert not_modified.status_code == 304
+            assert not_modified.content == b""
+            assert not_modified.headers["etag"] == etag
+        assert (await http.get("/i/img", headers={"If-None-Match": '"other"'})).status_code == 200
+
+    origin(scenario)
+
+
+def test_variant_range_learns_the_size_from_storage(origin):
+    async def scenario(http):
+        partial = await http.get("/i/img_thumb", headers={"Range": "bytes=-4"})
+        assert partial.status_code == 206
+        assert partial.content == VARIANT[-4:]
+        assert partial.headers["content-range"] == f"bytes {len(VARIANT) - 4}-{len(VARIANT) - 1}/{len(VARIANT)}"
+        assert (await http.get("/i/img_missing")).status_code == 404
+
+    origin(scenario)
+
+
+def test_head_sends_no_body(origin):
+    async def scenario(http):
+        head = await http.head("/i/img", headers={"Range": "bytes=0-99"})
+        assert head.status_code == 206
+        assert head.content == b""
+        assert head.headers["content-length"] == "100"
+
+    origin(scenario)
+
+
+def test_memory_lru_evicts_least_recently_used():
+    from services.cache import ObjectCache
+
+    async def scenario():
+        cache = ObjectCache(memory_bytes=300, max_object_bytes=200, disk_dir=None, disk_bytes=0)
+        await cache.put("a", b"a" * 100)
+        await cache.put("b", b"b" * 100)
+        await cache.put("c", b"c" * 100)
+        # reading "a" makes "b" the oldest
+        assert await cache.get("a") is not None
+        await cache.put("d", b"d" * 100)
+        assert await cache.get("b") is None
+        assert [await cache.get(key) is not None for key in "acd"] == [True, True, True]
+
+        # too big for memory, and no disk tier to take it
+        await cache.put("big", b"x" * 250)
+        assert await cache.get("big") is None
+        assert not cache.fits(250)
+
+    asyncio.run(scenario())
+
+
+def test_disk_tier_evicts_oldest_first_down_to_low_water(tmp_path):
+    from services.cache import ObjectCache
+
+    async def scenario():
+        cache = ObjectCache(memory_bytes=0, max_object_bytes=0, disk_dir=str(tmp_path), disk_bytes=1000)
+        for i, key in enumerate("abc"):
+            await cache.put(key, key.encode() * 300)
+            # mtimes a second apart, the order eviction goes by
+            os.utime(cache._path(key), (1000 + i, 1000 + i))
+        # reading "a" bumps it past the others
+        assert await cache.get("a") == b"a" * 300
+
+        await cache.put("d", b"d" * 300)
+        kept = [key for key in "abcd" if os.path.exists(cache._path(key))]
+        # 1200 bytes over a 1000 budget goes down to 900, oldest first
+        assert kept == ["a", "c", "d"]
+        assert cache.fits(1000) and not cache.fits(1001)
+
+    asyncio.run(scenario())
+
+
+def test_served_object_comes_back_from_disk_after_leaving_memory(origin, cache):
+    from api.routes import serve
+    from services.cache import object_cache_key
+
+    async def scenario(http):
+        await http.get("/i/img")
+        key = object_cache_key("img", len(DATA), "image/png")
+        cache._memory.clear()
+        cache._memory_used = 0
+        assert os.path.exists(cache._path(key))
+
+        # storage no longer has it, so this can only come from the disk tier
+        await serve.storage_service.delete_file("img")
+        assert (await http.get("/i/img")).content == DATA
+
+    origin(scenario)
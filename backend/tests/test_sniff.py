@@ -0,0 +1,91 @@
+import io
+import zlib
+import struct
+import pytest
+from PIL import Image as PilImage
+from services.sniff import HEAD_BYTES, MAX_HEAD_BYTES, ImageInfo, probe
+
+
+def encode(frames, fmt: str, **options) -> bytes:
+    output = io.BytesIO()
+    if len(frames) > 1:
+        options.update(save_all=True, append_images=frames[1:])
+    frames[0].save(output, format=fmt, **options)
+    return output.getvalue()
+
+
+def noise(size, count: int = 1, mode: str = "RGB"):
+    return [PilImage.effect_noise(size, 30 + i * 10).convert(mode) for i in range(count)]
+
+
+def test_jpeg_past_large_exif_and_icc():
+    exif = PilImage.Exif()
+    # ImageDescription, close to the 64 KB an APP1 segment can hold
+    exif[0x010E] = "x" * 60000
+    # an ICC profile this size is split over several APP2 segments
+    data = encode(noise((640, 480)), "JPEG", exif=exif.tobytes(), icc_profile=b"\0" * 200_000)
+
+    assert probe(data[:HEAD_BYTES]) is None
+    info = probe(data[:MAX_HEAD_BYTES])
+    assert (info.format, info.width, info.height, info.frames, info.animated) == ("JPEG", 640, 480, 1, False)
+    assert info.exact
+
+
+def test_png_and_apng():
+    assert probe(encode(noise((300, 200)), "PNG")) == ImageInfo("PNG", 300, 200, 1, False)
+    assert probe(encode(noise((300, 200), 3), "PNG", duration=100)) == ImageInfo("PNG", 300, 200, 3, True)
+
+
+def test_png_dimensions_come_from_ihdr_alone():
+    # a 50000x50000 PNG (2.5 gigapixels) announces itself in the first 33 bytes
+    ihdr = struct.pack(">IIBBBBB", 50000, 50000, 8, 2, 0, 0, 0)
+    chunk = struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    info = probe(b"\x89PNG\r\n\x1a\n" + chunk)
+    assert (info.width, info.height) == (50000, 50000)
+    assert info.pixels == 2_500_000_000
+    # the frame count needs the first IDAT or acTL, which isn't there
+    assert info.frames is None
+
+
+def test_gif():
+    data = encode(noise((120, 80), 4, "P"), "GIF", duration=50, loop=0)
+    assert probe(data) == ImageInfo("GIF", 120, 80, 4, True)
+    assert probe(encode(noise((120, 80), 1, "P"), "GIF")) == ImageInfo("GIF", 120, 80, 1, False)
+
+    # cut short: the frames seen so far still say it's animated, the count is unknown
+    truncated = probe(data[:len(data) // 2])
+    assert truncated.animated and truncated.frames is None
+
+
+# simple lossy (VP8), lossless (VP8L), and extended (VP8X) for alpha with lossy
+@pytest.mark.parametrize("mode, lossless", [("RGB", False), ("RGB", True), ("RGBA", False)])
+def test_static_webp(mode, lossless):
+    img = noise((321, 123), mode=mode)[0]
+    if mode == "RGBA":
+        # an alpha channel that's actually used, an opaque one gets dropped
+        img.putalpha(PilImage.linear_gradient("L").resize(img.size))
+    data = encode([img], "WEBP", lossless=lossless)
+    assert data[12:16] == {("RGB", False): b"VP8 ", ("RGB", True): b"VP8L", ("RGBA", False): b"VP8X"}[mode, lossless]
+    assert probe(data) == ImageInfo("WEBP", 321, 123, 1, False)
+
+
+def test_animated_webp():
+    data = encode(noise((200, 100), 5), "WEBP", duration=80, loop=0)
+    assert probe(data) == ImageInfo("WEBP", 200, 100, 5, True)
+    assert probe(data[:len(data) // 2]) == ImageInfo("WEBP", 200, 100, None, True)
+
+
+def test_heif_size_is_an_upper_bound():
+    pillow_heif = pytest.importorskip("pillow_heif")
+    pillow_heif.register_heif_opener()
+
+    info = probe(encode(noise((1234, 567)), "HEIF"))
+    assert info.format == "HEIF"
+    assert not info.exact
+    # HEVC pads the coded size to whole blocks, 567 rows can come back as 568
+    assert 1234 <= info.width < 1234 + 64
+    assert 567 <= info.height < 567 + 64
+
+
+def test_unknown_bytes():
+    assert probe(b"not an image" * 100) is None
@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import event, insert, select, update
+
+# against the Postgres in DATABASE_URL (see conftest.py)
+
+
+async def add_images(rows: list) -> None:
+    # (filename, object key) pairs
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(Image).values([
+            {
+                "filename": filename,
+                "object_url": f"s3://{object_key}",
+                "size_bytes": 1000,
+                "mime_type": "image/png",
+                "ip_address": "127.0.0.1",
+                "is_processed": False,
+            }
+            for filename, object_key in rows
+        ]))
+        await session.commit()
+
+
+async def image_rows() -> dict:
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(
+            Image.filename, Image.is_processed, Image.size_bytes, Image.mime_type, Image.variants, Image.thumbnail_url
+        ))
+        return {row.filename: tuple(row[1:]) for row in result.all()}
+
+
+@pytest.fixture
+def updates(schema):
+    # the UPDATE statements sent to the database while the test runs
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("UPDATE"):
+            statements.append(statement)
+
+    event.listen(schema.sync_engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(schema.sync_engine, "before_cursor_execute", record)
+
+
+def test_marks_within_the_interval_share_one_update(updates, run):
+    from services.status import StatusWriter
+
+    writer = StatusWriter(flush_interval=0.05, max_batch=100)
+
+    async def scenario():
+        await add_images([("a", "a"), ("b", "b")])
+        results = await asyncio.gather(
+            writer.mark_processed("a", size_bytes=10),
+            writer.mark_processed("b"),
+            # a second mark of the same object before the flush replaces the first
+            writer.mark_processed("a", size_bytes=20, mime_type="image/webp"),
+        )
+        assert results == [["a"], ["b"], ["a"]]
+        rows = await image_rows()
+        assert rows["a"][:3] == (True, 20, "image/webp")
+        assert rows["b"][:3] == (True, 1000, "image/png")
+
+    run(scenario)
+    assert len(updates) == 1
+
+
+def test_mixed_batch_of_variants_and_nulls(schema, run):
+    from services.status import StatusWriter
+
+    writer = StatusWriter(flush_interval=0.05, max_batch=100)
+    variants = {"thumb": "shared_thumb", "medium": "shared_medium"}
+
+    async def scenario():
+        # two deduplicated rows share "shared", the GIF is marked with nothing but done
+        await add_images([("first", "shared"), ("second", "shared"), ("anim", "anim")])
+        results = await asyncio.gather(
+            writer.mark_processed("shared", size_bytes=500, mime_type="image/webp", variants=variants, thumbnail="thumb"),
+            writer.mark_processed("anim"),
+        )
+        assert sorted(results[0]) == ["first", "second"]
+        assert results[1] == ["anim"]
+
+        rows = await image_rows()
+        for filename in ("first", "second"):
+            # each row's thumbnail hangs off its own filename
+            assert rows[filename] == (True, 500, "image/webp", variants, f"http://localhost:8000/i/{filename}_thumb")
+        assert rows["anim"] == (True, 1000, "image/png", None, None)
+
+    run(scenario)
+
+
+def test_full_batch_flushes_without_waiting(schema, run):
+    from services.status import StatusWriter
+
+    writer = StatusWriter(flush_interval=3600, max_batch=2)
+
+    async def scenario():
+        await add_images([("a", "a"), ("b", "b")])
+        results = await asyncio.wait_for(
+            asyncio.gather(writer.mark_processed("a"), writer.mark_processed("b")), timeout=5
+        )
+        assert results == [["a"], ["b"]]
+
+    run(scenario)
+
+
+def test_close_flushes_what_is_pending(schema, run):
+    from services.status import StatusWriter
+
+    writer = StatusWriter(flush_interval=3600, max_batch=100)
+
+    async def scenario():
+        await add_images([("a", "a")])
+        marked = asyncio.create_task(writer.mark_processed("a", size_bytes=5))
+        await asyncio.sleep(0)
+        assert not marked.done()
+
+        await writer.close()
+        assert await marked == ["a"]
+        assert (await image_rows())["a"][:2] == (True, 5)
+
+    run(scenario)
+
+
+def test_rows_gone_or_deleted_come_back_empty(schema, run):
+    from db.session import AsyncSessionLocal
+    from models.image import Image
+    from services.status import StatusWriter
+
+    writer = StatusWriter(flush_interval=0.01, max_batch=100)
+
+    async def scenario():
+        await add_images([("a", "a")])
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Image).values(deleted_at=datetime.now(timezone.utc)))
+            await session.commit()
+        assert await writer.mark_processed("a") == []
+        assert await writer.mark_processed("missing") == []
+
+    run(scenario)
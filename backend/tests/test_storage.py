@@ -0,0 +1,96 @@
+import io
+import asyncio
+import pytest
+
+pytest.importorskip("moto.server")
+
+
+@pytest.fixture(params=["boto3", "aiobotocore"])
+def storage(request, bucket):
+    from services.storage import StorageService, AioStorageService
+
+    return StorageService() if request.param == "boto3" else AioStorageService()
+
+
+def run(service, coro_fn):
+    # aiobotocore clients are bound to the loop they were created on, so each test runs on a single loop
+    async def main():
+        try:
+            return await coro_fn()
+        finally:
+            await service.close()
+    return asyncio.run(main())
+
+
+def test_put_get_delete(storage):
+    async def scenario():
+        await storage.check()
+        await storage.upload_file(io.BytesIO(b"hello"), "a.txt", "text/plain")
+        assert await storage.download_file("a.txt") == b"hello"
+        await storage.delete_file("a.txt")
+        with pytest.raises(Exception):
+            await storage.download_file("a.txt")
+
+    run(storage, scenario)
+
+
+def test_open_stream_full_and_ranged(storage):
+    from services.storage import GET_CHUNK_SIZE
+
+    data = bytes(range(256)) * (GET_CHUNK_SIZE // 256 * 3)
+
+    async def scenario():
+        await storage.upload_file(io.BytesIO(data), "stream.bin", "application/octet-stream")
+
+        stream = await storage.open_stream("stream.bin")
+        assert (stream.length, stream.total) == (len(data), len(data))
+        chunks = [chunk async for chunk in stream.chunks()]
+        assert len(chunks) > 1
+        assert b"".join(chunks) == data
+
+        stream = await storage.open_stream("stream.bin", (100, 299))
+        assert (stream.length, stream.total) == (200, len(data))
+        assert b"".join([chunk async for chunk in stream.chunks()]) == data[100:300]
+
+        # a stream that's never read still gives its connection back
+        (await storage.open_stream("stream.bin")).close()
+
+    run(storage, scenario)
+
+
+def test_delete_files_spans_batches(storage):
+    from services.storage import MAX_DELETE_BATCH
+
+    keys = [f"k{i}" for i in range(MAX_DELETE_BATCH + 5)]
+
+    async def scenario():
+        await asyncio.gather(*(storage.upload_file(io.BytesIO(b"x"), key, "text/plain") for key in keys[:10]))
+        # missing keys count as deleted for S3, so the whole set goes through without errors
+        assert await storage.delete_files(keys) == []
+        with pytest.raises(Exception):
+            await storage.download_file(keys[0])
+
+    run(storage, scenario)
+
+
+def test_multipart_writer(storage, monkeypatch):
+    from core.config import settings
+    from services.storage import MIN_PART_SIZE
+
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", MIN_PART_SIZE)
+    data = bytes(range(256)) * (MIN_PART_SIZE * 2 // 256 + 1000)
+
+    async def scenario():
+        writer = storage.multipart_writer("big.bin", "application/octet-stream")
+        for i in range(0, len(data), 1024 * 1024):
+            await writer.write(data[i:i + 1024 * 1024])
+        await writer.complete()
+        assert writer.size == len(data)
+        assert await storage.download_file("big.bin") == data
+
+        small = storage.multipart_writer("small.bin", "application/octet-stream")
+        await small.write(b"tiny")
+        await small.complete()
+        assert await storage.download_file("small.bin") == b"tiny"
+
+    run(storage, scenario)
@@ -0,0 +1,78 @@
+import signal
+import asyncio
+import logging
+from services.jobs import ProcessingJob, claim_jobs, fail_job
+from services.processing import process_image_and_update_db
+from services.storage import storage_service
+from services.executor import processing_executor
+from services.cloudflare import close_client
+from services.status import status_writer
+from core.config import settings
+from core.monitoring import serve_metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("worker")
+
+# Runs the durable processing queue (PROCESSING_MODE=queue). Any number of these can run on any
+# number of hosts against the same database; claims use SKIP LOCKED so they never share a job.
+
+
+async def run_job(job: ProcessingJob):
+    try:
+        skip_download = job.mime_type == "image/gif" and not settings.TRANSCODE_GIFS
+        source = None if skip_download else await storage_service.download_file(job.filename)
+        await process_image_and_update_db(job.image_id, source, job.filename, job.mime_type)
+    except Exception as e:
+        await fail_job(job, f"{type(e).__name__}: {e}")
+
+
+async def run_worker(stop: asyncio.Event):
+    in_flight: set[asyncio.Task] = set()
+
+    while not stop.is_set():
+        free = settings.WORKER_CONCURRENCY - len(in_flight)
+        jobs = []
+        if free > 0:
+            try:
+                jobs = await claim_jobs(free)
+            except Exception as e:
+                logger.error(f"Failed to claim jobs: {e}")
+
+        for job in jobs:
+            task = asyncio.create_task(run_job(job))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if not jobs:
+            try:
+                await asyncio.wait_for(stop.wait(), settings.WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        elif len(in_flight) >= settings.WORKER_CONCURRENCY:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+    if in_flight:
+        logger.info(f"Waiting for {len(in_flight)} in-flight jobs")
+        await asyncio.wait(in_flight)
+
+
+async def main():
+    logger.info(f"Starting processing worker, concurrency={settings.WORKER_CONCURRENCY}")
+    serve_metrics(settings.WORKER_METRICS_PORT)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await run_worker(stop)
+    finally:
+        await processing_executor.shutdown()
+        await status_writer.close()
+        await close_client()
+        await storage_service.close()
+        logger.info("Processing worker stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())